@@ -1,120 +1,168 @@
-import json
+import os
+import time
 import logging
-import datetime
+import anomaly_rules
+from batch_codec import expand_event, is_multi, timestamp_to_ms
+from co2_detector import StreamingDetector, new_state
+from state_store import create_store, shard
+from topology import get_topology
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# "stream" = streaming spike/dip/level shift detector like the Azure ASA query (co2_detector.py)
+# plus the fixed limit, "threshold" = only the fixed 2000 ppm limit like before
+CO2_DETECTOR = os.environ.get('CO2_DETECTOR', 'stream')
+co2_detector = StreamingDetector()
+# detector state per room, one shard per gateway ("co2/<gateway>", state_store.py).
+# The state lives in the warm container and is only written back every CO2_PERSIST_READINGS readings
+# or CO2_PERSIST_SECONDS seconds of a shard, all rooms of the shard in one write. A new container
+# starts from the stored state, a container that dies loses at most these last readings.
+CO2_PERSIST_READINGS = int(os.environ.get('CO2_PERSIST_READINGS', '50'))
+CO2_PERSIST_SECONDS = float(os.environ.get('CO2_PERSIST_SECONDS', '60'))
+CO2_STATE_KEY = 'rooms'
+state = create_store() if CO2_DETECTOR == 'stream' else None
+co2_shards = {}   # shard -> {'rooms': room -> detector state, 'readings': not written yet, 'saved': monotonic time}
+
 def lambda_handler(event, context):
     logger.info("Checking for anomalies")
 
+    anomaly_updates = []
+    detected_anomalies = []
+
+    # a batch envelope or a list of readings holds many samples, a slam in any of them counts
+    topology = get_topology()
+    batched = is_multi(event)
+    co2_readings = {}   # gateway -> room -> readings, rooms of every gateway in the event
+    gateways = set()
+    for sample in expand_event(event):
+        door_id = topology.door_of(sample)
+        if door_id is None:
+            continue
+        gateway_id = topology.gateway_id(sample)
+        gateways.add(gateway_id)
+        devices = topology.devices_of(sample)
+        found, reported = len(anomaly_updates), len(detected_anomalies)
+        detect_sample_anomalies(sample, door_id, devices, anomaly_updates, detected_anomalies)
+        # the gateway decides the state shard of the notification (Notification.py)
+        for anomaly in detected_anomalies[reported:]:
+            anomaly['gateway'] = gateway_id
+        sample_ms = timestamp_to_ms(sample['door_timestamp']) if batched and sample.get('door_timestamp') else None
+        if sample_ms is not None:
+            # timestream needs a time per sample, otherwise they all get the same time
+            for update in anomaly_updates[found:]:
+                update['timestamp'] = sample_ms
+        collect_co2_readings(sample, devices, sample_ms, anomaly_updates[found:],
+                             co2_readings.setdefault(gateway_id, {}))
+
+    if CO2_DETECTOR == 'stream':
+        for gateway_id, rooms in co2_readings.items():
+            shard_id = topology.shard_id(gateway_id)
+            for room_key, readings in rooms.items():
+                if readings:
+                    detect_co2_stream(gateway_id, shard_id, room_key, readings, anomaly_updates, detected_anomalies)
+            save_co2_shard(shard_id)
+
+    logger.info(f"Found {len(detected_anomalies)} anomalies")
+    return {
+        'anomalyUpdates': anomaly_updates,
+        'anomalies': detected_anomalies,
+        'gateways': sorted(gateways)
+    }
+
+def detect_sample_anomalies(event, door_id, devices, anomaly_updates, detected_anomalies):
     # get data
     door_info = event.get('doorInfo', {})
     angle = door_info.get('angle', 0)
     gyro = door_info.get('gyro', 0)
     magnet = door_info.get('magnet', False)
-    rooms_info = event.get('roomsInfo', {})
-    room1_co2 = rooms_info.get('Room1', {}).get('co2', 0)
-    room2_co2 = rooms_info.get('Room2', {}).get('co2', 0)
-
-    anomaly_updates = []
-    detected_anomalies = []
 
-    # door slam detection
-    if abs(gyro) > 65:
-        anomaly_updates.append({
-            "entityId": "Door",
-            "componentName": "DoorComponents",
-            "property": "slammedAnomaly",
-            "value": "slammed",
-            "valueType": "stringValue"
-        })
-        
-        detected_anomalies.append({
-            'entity': 'Door',
-            'type': 'door_slam',
-            'details': {
-                'gyro': gyro,
-                'timestamp': datetime.datetime.utcnow().isoformat()
-            }
-        })
-        
-        logger.info(f"Door slammed detected: gyro={gyro}")
-
-    # sensor conflict detection (magnet and angle mismatch)
-    conflict_detected = False
-    if magnet and (angle > 5 or angle < -5):
-        # magnet says closed but angle says open
-        conflict_detected = True
-    elif not magnet and (-1 <= angle <= 1):
-        # magnet says open but angle says closed
-        conflict_detected = True
-        
-    if conflict_detected:
-        anomaly_updates.append({
-            "entityId": "Door",
-            "componentName": "DoorComponents",
-            "property": "conflictAnomaly",
-            "value": "conflict",
-            "valueType": "stringValue"
-        })
-        
-        detected_anomalies.append({
-            'entity': 'Door',
-            'type': 'sensor_conflict',
-            'details': {
-                'magnet': magnet,
-                'angle': angle,
-                'timestamp': datetime.datetime.utcnow().isoformat()
-            }
-        })
-        
-        logger.info(f"Sensor conflict detected: magnet={magnet}, angle={angle}")
+    # door slam and sensor conflict (magnet and angle mismatch), rules in anomaly_rules.py
+    # are the same ones the Raspberry Pi gateway checks at sample rate
+    for update, anomaly in anomaly_rules.check_door(angle, gyro, magnet, entity=door_id):
+        anomaly_updates.append(update)
+        detected_anomalies.append(anomaly)
+        if anomaly['type'] == 'door_slam':
+            logger.info(f"Door slammed detected on {door_id}: gyro={gyro}")
+        else:
+            logger.info(f"Sensor conflict detected on {door_id}: magnet={magnet}, angle={angle}")
 
     # co2 spike detection (simple threshold for now, azure uses ML) 
     # ---> Could have used Kinesis Analytics instead for something similar like azure
-    if room1_co2 > 2000:
-        anomaly_updates.append({
-            "entityId": "Room1",
-            "componentName": "RoomSensorComponent",
-            "property": "airQualityState",
-            "value": "too_high",
-            "valueType": "stringValue"
-        })
-        
-        detected_anomalies.append({
-            'entity': 'Room1',
-            'type': 'co2_spike',
-            'details': {
-                'co2': room1_co2,
-                'timestamp': datetime.datetime.utcnow().isoformat()
-            }
-        })
-        
-        logger.info(f"CO2 spike in Room1: {room1_co2}")
-    
-    if room2_co2 > 2000:
-        anomaly_updates.append({
-            "entityId": "Room2",
-            "componentName": "RoomSensorComponent", 
-            "property": "airQualityState",
-            "value": "too_high",
-            "valueType": "stringValue"
-        })
-        
-        detected_anomalies.append({
-            'entity': 'Room2',
-            'type': 'co2_spike',
-            'details': {
-                'co2': room2_co2,
-                'timestamp': datetime.datetime.utcnow().isoformat()
-            }
-        })
-        
-        logger.info(f"CO2 spike in Room2: {room2_co2}")
+    for device, room_key in devices:
+        co2 = event.get(f'{device}_co2')
+        if anomaly_rules.is_co2_too_high(co2):
+            update, anomaly = anomaly_rules.co2_spike(room_key, co2)
+            anomaly_updates.append(update)
+            detected_anomalies.append(anomaly)
+            logger.info(f"CO2 spike in {room_key}: {co2}")
 
-    logger.info(f"Found {len(detected_anomalies)} anomalies")
-    return {
-        'anomalyUpdates': anomaly_updates,
-        'anomalies': detected_anomalies
-    }
\ No newline at end of file
+def collect_co2_readings(sample, devices, sample_ms, sample_updates, co2_readings):
+    # (device timestamp, co2, sample time, fixed limit already hit) per room for the streaming detector
+    flagged = {update['entityId'] for update in sample_updates if update.get('property') == 'airQualityState'}
+    for device, room_key in devices:
+        co2 = sample.get(f'{device}_co2')
+        if co2 is None:
+            continue
+        device_timestamp = sample.get(f'{device}_timestamp')
+        if not device_timestamp or device_timestamp.startswith('0000'):
+            device_timestamp = None  # ESP32 without NTP time, every message counts as a new reading
+        co2_readings.setdefault(room_key, []).append((device_timestamp, co2, sample_ms, room_key in flagged))
+
+def load_co2_shard(shard_id):
+    # detector states of a shard, read once per container
+    if shard_id not in co2_shards:
+        rooms = {}
+        try:
+            items = state.items(shard('co2', shard_id))
+            if CO2_STATE_KEY in items:
+                rooms = dict(items[CO2_STATE_KEY][0])
+            else:
+                # written by the older layout, one key per room
+                rooms = {room_key: value for room_key, (value, version) in items.items()}
+        except Exception as e:
+            logger.error(f"CO2 detector state of shard {shard_id} not available, starting empty: {e}")
+        co2_shards[shard_id] = {'rooms': rooms, 'readings': 0, 'saved': time.monotonic()}
+    return co2_shards[shard_id]
+
+def save_co2_shard(shard_id, force=False):
+    co2_shard = co2_shards.get(shard_id)
+    if co2_shard is None or not co2_shard['readings']:
+        return
+    if not force and co2_shard['readings'] < CO2_PERSIST_READINGS and \
+            time.monotonic() - co2_shard['saved'] < CO2_PERSIST_SECONDS:
+        return
+
+    rooms = {room_key: dict(detector_state) for room_key, detector_state in co2_shard['rooms'].items()}
+
+    def merge(current):
+        # rooms only another container knows are kept, the rooms of this container win
+        return dict(current or {}, **rooms)
+
+    try:
+        state.update(shard('co2', shard_id), CO2_STATE_KEY, merge)
+    except Exception as e:
+        logger.error(f"CO2 detector state of shard {shard_id} not saved: {e}")
+        return
+    co2_shard['readings'] = 0
+    co2_shard['saved'] = time.monotonic()
+
+def detect_co2_stream(gateway_id, shard_id, room_key, readings, anomaly_updates, detected_anomalies):
+    co2_shard = load_co2_shard(shard_id)
+    detector_state = co2_shard['rooms'].setdefault(room_key, new_state())
+
+    found = []
+    for device_timestamp, co2, sample_ms, flagged in readings:
+        kind, score = co2_detector.update(detector_state, co2, device_timestamp)
+        if kind and not (flagged and kind == 'spike'):
+            found.append((kind, co2, score, device_timestamp, sample_ms))
+    co2_shard['readings'] += len(readings)
+
+    for kind, co2, score, device_timestamp, sample_ms in found:
+        update, anomaly = anomaly_rules.co2_anomaly(room_key, kind, co2, device_timestamp, round(score, 2))
+        if sample_ms is not None:
+            update['timestamp'] = sample_ms
+        anomaly['gateway'] = gateway_id
+        anomaly_updates.append(update)
+        detected_anomalies.append(anomaly)
+        logger.info(f"CO2 {kind} in {room_key}: {co2} (z={score:.1f})")
@@ -1,41 +1,30 @@
-import boto3
 import os
 import json
+import time
 import logging
 from datetime import datetime
-from botocore.exceptions import ClientError
+from state_store import create_store
+from suppression_index import SuppressionIndex
+from topology import get_topology
+from aws_clients import lazy_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sns = boto3.client('sns', region_name='eu-north-1')
-s3 = boto3.client('s3', region_name='eu-north-1')
+# created on first use (aws_clients.py), an invocation without anything to send never creates sns
+sns = lazy_client('sns', region_name='eu-north-1')
+s3 = lazy_client('s3', region_name='eu-north-1')
 
-def load_reported_anomalies(bucket, key):
-    try:
-        response = s3.get_object(Bucket=bucket, Key=key)
-        data = response['Body'].read().decode('utf-8')
-        return json.loads(data)
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            logger.info("No existing anomaly state file found in S3")
-            return {}
-        else:
-            raise
-
-def save_reported_anomalies(bucket, key, data):
-    s3.put_object(
-        Bucket=bucket,
-        Key=key,
-        Body=json.dumps(data, indent=2),
-        ContentType='application/json'
-    )
+# already reported anomalies, one key per "<entity>_<type>", and the pending digest,
+# both sharded per gateway (state_store.py)
+state = create_store(s3)
+suppression = SuppressionIndex(state)
 
 def lambda_handler(event, context):
     try:
         sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
         s3_bucket = 'bucket-for-lambda-function1'  # Hardcoded bucket name
-        s3_key = 'anomaly-state/reported_anomalies.json'
+        s3_key = 'anomaly-state/reported_anomalies.json'  # see state_store.S3_DOCUMENTS
 
         if not sns_topic_arn:
             return {'status': 'error', 'message': 'SNS_TOPIC_ARN not set'}
@@ -43,43 +32,44 @@ def lambda_handler(event, context):
             return {'status': 'error', 'message': 'S3_BUCKET_NAME not set'}
 
         anomalies = []
+        gateways = []
         if 'anomalies' in event:
             if isinstance(event['anomalies'], dict) and 'anomalies' in event['anomalies']:
                 anomalies = event['anomalies']['anomalies']
+                gateways = event['anomalies'].get('gateways', [])
             elif isinstance(event['anomalies'], list):
                 anomalies = event['anomalies']
 
-        if not anomalies:
+        # anomalies per state shard, every gateway of the event gets one even without anomalies
+        # so its resolved keys are noticed
+        topology = get_topology()
+        shards = {topology.shard_id(gateway_id): [] for gateway_id in gateways}
+        for anomaly in anomalies:
+            shards.setdefault(topology.shard_id(anomaly.get('gateway')), []).append(anomaly)
+        if not shards:
+            shards[None] = []
+
+        # cooldown, hysteresis and digest: see suppression_index.py
+        now = time.time()
+        to_notify = []
+        new_by_shard = {}
+        for shard_id, shard_anomalies in shards.items():
+            notify, current_keys = suppression.observe(shard_anomalies, now, shard_id)
+            suppression.resolve(now, current_keys, shard_id)
+            to_notify.extend(notify)
+            new_by_shard[shard_id] = suppression.digest(notify, now, shard_id)
+        suppression.sweep(now, topology.shard_ids(), skip=shards)
+        new_anomalies = [anomaly for shard_anomalies in new_by_shard.values() for anomaly in shard_anomalies]
+
+        if not anomalies and not new_anomalies:
             logger.info("No anomalies to notify about")
             return {'status': 'success', 'message': 'No anomalies to notify about'}
 
-        # load anomalies that already happeded
-        reported_anomalies = load_reported_anomalies(s3_bucket, s3_key)
-
-        new_anomalies = []
-        current_keys = set()
-
-        for anomaly in anomalies:
-            entity = anomaly.get('entity', 'Unknown')
-            anomaly_type = anomaly.get('type', 'Unknown')
-            key = f"{entity}_{anomaly_type}"
-            current_keys.add(key)
-
-            if key not in reported_anomalies:
-                new_anomalies.append(anomaly)
-                reported_anomalies[key] = True
-            else:
-                logger.info(f"Skipping already reported anomaly: {key}")
-
-        # remove anomalies from list once they don't happen anymore
-        for key in list(reported_anomalies.keys()):
-            if key not in current_keys:
-                del reported_anomalies[key]
-                logger.info(f"Anomaly resolved: {key}")
-
         if not new_anomalies:
+            if to_notify:
+                logger.info(f"{len(to_notify)} new anomalies wait for the next digest")
+                return {'status': 'success', 'message': f"Queued {len(to_notify)} new anomalies for the next digest"}
             logger.info("No new anomalies to notify about")
-            save_reported_anomalies(s3_bucket, s3_key, reported_anomalies)
             return {'status': 'success', 'message': 'No new anomalies to notify about'}
 
         # create SNS message
@@ -104,20 +94,27 @@ def lambda_handler(event, context):
                     message_parts.append(f"- Sensor conflict on {entity}: {value} at {timestamp}")
             elif anomaly_type == 'co2_spike':
                 message_parts.append(f"- CO2 spike in {entity}: {value} ppm at {timestamp}")
+            elif anomaly_type.startswith('co2_'):
+                kind = anomaly_type[4:].replace('_', ' ')
+                message_parts.append(f"- CO2 {kind} in {entity}: {details.get('co2', value)} ppm at {timestamp}")
             else:
                 message_parts.append(f"- Unknown anomaly type {anomaly_type} on {entity}: {value} at {timestamp}")
 
         message = "\n".join(message_parts)
         logger.info(f"Sending message:\n{message}")
 
-        response = sns.publish(
-            TopicArn=sns_topic_arn,
-            Message=message,
-            Subject=subject
-        )
-
-        # save updated anomaly list to s3
-        save_reported_anomalies(s3_bucket, s3_key, reported_anomalies)
+        try:
+            response = sns.publish(
+                TopicArn=sns_topic_arn,
+                Message=message,
+                Subject=subject
+            )
+        except Exception:
+            # not notified, the next invocation tries again
+            for shard_id, shard_anomalies in new_by_shard.items():
+                if shard_anomalies:
+                    suppression.requeue(shard_anomalies, shard_id)
+            raise
 
         return {
             'status': 'success',
@@ -1,6 +1,8 @@
 import json
 import logging
 import datetime
+from batch_codec import expand_event, is_multi, timestamp_to_ms
+from topology import get_topology
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -8,6 +10,42 @@ logger.setLevel(logging.INFO)
 def lambda_handler(event, context):
     logger.info("Processing door sensor data")
 
+    # a batch envelope or a list of readings (SQS, micro batch) holds many samples,
+    # every sample is processed and the last one of a door decides its current state
+    topology = get_topology()
+    batched = is_multi(event)
+    state = door_timestamp = None
+    doors = {}
+    door_updates = []
+    for sample in expand_event(event):
+        door_id = topology.door_of(sample)
+        if door_id is None:
+            continue
+        state, door_timestamp, updates = process_door_sample(sample, door_id)
+        # like ProcessRoomData and DetectAnomalies: a sample without its own timestamp keeps the write time
+        if batched and sample.get('door_timestamp'):
+            sample_ms = timestamp_to_ms(door_timestamp)
+            for update in updates:
+                update['timestamp'] = sample_ms
+        door_updates.extend(updates)
+        doors[door_id] = {
+            'doorState': state,
+            'lastDoorClosedTimestamp': door_timestamp if state == 'closed' else None
+        }
+
+    # return the results for the step function
+    # doorState / lastDoorClosedTimestamp = last sample, "doors" = every door of the event
+    response = {
+        'doorState': state,
+        'lastDoorClosedTimestamp': door_timestamp if state == 'closed' else None,
+        'doors': doors,
+        'doorUpdates': door_updates
+    }
+
+    logger.info(f"Door processing done: {state}")
+    return response
+
+def process_door_sample(event, door_id="Door"):
     # get the door sensor readings
     angle = event.get('angle', 0)
     gyro = event.get('gyro', 0)
@@ -22,39 +60,39 @@ def lambda_handler(event, context):
     else:
         state = 'partially_open'
     
-    logger.info(f"Door is {state} (angle={angle}, magnet={magnet})")
+    logger.info(f"{door_id} is {state} (angle={angle}, magnet={magnet})")
 
     door_updates = [
         {
-            "entityId": "Door",
+            "entityId": door_id,
             "componentName": "DoorComponents",
             "property": "doorState",
             "value": state,
             "valueType": "stringValue"
         },
         {
-            "entityId": "Door", 
+            "entityId": door_id, 
             "componentName": "DoorComponents",
             "property": "angle",
             "value": angle,
             "valueType": "doubleValue"
         },
         {
-            "entityId": "Door",
+            "entityId": door_id,
             "componentName": "DoorComponents", 
             "property": "gyro",
             "value": gyro,
             "valueType": "doubleValue"
         },
         {
-            "entityId": "Door",
+            "entityId": door_id,
             "componentName": "DoorComponents",
             "property": "magnet", 
             "value": magnet,
             "valueType": "booleanValue"
         },
         {
-            "entityId": "Door",
+            "entityId": door_id,
             "componentName": "DoorComponents",
             "property": "doorTimestamp",
             "value": door_timestamp,
@@ -62,12 +100,4 @@ def lambda_handler(event, context):
         }
     ]
 
-    # return the results for the step function
-    response = {
-        'doorState': state,
-        'lastDoorClosedTimestamp': door_timestamp if state == 'closed' else None,
-        'doorUpdates': door_updates
-    }
-
-    logger.info(f"Door processing done: {state}")
-    return response
\ No newline at end of file
+    return state, door_timestamp, door_updates
\ No newline at end of file
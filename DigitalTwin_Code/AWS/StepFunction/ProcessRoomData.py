@@ -1,116 +1,105 @@
 import json
 import logging
 import datetime
-import boto3
 from datetime import timezone
+from batch_codec import expand_event, is_multi, timestamp_to_ms
+from state_store import create_store, shard
+from topology import get_topology
+from aws_clients import lazy_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client('s3')
+s3 = lazy_client('s3')
 
-def load_motion_data():
+# last motion per room, one shard per gateway ("motion/<gateway>"), cached between warm invocations (state_store.py)
+state = create_store(s3)
+
+# occupancy timeouts in seconds, see calculate_occupancy
+OCCUPANCY_TIMEOUT = 10
+CLOSED_ROOM_TIMEOUT = 30
+
+def load_motion_data(shard_id=None):
     try:
-        response = s3.get_object(Bucket='bucket-for-lambda-function1', Key='motion-data.json')
-        data = json.loads(response['Body'].read())
         timestamps = {}
-        for room, timestamp_str in data.items():
+        for room, (timestamp_str, version) in state.items(shard('motion', shard_id)).items():
             timestamps[room] = datetime.datetime.fromisoformat(timestamp_str)
         return timestamps
     except:
         return {}
 
-def save_motion_data(timestamps):
-    data = {room: timestamp.isoformat() for room, timestamp in timestamps.items()}
-    s3.put_object(
-        Bucket='bucket-for-lambda-function1',
-        Key='motion-data.json',
-        Body=json.dumps(data)
-    )
+def save_motion_data(timestamps, rooms=None, shard_id=None):
+    # only the given rooms are written, each one on its own with compare and set,
+    # a newer timestamp written by another execution is kept
+    for room in rooms if rooms is not None else timestamps:
+        timestamp = timestamps[room]
+
+        def newer(current):
+            if current and datetime.datetime.fromisoformat(current) >= timestamp:
+                return current
+            return timestamp.isoformat()
+
+        state.update(shard('motion', shard_id), room, newer)
 
 def lambda_handler(event, context):
     logger.info("Processing room sensor data")
     
-    # load last timestamp from S3
-    last_motion_timestamps = load_motion_data()
+    # last motion timestamps of every gateway in the event, loaded on its first sample
+    motion_by_shard = {}
     
     # get door state info for occupancy logic
-    door_info = event.get('doorInfo', {})
-    door_state = door_info.get('doorState')
-    last_door_closed_timestamp = door_info.get('lastDoorClosedTimestamp')
-    
-    if isinstance(last_door_closed_timestamp, str):
-        last_door_closed_timestamp = datetime.datetime.fromisoformat(last_door_closed_timestamp.replace('Z', '+00:00'))
+    door_info = event.get('doorInfo', {}) if isinstance(event, dict) else {}
+    topology = get_topology()
     
     now = datetime.datetime.now(timezone.utc)
     rooms_info = {}
     room_updates = []
-    should_save = False
-
-    # loop through both rooms
-    for room_key in ['Room1', 'Room2']:
-        idx = '1' if room_key == 'Room1' else '2'
-        
-        temp = event.get(f'device_{idx}_temperature')
-        humidity = event.get(f'device_{idx}_humidity')
-        light = event.get(f'device_{idx}_light')
-        co2 = event.get(f'device_{idx}_co2')
-        motion = event.get(f'device_{idx}_motion', False)
-        timestamp_str = event.get(f'device_{idx}_timestamp')
-        
-        # update motion timestamp if detected -> for occupancy logic
-        if motion:
-            last_motion_timestamps[room_key] = now
-            should_save = True
-            logger.info(f"Motion in {room_key}")
-        
-        occupancy_state = calculate_occupancy(room_key, door_state, last_door_closed_timestamp, now, last_motion_timestamps)
-        
-        rooms_info[room_key] = {
-            'temperature': temp,
-            'humidity': humidity,
-            'light': light,
-            'co2': co2,
-            'occupancy': occupancy_state
-        }
-
-        for prop, value, vtype in [
-            ('temperature', temp, 'doubleValue'),
-            ('humidity', humidity, 'doubleValue'),
-            ('light', light, 'doubleValue'),
-            ('co2', co2, 'doubleValue')
-        ]:
-            if value is not None:
-                room_updates.append({
-                    'entityId': room_key,
-                    'componentName': 'RoomSensorComponent',
-                    'property': prop,
-                    'value': value,
-                    'valueType': vtype
-                })
-                
-        # add occupancy
-        room_updates.append({
-            'entityId': room_key,
-            'componentName': 'RoomSensorComponent',
-            'property': 'occupancy',
-            'value': occupancy_state,
-            'valueType': 'stringValue'
-        })
-        
-        # add timestamp
-        if timestamp_str:
-            room_updates.append({
-                'entityId': room_key,
-                'componentName': 'RoomSensorComponent',
-                'property': 'roomTimestamp',
-                'value': timestamp_str,
-                'valueType': 'stringValue'
-            })
+    motion_rooms = {}   # shard -> rooms with new motion
+
+    # a batch envelope holds many samples. The ESP32s only send every few seconds,
+    # so a room reading is only processed again when its timestamp changed
+    batched = is_multi(event)
+    seen_room_timestamps = {}
+
+    for sample in expand_event(event):
+        shard_id = topology.shard_id(topology.gateway_id(sample))
+        if shard_id not in motion_by_shard:
+            motion_by_shard[shard_id] = load_motion_data(shard_id)
+        last_motion_timestamps = motion_by_shard[shard_id]
+
+        # every room the gateway of this sample measures (topology.json)
+        for device, room_key in topology.devices_of(sample):
+            timestamp_str = sample.get(f'{device}_timestamp')
+
+            if batched:
+                if room_key in seen_room_timestamps and seen_room_timestamps[room_key] == timestamp_str:
+                    continue
+                seen_room_timestamps[room_key] = timestamp_str
+
+            motion = sample.get(f'{device}_motion', False)
+
+            # update motion timestamp if detected -> for occupancy logic
+            if motion:
+                last_motion_timestamps[room_key] = now
+                motion_rooms.setdefault(shard_id, set()).add(room_key)
+                logger.info(f"Motion in {room_key}")
+
+            room = topology.room(room_key)
+            door_state, last_door_closed_timestamp = room_door_state(door_info, room.get('door'))
+            occupancy_state = calculate_occupancy(room_key, room, door_state, last_door_closed_timestamp, now, last_motion_timestamps)
+            room_info, updates = process_room_sample(sample, room_key, device, occupancy_state)
 
-    # Save motion data back in S3 
-    if should_save:
-        save_motion_data(last_motion_timestamps)
+            if batched and sample.get('door_timestamp'):
+                sample_ms = timestamp_to_ms(sample['door_timestamp'])
+                for update in updates:
+                    update['timestamp'] = sample_ms
+
+            rooms_info[room_key] = room_info
+            room_updates.extend(updates)
+
+    # Save motion data back (S3 or DynamoDB, see state_store.py), every gateway to its own shard
+    for shard_id, rooms in motion_rooms.items():
+        save_motion_data(motion_by_shard[shard_id], rooms, shard_id)
 
     logger.info(f"Processed {len(room_updates)} room updates")
     return {
@@ -118,23 +107,84 @@ def lambda_handler(event, context):
         'roomUpdates': room_updates
     }
 
-def calculate_occupancy(room_key, door_state, last_door_closed_timestamp, now, last_motion_timestamps):
+def room_door_state(door_info, door_id):
+    # state of the door of a room: ProcessDoorData returns every door under "doors",
+    # a single door result only has doorState / lastDoorClosedTimestamp
+    door = door_info.get('doors', {}).get(door_id, door_info)
+    last_door_closed_timestamp = door.get('lastDoorClosedTimestamp')
+    if isinstance(last_door_closed_timestamp, str):
+        last_door_closed_timestamp = datetime.datetime.fromisoformat(last_door_closed_timestamp.replace('Z', '+00:00'))
+    return door.get('doorState'), last_door_closed_timestamp
+
+def process_room_sample(event, room_key, device, occupancy_state):
+    temp = event.get(f'{device}_temperature')
+    humidity = event.get(f'{device}_humidity')
+    light = event.get(f'{device}_light')
+    co2 = event.get(f'{device}_co2')
+    timestamp_str = event.get(f'{device}_timestamp')
+
+    room_info = {
+        'temperature': temp,
+        'humidity': humidity,
+        'light': light,
+        'co2': co2,
+        'occupancy': occupancy_state
+    }
+
+    room_updates = []
+    for prop, value, vtype in [
+        ('temperature', temp, 'doubleValue'),
+        ('humidity', humidity, 'doubleValue'),
+        ('light', light, 'doubleValue'),
+        ('co2', co2, 'doubleValue')
+    ]:
+        if value is not None:
+            room_updates.append({
+                'entityId': room_key,
+                'componentName': 'RoomSensorComponent',
+                'property': prop,
+                'value': value,
+                'valueType': vtype
+            })
+
+    # add occupancy
+    room_updates.append({
+        'entityId': room_key,
+        'componentName': 'RoomSensorComponent',
+        'property': 'occupancy',
+        'value': occupancy_state,
+        'valueType': 'stringValue'
+    })
+
+    # add timestamp
+    if timestamp_str:
+        room_updates.append({
+            'entityId': room_key,
+            'componentName': 'RoomSensorComponent',
+            'property': 'roomTimestamp',
+            'value': timestamp_str,
+            'valueType': 'stringValue'
+        })
+
+    return room_info, room_updates
+
+def calculate_occupancy(room_key, room, door_state, last_door_closed_timestamp, now, last_motion_timestamps):
     if room_key not in last_motion_timestamps:
         return "not_occupied"
     
     last_motion = last_motion_timestamps[room_key]
     seconds_since_motion = (now - last_motion).total_seconds()
     
-    if room_key == "Room1":
-        # room1 (enclosed room)
+    if room.get('occupancy') == "enclosed":
+        # enclosed room (Room1)
         if (door_state == "closed" and 
             last_door_closed_timestamp is not None and 
             last_motion > last_door_closed_timestamp):
             # if motion after door closed then use 30 second timeout
-            return "occupied" if seconds_since_motion <= 30 else "not_occupied"
+            return "occupied" if seconds_since_motion <= CLOSED_ROOM_TIMEOUT else "not_occupied"
         else:
             # if door open or no motion after close use 10 second timeout
-            return "occupied" if seconds_since_motion <= 10 else "not_occupied"
+            return "occupied" if seconds_since_motion <= OCCUPANCY_TIMEOUT else "not_occupied"
     else:
-        # room2 is hallway, always 10 seconds
-        return "occupied" if seconds_since_motion <= 10 else "not_occupied"
\ No newline at end of file
+        # hallway (Room2), always 10 seconds
+        return "occupied" if seconds_since_motion <= OCCUPANCY_TIMEOUT else "not_occupied"
\ No newline at end of file
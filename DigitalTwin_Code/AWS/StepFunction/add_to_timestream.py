@@ -1,12 +1,23 @@
-import boto3
 import os
 import time
 import logging
+from timestream_writer import TimestreamWriter
+from batch_codec import timestamp_to_ms
+from aws_clients import lazy_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-timestream = boto3.client('timestream-write', region_name='eu-central-1')
+timestream = lazy_client('timestream-write', region_name='eu-central-1')
+writer = TimestreamWriter(timestream)
+
+# "single" = one record per property (MeasureName = property) like before,
+# "multi"  = one multi-measure record per entity and reading (MeasureName = MULTI_MEASURE_NAME)
+RECORD_MODE = os.environ.get('TIMESTREAM_RECORD_MODE', 'single')
+MULTI_MEASURE_NAME = 'reading'
+
+# properties that hold the time the device measured the reading, used as the record time in multi mode
+SOURCE_TIMESTAMP_PROPERTIES = ('doorTimestamp', 'roomTimestamp')
 
 def lambda_handler(event, context):
     
@@ -14,7 +25,7 @@ def lambda_handler(event, context):
     table = os.environ.get('TIMESTREAM_TABLE_NAME', 'SensorReadings')
     
     updates = get_all_updates(event)   
-    records = prepare_records(updates)
+    records = prepare_multi_measure_records(updates) if RECORD_MODE == 'multi' else prepare_records(updates)
     write_to_timestream(database, table, records)
     
     return {"message": f"Successfully processed {len(updates)} sensor updates"}
@@ -24,6 +35,12 @@ def lambda_handler(event, context):
 def get_all_updates(event):
     
     updates = []
+
+    # several results at once (e.g. a list of pipeline outputs), one write for all of them
+    if isinstance(event, list):
+        for item in event:
+            updates.extend(get_all_updates(item))
+        return updates
     
     door_info = event.get('doorInfo', {})
     if door_info:
@@ -83,20 +100,66 @@ def prepare_records(updates):
     
     return records
 
+# multi measure: all properties of one entity/component from the same reading go into one record
+# with typed measures (DOUBLE, BOOLEAN, VARCHAR). The time is the device time (door_timestamp /
+# roomTimestamp), so late data is stored at the time it was measured
+def multi_measure_value(update):
+    value = update.get('value')
+    value_type = update.get('valueType', 'stringValue')
+    if value_type == 'doubleValue':
+        return {'Name': update.get('property'), 'Value': str(float(value)), 'Type': 'DOUBLE'}
+    if value_type == 'booleanValue':
+        return {'Name': update.get('property'), 'Value': 'true' if value else 'false', 'Type': 'BOOLEAN'}
+    return {'Name': update.get('property'), 'Value': str(value), 'Type': 'VARCHAR'}
+
+def source_time_ms(updates, fallback):
+    for update in updates:
+        if update.get('property') in SOURCE_TIMESTAMP_PROPERTIES:
+            try:
+                return timestamp_to_ms(update.get('value'))
+            except (TypeError, ValueError):
+                break  # e.g. ESP32 without NTP time: "0000-00-00T00:00:00.000Z"
+    return fallback
+
+def prepare_multi_measure_records(updates):
+
+    current_time = int(time.time() * 1000)
+
+    # a reading = the updates of one entity/component with the same sample time
+    # (batches set 'timestamp' per sample, a single message has none)
+    readings = {}
+    for update in updates:
+        if not isinstance(update, dict) or update.get('value') is None:
+            continue
+        key = (update.get('entityId'), update.get('componentName'), update.get('timestamp'))
+        readings.setdefault(key, []).append(update)
+
+    records = []
+    for (entity_id, component, sample_time), reading in readings.items():
+        record_time = source_time_ms(reading, sample_time or current_time)
+        measures = {}
+        for update in reading:
+            if update.get('property') not in SOURCE_TIMESTAMP_PROPERTIES:
+                measures[update.get('property')] = multi_measure_value(update)  # newest value wins
+        if not measures:
+            continue
+
+        records.append({
+            'Dimensions': [
+                {'Name': 'entityId', 'Value': entity_id},
+                {'Name': 'componentName', 'Value': component}
+            ],
+            'MeasureName': MULTI_MEASURE_NAME,
+            'MeasureValueType': 'MULTI',
+            'MeasureValues': list(measures.values()),
+            'Time': str(record_time),
+            'TimeUnit': 'MILLISECONDS'
+        })
+
+    return records
+
 def write_to_timestream(database, table, records):
-    
-    batch_size = 100
-    
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i + batch_size]
-        
-        try:
-            timestream.write_records(
-                DatabaseName=database,
-                TableName=table,
-                Records=batch
-            )
-            logger.info(f"{len(batch)} records sent to timesream")
-            
-        except Exception as e:
-            logger.error(f"Failed: {str(e)}")
+    # grouping, concurrent batches, retries and rejected records: see timestream_writer.py
+    if not records:
+        return None
+    return writer.write(database, table, records)
@@ -0,0 +1,69 @@
+import os
+import threading
+
+# boto3 clients of the lambdas, created on first use and shared by every handler in the container
+# (pipeline.py runs all of them in one process).
+# boto3 is only imported when the first client is needed, so a cold start that never calls AWS
+# (no anomalies, nothing to notify) does not pay for it. Handlers keep a module level name:
+#
+#   sns = lazy_client('sns', region_name='eu-north-1')
+#   sns.publish(...)      # boto3 is imported and the client created here, once
+#
+# One connection pool per client, sized for the parallel stages and the timestream writer
+# threads, with TCP keep-alive so warm invocations reuse the connections (the step function
+# sends a message every 0.5 s). See import_profile.py for the import time of every handler.
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '16'))
+CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '10'))
+MAX_ATTEMPTS = 3
+# services whose callers retry on their own: timestream_writer.py retries throttling with its own
+# jittered backoff (and counts the retries), botocore retrying underneath would multiply the attempts
+SERVICE_MAX_ATTEMPTS = {'timestream-write': 1}
+
+_clients = {}   # (service, region) -> client
+_lock = threading.Lock()
+
+
+def _config(service_name):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries={'max_attempts': SERVICE_MAX_ATTEMPTS.get(service_name, MAX_ATTEMPTS), 'mode': 'standard'}
+    )
+
+
+def client(service_name, region_name=None):
+    # the shared client of a service and region, created on the first call
+    key = (service_name, region_name)
+    existing = _clients.get(key)
+    if existing is not None:
+        return existing
+    # boto3 client creation is not thread safe, the parallel stages may ask at the same time
+    with _lock:
+        if key not in _clients:
+            import boto3
+            _clients[key] = boto3.client(service_name, region_name=region_name, config=_config(service_name))
+        return _clients[key]
+
+
+def reset():
+    # forget all clients, e.g. after local_stubs.install()
+    with _lock:
+        _clients.clear()
+
+
+class LazyClient:
+    # stands in for the client until an operation is called on it
+    def __init__(self, service_name, region_name=None):
+        self.service_name = service_name
+        self.region_name = region_name
+
+    def __getattr__(self, name):
+        return getattr(client(self.service_name, self.region_name), name)
+
+
+def lazy_client(service_name, region_name=None):
+    return LazyClient(service_name, region_name)
@@ -0,0 +1,84 @@
+import math
+from statistics import NormalDist
+
+# Streaming CO2 anomaly detection, the AWS counterpart of the Azure Stream Analytics query
+#   AnomalyDetection_SpikeAndDip(co2, 99, 120, 'spikesanddips')   (Azure Code/queryASA.sql)
+# confidence and history size mean the same here:
+#   - the baseline is an exponentially weighted mean/variance whose span is the history size
+#     (alpha = 2 / (history + 1)), so roughly the last 120 readings count
+#   - a reading is a spike/dip if it is outside the two sided confidence interval of the baseline
+#     (99% -> |z| > 2.576), no detection before history_size readings were seen
+# Level shifts (the CO2 stays higher/lower instead of one peak) are found with a CUSUM on the same z.
+# Every reading costs O(1) and the state per room is a small dict that can be stored as JSON.
+CONFIDENCE = 99
+HISTORY_SIZE = 120
+MODE = 'spikesanddips'      # or 'spikes', 'dips' like in ASA
+MIN_STD = 10.0              # ppm, sensor resolution. A flat signal would otherwise make every change an anomaly
+SHIFT_DRIFT = 0.5           # CUSUM allowance in standard deviations
+SHIFT_THRESHOLD = 8.0       # CUSUM decision limit in standard deviations
+
+
+def new_state():
+    return {'n': 0, 'mean': 0.0, 'var': 0.0, 'up': 0.0, 'down': 0.0, 'last': None}
+
+
+class StreamingDetector:
+    def __init__(self, confidence=CONFIDENCE, history_size=HISTORY_SIZE, mode=MODE, min_std=MIN_STD,
+                 shift_drift=SHIFT_DRIFT, shift_threshold=SHIFT_THRESHOLD):
+        self.alpha = 2.0 / (history_size + 1)
+        self.history_size = history_size
+        self.limit = NormalDist().inv_cdf(1 - (1 - confidence / 100.0) / 2)
+        self.spikes = mode in ('spikes', 'spikesanddips')
+        self.dips = mode in ('dips', 'spikesanddips')
+        self.min_std = min_std
+        self.shift_drift = shift_drift
+        self.shift_threshold = shift_threshold
+
+    def update(self, state, value, reading_id=None):
+        # adds one reading to the state (changed in place)
+        # returns (kind, z) with kind None, 'spike', 'dip', 'level_shift_up' or 'level_shift_down'
+        # reading_id: e.g. the device timestamp, the same reading is only counted once
+        if value is None or (reading_id is not None and reading_id == state.get('last')):
+            return None, 0.0
+        state['last'] = reading_id
+
+        n = state['n']
+        if n == 0:
+            state.update(n=1, mean=float(value), var=0.0, up=0.0, down=0.0)
+            return None, 0.0
+
+        std = max(math.sqrt(state['var']), self.min_std)
+        z = (value - state['mean']) / std
+        warm = n >= self.history_size
+
+        kind = None
+        if warm and self.spikes and z > self.limit:
+            kind = 'spike'
+        elif warm and self.dips and z < -self.limit:
+            kind = 'dip'
+
+        # level shift: deviations that add up over several readings. z is clipped to the
+        # confidence limit, so a single spike is not a shift. A shift moves the baseline to the new level
+        clipped_z = max(-self.limit, min(self.limit, z))
+        state['up'] = max(0.0, state['up'] + clipped_z - self.shift_drift)
+        state['down'] = min(0.0, state['down'] + clipped_z + self.shift_drift)
+        shift = None
+        if state['up'] > self.shift_threshold:
+            shift = 'level_shift_up'
+        elif state['down'] < -self.shift_threshold:
+            shift = 'level_shift_down'
+        if shift:
+            state.update(mean=float(value), up=0.0, down=0.0)
+            state['n'] = n + 1
+            return (shift if warm else None), z
+
+        # outliers only move the baseline as far as the confidence limit, so one spike
+        # does not hide the next one
+        clipped = state['mean'] + clipped_z * std
+        diff = clipped - state['mean']
+        alpha = max(self.alpha, 1.0 / (n + 1))   # plain average until the history is full
+        increment = alpha * diff
+        state['mean'] += increment
+        state['var'] = (1 - alpha) * (state['var'] + diff * increment)
+        state['n'] = n + 1
+        return kind, z
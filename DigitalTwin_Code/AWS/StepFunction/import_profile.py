@@ -0,0 +1,94 @@
+# Import time of every lambda handler, i.e. what a cold start costs before lambda_handler runs.
+# Every handler is imported in a fresh interpreter with python -X importtime, like a new container.
+#
+#   python3 import_profile.py                    # all handlers, 10 slowest modules each
+#   python3 import_profile.py --top 20 Notification
+#   python3 import_profile.py --clients          # also the first boto3 client per handler
+#
+# boto3 should not show up in the imports any more (aws_clients.py creates the clients on first use).
+# --clients measures that first use: importing boto3 and creating the client, which a cold
+# invocation pays the first time it calls AWS. It needs boto3 installed, no credentials.
+import os
+import sys
+import argparse
+import subprocess
+
+HANDLERS = ['ProcessDoorData', 'ProcessRoomData', 'DetectAnomalies', 'update_DoorTwin',
+            'Notification', 'add_to_timestream', 'pipeline']
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the module level clients of the handlers, see aws_clients.lazy_client
+CLIENT_CALL = """
+import time
+start = time.perf_counter()
+for name in dir(handler):
+    value = getattr(handler, name)
+    if type(value).__name__ == 'LazyClient':
+        value.meta
+print(f"CLIENTS {(time.perf_counter() - start) * 1000:.1f}")
+"""
+
+
+def profile(handler, clients=False):
+    # returns (total ms, {module: (self ms, cumulative ms)}, clients ms or None)
+    code = f"import time; start = time.perf_counter(); import {handler} as handler; " \
+           f"print(f'TOTAL {{(time.perf_counter() - start) * 1000:.1f}}')"
+    if clients:
+        code += "\n" + CLIENT_CALL
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'eu-central-1'),
+               SNS_TOPIC_ARN=os.environ.get('SNS_TOPIC_ARN', 'arn:aws:sns:eu-north-1:000000000000:profile'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=HERE, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+
+    total, clients_ms = None, None
+    for line in result.stdout.splitlines():
+        if line.startswith('TOTAL '):
+            total = float(line.split()[1])
+        elif line.startswith('CLIENTS '):
+            clients_ms = float(line.split()[1])
+    return total, modules, clients_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('handlers', nargs='*', default=HANDLERS)
+    parser.add_argument('--top', type=int, default=10, help="slowest modules (self time) per handler")
+    parser.add_argument('--clients', action='store_true', help="also create the boto3 clients of the handler")
+    args = parser.parse_args()
+
+    summary = []
+    for handler in args.handlers:
+        try:
+            total, modules, clients_ms = profile(handler, args.clients)
+        except RuntimeError as e:
+            print(f"{handler}: import failed: {e}\n")
+            continue
+        aws = sorted(name for name in modules if name.split('.')[0] in ('boto3', 'botocore'))
+        print(f"{handler}: {total:.1f} ms, {len(modules)} modules imported"
+              + (f", boto3/botocore imported: {len(aws)} modules" if aws else ""))
+        print(f"  {'self ms':>8} {'cum ms':>8}  module")
+        for name, (self_ms, cumulative_ms) in sorted(modules.items(), key=lambda m: -m[1][0])[:args.top]:
+            print(f"  {self_ms:8.1f} {cumulative_ms:8.1f}  {name}")
+        print()
+        summary.append((handler, total, len(modules), clients_ms))
+
+    print(f"{'handler':<20}{'import ms':>10}{'modules':>9}" + (f"{'clients ms':>12}" if args.clients else ""))
+    for handler, total, count, clients_ms in summary:
+        line = f"{handler:<20}{total:10.1f}{count:9d}"
+        if args.clients:
+            line += f"{clients_ms:12.1f}" if clients_ms is not None else f"{'-':>12}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+# Local stand-ins for the boto3 clients used by the lambdas, for benchmarks and for
+# running the handlers without an AWS account. Only the calls the handlers make are there.
+#
+#   import local_stubs
+#   local_stubs.install(latency_ms=20)   # before the handlers are imported
+#   import pipeline
+import io
+import re
+import sys
+import random
+import hashlib
+import time
+import types
+import threading
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    class ClientError(Exception):
+        # same constructor and .response as botocore's ClientError
+        def __init__(self, error_response, operation_name):
+            self.response = error_response
+            self.operation_name = operation_name
+            super().__init__(f"An error occurred ({error_response['Error']['Code']}) when calling the {operation_name} operation")
+
+
+class FakeClient:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        # count the call and wait like a network round trip would
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeS3(FakeClient):
+    def __init__(self, latency_ms=0.0):
+        super().__init__(latency_ms)
+        self.objects = {}
+
+    @staticmethod
+    def _etag(body):
+        return '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def get_object(self, Bucket, Key):
+        self._call('get_object')
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
+        body = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(body), 'ETag': self._etag(body)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._call('put_object')
+        with self._lock:
+            current = self.objects.get((Bucket, Key))
+            if (IfMatch is not None and (current is None or self._etag(current) != IfMatch)) or \
+                    (IfNoneMatch == '*' and current is not None):
+                raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'At least one of the pre-conditions you specified did not hold'}}, 'PutObject')
+            body = Body.encode() if isinstance(Body, str) else Body
+            self.objects[(Bucket, Key)] = body
+        return {'ETag': self._etag(body)}
+
+
+class FakeTwinMaker(FakeClient):
+    def __init__(self, latency_ms=0.0):
+        super().__init__(latency_ms)
+        self.entities = {}
+
+    def get_entity(self, workspaceId, entityId):
+        self._call('get_entity')
+        return {'entityId': entityId, 'components': self.entities.get(entityId, {})}
+
+    def update_entity(self, workspaceId, entityId, componentUpdates, **kwargs):
+        self._call('update_entity')
+        components = self.entities.setdefault(entityId, {})
+        for component_name, update in componentUpdates.items():
+            properties = components.setdefault(component_name, {}).setdefault('properties', {})
+            for property_name, property_update in update.get('propertyUpdates', {}).items():
+                properties[property_name] = {'value': property_update.get('value', {})}
+        return {'updateDateTime': time.time(), 'state': 'UPDATING'}
+
+
+class FakeSNS(FakeClient):
+    def __init__(self, latency_ms=0.0):
+        super().__init__(latency_ms)
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self._call('publish')
+        self.messages.append((TopicArn, Subject, Message))
+        return {'MessageId': f"local-{len(self.messages)}"}
+
+
+class FakeTimestreamWrite(FakeClient):
+    # keeps the newest version of every point, rejects conflicting values like timestream does.
+    # throttle_rate = share of calls that fail with ThrottlingException
+    def __init__(self, latency_ms=0.0, throttle_rate=0.0):
+        super().__init__(latency_ms)
+        self.throttle_rate = throttle_rate
+        self.records = []
+        self.points = {}   # (dimensions, measure, time) -> (value, version)
+        self._random = random.Random(1)
+
+    def write_records(self, DatabaseName, TableName, Records, CommonAttributes=None):
+        self._call('write_records')
+        if len(Records) > 100:
+            raise ClientError({'Error': {'Code': 'ValidationException', 'Message': 'Too many records'}}, 'WriteRecords')
+        with self._lock:
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'WriteRecords')
+            rejected = []
+            for index, record in enumerate(Records):
+                record = dict(CommonAttributes or {}, **record)
+                dimensions = tuple((d['Name'], d['Value']) for d in record.get('Dimensions', []))
+                key = (dimensions, record['MeasureName'], record['Time'])
+                value = record.get('MeasureValue', record.get('MeasureValues'))
+                version = record.get('Version', 1)
+                existing = self.points.get(key)
+                if existing and existing[0] != value and version <= existing[1]:
+                    rejected.append({'RecordIndex': index, 'ExistingVersion': existing[1],
+                                     'Reason': 'A record with the same time, dimensions and measure name but a different value exists'})
+                    continue
+                self.points[key] = (value, version)
+                self.records.append(record)
+        if rejected:
+            error = ClientError({'Error': {'Code': 'RejectedRecordsException', 'Message': 'One or more records have been rejected'}}, 'WriteRecords')
+            error.response['RejectedRecords'] = rejected
+            raise error
+        return {'RecordsIngested': {'Total': len(Records)}}
+
+
+class FakeDynamoDB(FakeClient):
+    # items are stored by their "pk" (and "sk") attribute, conditions may use
+    # attribute_not_exists(a), a = :v and a < :v joined with OR
+    _CLAUSE = re.compile(r"^attribute_not_exists\((\w+)\)$|^(#?\w+) (=|<) (:\w+)$")
+
+    def __init__(self, latency_ms=0.0):
+        super().__init__(latency_ms)
+        self.tables = {}
+
+    @staticmethod
+    def _key(item):
+        return (item['pk']['S'], item.get('sk', {}).get('S'))
+
+    @staticmethod
+    def _plain(value):
+        return float(value['N']) if 'N' in value else value.get('S')
+
+    def _check(self, current, condition, names, values):
+        if not condition:
+            return
+        for clause in condition.split(' OR '):
+            missing, name, operator, placeholder = self._CLAUSE.match(clause.strip()).groups()
+            if missing:
+                if current is None or missing not in current:
+                    return
+                continue
+            name = names.get(name, name)
+            if current is None or name not in current:
+                continue
+            left, right = self._plain(current[name]), self._plain(values[placeholder])
+            if (operator == '=' and left == right) or (operator == '<' and left < right):
+                return
+        raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'PutItem')
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        self._call('put_item')
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            current = table.get(self._key(Item))
+            self._check(current, ConditionExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {})
+            table[self._key(Item)] = dict(Item)
+        if ReturnValues == 'ALL_OLD' and current is not None:
+            return {'Attributes': dict(current)}
+        return {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        self._call('delete_item')
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            self._check(table.get(self._key(Key)), ConditionExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {})
+            table.pop(self._key(Key), None)
+        return {}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, **kwargs):
+        # only "pk = :pk"
+        self._call('query')
+        pk = ExpressionAttributeValues[':pk']['S']
+        with self._lock:
+            items = [dict(item) for key, item in self.tables.get(TableName, {}).items() if key[0] == pk]
+        return {'Items': items, 'Count': len(items)}
+
+
+FAKE_CLIENTS = {
+    's3': FakeS3,
+    'iottwinmaker': FakeTwinMaker,
+    'sns': FakeSNS,
+    'timestream-write': FakeTimestreamWrite,
+    'dynamodb': FakeDynamoDB
+}
+
+# one client per service, shared by all handlers like one AWS account would be
+clients = {}
+_latency_ms = 0.0
+
+
+def client(service_name, region_name=None, **kwargs):
+    if service_name not in clients:
+        clients[service_name] = FAKE_CLIENTS[service_name](_latency_ms)
+    return clients[service_name]
+
+
+def install(latency_ms=0.0):
+    # boto3.client returns the fakes from now on, latency_ms is added to every call
+    global _latency_ms
+    _latency_ms = latency_ms
+    clients.clear()
+    try:
+        import boto3
+        boto3.client = client
+    except ImportError:
+        sys.modules['boto3'] = types.SimpleNamespace(client=client)
+    if 'botocore.exceptions' not in sys.modules:
+        sys.modules['botocore'] = types.SimpleNamespace()
+        sys.modules['botocore.exceptions'] = types.SimpleNamespace(ClientError=ClientError)
+    if 'botocore.config' not in sys.modules:
+        try:
+            import botocore.config
+        except ImportError:
+            sys.modules['botocore.config'] = types.SimpleNamespace(Config=dict)
+    # clients created before belong to the last install
+    if 'aws_clients' in sys.modules:
+        sys.modules['aws_clients'].reset()
+
+
+def call_counts():
+    return {name: dict(fake.calls) for name, fake in clients.items()}
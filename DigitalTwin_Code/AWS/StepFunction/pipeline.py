@@ -0,0 +1,87 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import ProcessDoorData
+import ProcessRoomData
+import DetectAnomalies
+import update_DoorTwin
+import Notification
+import add_to_timestream
+from batch_codec import expand_event, is_multi
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Single lambda mode of the step function in Definiton.json.
+# The same handlers run as stages in one process, so one message is one invocation
+# instead of six lambdas and the state transitions in between.
+# Definiton.json still works, PipelineDefinition.json is the state machine for this mode.
+#
+#   ProcessDoorData | ProcessRoomData | DetectAnomalies     (in parallel, like ProcessingParallel)
+#   -> doorInfo / roomsInfo / anomalies                     (like PrepareUpdateData)
+#   -> update_DoorTwin | Notification                       (in parallel, like ParallelUpdates)
+#   -> add_to_timestream
+
+# the stages mostly wait for AWS calls, so threads help like the Parallel states do.
+# The pool is created once per container and reused by warm invocations
+PARALLEL_STAGES = os.environ.get('PIPELINE_PARALLEL', 'true').lower() == 'true'
+executor = ThreadPoolExecutor(max_workers=3) if PARALLEL_STAGES else None
+
+
+def run_stages(stages, event, context):
+    # run handlers on the same input, results in the same order as the branches
+    if executor is None:
+        return [stage(event, context) for stage in stages]
+    futures = [executor.submit(stage, event, context) for stage in stages]
+    return [future.result() for future in futures]
+
+
+def run_pipeline(event, context=None, timings=None):
+    # timings: optional dict, gets the milliseconds of every step
+    start = time.perf_counter()
+
+    # SQS / Kinesis records, lists and batch envelopes are decoded once here instead of in every stage.
+    # All readings are processed in one pass, TwinMaker gets the newest state and
+    # timestream the whole history
+    if is_multi(event):
+        event = {'readings': expand_event(event)}
+
+    processed = run_stages([
+        ProcessDoorData.lambda_handler,
+        ProcessRoomData.lambda_handler,
+        DetectAnomalies.lambda_handler
+    ], event, context)
+    processing_done = time.perf_counter()
+
+    prepared = {
+        'doorInfo': processed[0],
+        'roomsInfo': processed[1],
+        'anomalies': processed[2]
+    }
+    twin_result, notification_result = run_stages([
+        update_DoorTwin.lambda_handler,
+        Notification.lambda_handler
+    ], prepared, context)
+    updates_done = time.perf_counter()
+
+    # update_DoorTwin passes doorInfo, roomsInfo and anomalies through for timestream
+    result = add_to_timestream.lambda_handler(twin_result, context)
+    end = time.perf_counter()
+
+    if notification_result.get('status') == 'error':
+        logger.error(f"Notification failed: {notification_result.get('message')}")
+    if timings is not None:
+        timings['processing'] = (processing_done - start) * 1000
+        timings['updates'] = (updates_done - processing_done) * 1000
+        timings['timestream'] = (end - updates_done) * 1000
+        timings['total'] = (end - start) * 1000
+    return result
+
+
+def lambda_handler(event, context):
+    timings = {}
+    result = run_pipeline(event, context, timings)
+    logger.info("Pipeline done in {total:.1f} ms (processing {processing:.1f}, updates {updates:.1f}, timestream {timestream:.1f})".format(**timings))
+    return result
@@ -0,0 +1,180 @@
+# Local benchmark: per message latency of the step function (Definiton.json) vs the single
+# lambda pipeline (pipeline.py). boto3 is replaced by local_stubs.py, so no AWS account is needed.
+#   python3 pipeline_bench.py --messages 200 --aws-ms 5 --invoke-ms 15 --transition-ms 10
+#   python3 pipeline_bench.py --batch 25      # 25 messages per invocation as SQS records
+#
+# The step function mode runs Definiton.json with a small interpreter (Task, Parallel, Pass).
+# Every task is a lambda invocation: the input and output go through JSON like they do
+# between states, plus --invoke-ms. Every state adds --transition-ms.
+# These two overheads are estimates, measure them in the real account and pass them in.
+import os
+import re
+import json
+import time
+import logging
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import local_stubs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample_event(i):
+    # a single gateway message in the shape of the IoT rule
+    angle = 45.0 * (i % 4)
+    event = {
+        'door_timestamp': time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + f".{i % 1000:03d}Z",
+        'angle': angle,
+        'gyro': 80.0 if i % 50 == 0 else 3.0,
+        'magnet': angle == 0,
+        'doorInfo': {'angle': angle, 'gyro': 3.0, 'magnet': angle == 0},
+        'roomsInfo': {}
+    }
+    for idx in ('1', '2'):
+        event[f'device_{idx}_temperature'] = 21.5
+        event[f'device_{idx}_humidity'] = 40.0
+        event[f'device_{idx}_light'] = 250.0
+        event[f'device_{idx}_motion'] = i % 10 == 0
+        event[f'device_{idx}_co2'] = 650.0 + i % 30
+        event[f'device_{idx}_timestamp'] = event['door_timestamp']
+    return event
+
+
+################################   minimal state machine interpreter   ####################################
+_PATH_PART = re.compile(r"\.([A-Za-z_][\w]*)|\[(\d+)\]")
+
+
+def read_path(data, path):
+    for name, index in _PATH_PART.findall(path[1:]):
+        data = data[name] if name else data[int(index)]
+    return data
+
+
+def write_path(data, path, value):
+    if path == "$":
+        return value
+    result = dict(data)
+    result[path[2:]] = value  # only $.name is used in Definiton.json
+    return result
+
+
+class StepFunctionRunner:
+    def __init__(self, definition, handlers, invoke_ms=0.0, transition_ms=0.0):
+        self.definition = definition
+        self.handlers = handlers          # lambda function name -> handler
+        self.invoke = invoke_ms / 1000.0
+        self.transition = transition_ms / 1000.0
+        self.executor = ThreadPoolExecutor(max_workers=8)
+
+    def run(self, event, machine=None):
+        machine = machine or self.definition
+        state_name = machine['StartAt']
+        data = event
+        while True:
+            state = machine['States'][state_name]
+            if self.transition:
+                time.sleep(self.transition)
+            data = self.run_state(state, data)
+            if state.get('End'):
+                return data
+            state_name = state['Next']
+
+    def run_state(self, state, data):
+        kind = state['Type']
+        if kind == 'Task':
+            result = self.invoke_lambda(state['Resource'].rsplit(':', 1)[-1], data)
+        elif kind == 'Parallel':
+            futures = [self.executor.submit(self.run, data, branch) for branch in state['Branches']]
+            result = [future.result() for future in futures]
+        elif kind == 'Pass':
+            result = data
+            if 'Parameters' in state:
+                result = {key[:-2] if key.endswith('.$') else key: read_path(data, value) if key.endswith('.$') else value
+                          for key, value in state['Parameters'].items()}
+        else:
+            raise ValueError(f"State type {kind} is not supported")
+
+        if 'ResultPath' in state:
+            result = write_path(data, state['ResultPath'], result)
+        if 'OutputPath' in state:
+            result = read_path(result, state['OutputPath'])
+        return result
+
+    def invoke_lambda(self, name, data):
+        if self.invoke:
+            time.sleep(self.invoke)
+        payload = json.loads(json.dumps(data))
+        return json.loads(json.dumps(self.handlers[name](payload, None), default=str))
+
+
+################################   benchmark   ####################################
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def measure(name, run, invocations, messages):
+    # latency per invocation, throughput per message
+    latencies = []
+    start = time.perf_counter()
+    for event in invocations:
+        t = time.perf_counter()
+        run(event)
+        latencies.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - start
+    print(f"{name:14s} {statistics.mean(latencies):9.2f} {percentile(latencies, 50):9.2f} "
+          f"{percentile(latencies, 99):9.2f} {messages / total:10.1f}")
+
+
+def sqs_event(events):
+    return {'Records': [{'messageId': str(i), 'body': json.dumps(event)} for i, event in enumerate(events)]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--aws-ms", type=float, default=5.0, help="latency of every boto3 call")
+    parser.add_argument("--invoke-ms", type=float, default=15.0, help="overhead of a warm lambda invocation")
+    parser.add_argument("--transition-ms", type=float, default=10.0, help="overhead of a state transition")
+    parser.add_argument("--batch", type=int, default=1, help="messages per invocation (SQS records)")
+    args = parser.parse_args()
+
+    os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:eu-north-1:000000000000:local')
+    local_stubs.install(latency_ms=args.aws_ms)
+    logging.disable(logging.INFO)
+
+    import ProcessDoorData, ProcessRoomData, DetectAnomalies, update_DoorTwin, Notification, add_to_timestream
+    import pipeline
+
+    with open(os.path.join(HERE, 'Definiton.json')) as f:
+        definition = json.load(f)
+    runner = StepFunctionRunner(definition, {
+        'ProcessDoorData': ProcessDoorData.lambda_handler,
+        'ProcessRoomData': ProcessRoomData.lambda_handler,
+        'DetectAnomalies': DetectAnomalies.lambda_handler,
+        'update_DoorTwin': update_DoorTwin.lambda_handler,
+        'Notification': Notification.lambda_handler,
+        'add_to_timestream': add_to_timestream.lambda_handler
+    }, args.invoke_ms, args.transition_ms)
+
+    events = [sample_event(i) for i in range(args.messages)]
+    if args.batch > 1:
+        invocations = [sqs_event(events[i:i + args.batch]) for i in range(0, len(events), args.batch)]
+    else:
+        invocations = events
+
+    # both modes have to give the same result
+    assert runner.run(invocations[0]) == pipeline.run_pipeline(invocations[0]), "step function and pipeline differ"
+
+    print(f"{args.messages} messages in {len(invocations)} invocations, boto3 call {args.aws_ms} ms, "
+          f"invoke {args.invoke_ms} ms, transition {args.transition_ms} ms")
+    print(f"{'mode':14s} {'mean ms':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'msg/s':>10s}")
+    measure("step function", runner.run, invocations, args.messages)
+    measure("pipeline", pipeline.run_pipeline, invocations, args.messages)
+    print(f"boto3 calls: {local_stubs.call_counts()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+# Replay / load harness for the whole path gateway -> lambdas -> twin, without hardware or AWS.
+# Gateway messages in the exact shape aws_main.py publishes ({"local_data": ..., "remote_data": ...})
+# are generated (or replayed from a recording) and go through all handlers in this process,
+# boto3 is replaced by local_stubs.py. Reports throughput, p50/p99 per stage and allocations,
+# use it as the baseline before and after every performance change.
+#
+#   python3 replay_harness.py --messages 1000 --rate 2 --devices 2
+#   python3 replay_harness.py --record stream.jsonl        # keep the generated stream
+#   python3 replay_harness.py --replay stream.jsonl        # same stream again, e.g. after a change
+#   python3 replay_harness.py --mode stepfunction --batch 10 --report baseline.json
+#
+# The stream is deterministic: same --seed, --rate, --devices and --start give the same messages.
+# --rate is gateway messages per second of the stream (the timestamps), not of the replay.
+# Without --realtime the messages are fed as fast as the handlers take them (throughput),
+# with --realtime at the rate of the stream (latency under that load).
+# Devices map to rooms through topology.json, the readings of devices not listed there are in the payload but not processed.
+#
+# Allocations are measured with tracemalloc on the first --alloc-messages messages, which also warm up
+# the caches. Tracing makes everything slower, so throughput and latencies are from the rest of the stream.
+#
+# Recording format: one gateway message per line (JSON), like the MQTT payloads of the gateway.
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import calendar
+import threading
+import tracemalloc
+from datetime import datetime
+
+import local_stubs
+from pipeline_bench import StepFunctionRunner, percentile, sqs_event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HANDLERS = ['ProcessDoorData', 'ProcessRoomData', 'DetectAnomalies', 'update_DoorTwin', 'Notification', 'add_to_timestream']
+DEFAULT_START = "2025-01-01T08:00:00Z"
+DEVICE_INTERVAL = 2.0   # seconds between two readings of an ESP32
+SLAM_GYRO = 80.0
+
+
+def format_timestamp(seconds):
+    # same format as build_payload in gateway_runtime.py and the ESP32 timestamps
+    ms = int(round((seconds - int(seconds)) * 1000))
+    if ms == 1000:
+        seconds, ms = int(seconds) + 1, 0
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(int(seconds))) + f".{ms:03d}Z"
+
+
+################################   stream generator   ####################################
+class GatewayStream:
+    # a door that opens and closes (sometimes slams, sometimes the hall sensor disagrees)
+    # and ESP32 room sensors with slowly changing values, CO2 rising with people in the room
+    def __init__(self, rate=2.0, devices=2, seed=1, start=DEFAULT_START, device_interval=DEVICE_INTERVAL):
+        self.rng = random.Random(seed)
+        self.dt = 1.0 / rate
+        self.t = calendar.timegm(datetime.strptime(start, "%Y-%m-%dT%H:%M:%SZ").timetuple())
+        self.device_interval = device_interval
+        self.angle = 0.0
+        self.target = 0.0
+        self.hold = 5.0
+        self.speed = 0.0
+        self.devices = []
+        for i in range(1, devices + 1):
+            self.devices.append({
+                'key': f"device_{i}",
+                'next': self.t + self.rng.uniform(0, device_interval),
+                'co2': self.rng.uniform(450, 700),
+                'temperature': self.rng.uniform(20, 23),
+                'humidity': self.rng.uniform(35, 50),
+                'occupied': False,
+                'reading': None
+            })
+
+    def _door(self):
+        gyro = self.rng.gauss(0, 0.5)
+        if self.hold > 0:
+            self.hold -= self.dt
+        else:
+            step = min(self.speed * self.dt, abs(self.target - self.angle))
+            step = step if self.target > self.angle else -step
+            self.angle += step
+            gyro = step / self.dt
+            if abs(self.target - self.angle) < 1e-9:
+                if self.target == 0.0:
+                    self.target = self.rng.uniform(45, 95)
+                    self.speed = self.rng.uniform(30, 80)
+                    self.hold = self.rng.uniform(20, 120)
+                else:
+                    self.target = 0.0
+                    self.speed = SLAM_GYRO * 2 if self.rng.random() < 0.1 else self.rng.uniform(30, 60)
+                    self.hold = self.rng.uniform(5, 30)
+        magnet = self.angle < 2.0
+        if self.rng.random() < 0.002:
+            magnet = not magnet    # hall sensor glitch -> sensor conflict
+        return round(self.angle, 2), round(abs(gyro), 2), magnet
+
+    def _device(self, device):
+        if self.t < device['next']:
+            return device['reading']
+        device['next'] += self.device_interval
+        if self.rng.random() < 0.01:
+            device['occupied'] = not device['occupied']
+        target = 1400.0 if device['occupied'] else 450.0
+        device['co2'] += (target - device['co2']) * 0.01 + self.rng.gauss(0, 5)
+        co2 = device['co2'] + (self.rng.uniform(800, 1500) if self.rng.random() < 0.002 else 0.0)
+        device['temperature'] += self.rng.gauss(0, 0.02)
+        device['humidity'] += self.rng.gauss(0, 0.05)
+        device['reading'] = {
+            'temperature': round(device['temperature'], 2),
+            'humidity': round(device['humidity'], 2),
+            'light': round(self.rng.uniform(200, 400) if device['occupied'] else self.rng.uniform(0, 20), 1),
+            'motion': device['occupied'] and self.rng.random() < 0.3,
+            'co2': round(co2, 1),
+            'timestamp': format_timestamp(self.t)
+        }
+        return device['reading']
+
+    def next(self):
+        angle, gyro, magnet = self._door()
+        remote_data = {}
+        for device in self.devices:
+            reading = self._device(device)
+            # not connected yet: all fields None like ble_receiver.get_remote_data
+            remote_data[device['key']] = dict(reading) if reading else {
+                field: None for field in ('temperature', 'humidity', 'light', 'motion', 'co2', 'timestamp')}
+        message = {
+            'local_data': {'door_timestamp': format_timestamp(self.t), 'angle': angle, 'gyro': gyro, 'magnet': magnet},
+            'remote_data': remote_data
+        }
+        self.t += self.dt
+        return message
+
+    def take(self, count):
+        return [self.next() for _ in range(count)]
+
+
+def load_stream(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_stream(path, messages):
+    with open(path, 'w') as f:
+        for message in messages:
+            f.write(json.dumps(message) + "\n")
+
+
+################################   measurement   ####################################
+class StageTimer:
+    # wraps the handlers, collects the milliseconds of every call (the handlers may run in threads)
+    def __init__(self):
+        self.times = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, name, handler):
+        def timed(event, context):
+            start = time.perf_counter()
+            result = handler(event, context)
+            elapsed = (time.perf_counter() - start) * 1000
+            failed = isinstance(result, dict) and result.get('status') == 'error'
+            with self._lock:
+                self.times.setdefault(name, []).append(elapsed)
+                if failed:
+                    self.errors[name] = self.errors.get(name, 0) + 1
+            return result
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.times.clear()
+            self.errors.clear()
+
+    def summary(self):
+        return {name: {
+            'calls': len(times),
+            'mean_ms': sum(times) / len(times),
+            'p50_ms': percentile(times, 50),
+            'p99_ms': percentile(times, 99),
+            'errors': self.errors.get(name, 0)
+        } for name, times in self.times.items()}
+
+
+def install_handlers(mode, invoke_ms, transition_ms):
+    # returns (run(event), timer). The pipeline calls the handlers through their modules,
+    # so the timed versions are put there
+    import importlib
+    timer = StageTimer()
+    modules = {name: importlib.import_module(name) for name in HANDLERS}
+    handlers = {name: timer.wrap(name, module.lambda_handler) for name, module in modules.items()}
+
+    if mode == 'stepfunction':
+        with open(os.path.join(HERE, 'Definiton.json')) as f:
+            runner = StepFunctionRunner(json.load(f), handlers, invoke_ms, transition_ms)
+        return runner.run, timer
+
+    import pipeline
+    for name, module in modules.items():
+        module.lambda_handler = handlers[name]
+    return pipeline.run_pipeline, timer
+
+
+def invocations_of(messages, batch):
+    # one message per invocation like the IoT rule, or SQS batches of raw gateway messages
+    if batch <= 1:
+        return [[message] for message in messages]
+    return [messages[i:i + batch] for i in range(0, len(messages), batch)]
+
+
+def to_event(group, batch):
+    if batch <= 1:
+        # what the IoT rule makes out of one gateway message
+        from batch_codec import flatten_sample
+        return flatten_sample(group[0])
+    return sqs_event(group)
+
+
+def replay(run, groups, batch, realtime=False, rate=None, alloc=False):
+    # returns (seconds, latency per invocation in ms, allocation stats or None)
+    peaks = []
+    latencies = []
+    if alloc:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    sent = 0
+    for group in groups:
+        if realtime:
+            delay = start + sent / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        event = to_event(group, batch)
+        if alloc:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        run(event)
+        latencies.append((time.perf_counter() - t) * 1000)
+        if alloc:
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        sent += len(group)
+    seconds = time.perf_counter() - start
+
+    if not alloc:
+        return seconds, latencies, None
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    retained = [stat for stat in after.compare_to(before, 'filename') if stat.size_diff > 0]
+    return seconds, latencies, {
+        'messages': sum(len(group) for group in groups),
+        'peak_kb': peak / 1024,
+        'invocation_peak_kb_p50': percentile(peaks, 50) / 1024,
+        'invocation_peak_kb_p99': percentile(peaks, 99) / 1024,
+        'retained_kb': sum(stat.size_diff for stat in retained) / 1024,
+        'retained_by_file': [{
+            'file': os.path.basename(stat.traceback[0].filename),
+            'kb': stat.size_diff / 1024,
+            'blocks': stat.count_diff
+        } for stat in retained[:10]]
+    }
+
+
+def print_report(report):
+    config = report['config']
+    print(f"{report['messages']} messages in {report['invocations']} invocations ({config['mode']}, batch {config['batch']}, "
+          f"{config['devices']} devices, boto3 call {config['aws_ms']} ms)")
+    print(f"throughput {report['throughput_msg_s']:.1f} msg/s, invocation p50 {report['invocation']['p50_ms']:.2f} ms, "
+          f"p99 {report['invocation']['p99_ms']:.2f} ms")
+    print(f"{'stage':18s} {'calls':>7s} {'mean ms':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'errors':>7s}")
+    for name in HANDLERS:
+        stage = report['stages'].get(name)
+        if stage:
+            print(f"{name:18s} {stage['calls']:7d} {stage['mean_ms']:9.2f} {stage['p50_ms']:9.2f} "
+                  f"{stage['p99_ms']:9.2f} {stage['errors']:7d}")
+    print(f"boto3 calls: {report['boto3_calls']}")
+    alloc = report.get('allocations')
+    if alloc:
+        print(f"allocations (first {alloc['messages']} messages): peak {alloc['peak_kb']:.1f} KiB, per invocation "
+              f"p50 {alloc['invocation_peak_kb_p50']:.1f} KiB / p99 {alloc['invocation_peak_kb_p99']:.1f} KiB, "
+              f"retained {alloc['retained_kb']:.1f} KiB")
+        for entry in alloc['retained_by_file']:
+            print(f"  {entry['file']:28s} {entry['kb']:9.1f} KiB {entry['blocks']:7d} blocks")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500, help="generated gateway messages")
+    parser.add_argument("--rate", type=float, default=2.0, help="gateway messages per second in the stream")
+    parser.add_argument("--devices", type=int, default=2, help="ESP32 devices per gateway")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--start", default=DEFAULT_START, help="time of the first message (UTC)")
+    parser.add_argument("--replay", help="replay a recorded stream (JSON lines) instead of generating one")
+    parser.add_argument("--record", help="write the stream to this file")
+    parser.add_argument("--mode", choices=['pipeline', 'stepfunction'], default='pipeline')
+    parser.add_argument("--batch", type=int, default=1, help="messages per invocation (SQS records)")
+    parser.add_argument("--realtime", action="store_true", help="feed the messages at the rate of the stream")
+    parser.add_argument("--aws-ms", type=float, default=0.0, help="latency of every boto3 call")
+    parser.add_argument("--invoke-ms", type=float, default=0.0, help="stepfunction mode: overhead of a lambda invocation")
+    parser.add_argument("--transition-ms", type=float, default=0.0, help="stepfunction mode: overhead of a state transition")
+    parser.add_argument("--alloc-messages", type=int, default=100, help="messages measured with tracemalloc (0 = none)")
+    parser.add_argument("--report", help="write the results as JSON, e.g. to compare two runs")
+    args = parser.parse_args()
+
+    if args.replay:
+        messages = load_stream(args.replay)
+    else:
+        messages = GatewayStream(args.rate, args.devices, args.seed, args.start).take(args.messages)
+    if args.record:
+        save_stream(args.record, messages)
+
+    os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:eu-north-1:000000000000:local')
+    local_stubs.install(latency_ms=args.aws_ms)
+    logging.disable(logging.INFO)
+    run, timer = install_handlers(args.mode, args.invoke_ms, args.transition_ms)
+
+    groups = invocations_of(messages, args.batch)
+    traced = groups[:-(-args.alloc_messages // args.batch)] if args.alloc_messages > 0 else []
+    timed = groups[len(traced):]
+    if not timed:
+        parser.error("no messages left after the --alloc-messages")
+
+    allocations = replay(run, traced, args.batch, alloc=True)[2] if traced else None
+    timer.reset()
+    calls_before = local_stubs.call_counts()
+    seconds, latencies, _ = replay(run, timed, args.batch, args.realtime, args.rate)
+    calls = {service: {operation: count - calls_before.get(service, {}).get(operation, 0)
+                       for operation, count in operations.items()}
+             for service, operations in local_stubs.call_counts().items()}
+
+    timed_messages = sum(len(group) for group in timed)
+    report = {
+        'config': {key: getattr(args, key) for key in ('mode', 'batch', 'rate', 'devices', 'seed', 'aws_ms', 'realtime', 'replay')},
+        'messages': timed_messages,
+        'invocations': len(timed),
+        'seconds': seconds,
+        'throughput_msg_s': timed_messages / seconds,
+        'invocation': {'p50_ms': percentile(latencies, 50), 'p99_ms': percentile(latencies, 99)},
+        'stages': timer.summary(),
+        'boto3_calls': calls,
+        'allocations': allocations
+    }
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
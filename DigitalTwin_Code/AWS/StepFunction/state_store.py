@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger()
+
+# Small key/value state of the lambdas (last motion per room, already reported anomalies,
+# CO2 detector state per room, pending notification digest).
+# Values live in namespaces ("motion", "anomalies", "co2", "notifications") and every value has a version.
+# compare_and_set only writes if the version is still the one that was read, so two executions
+# at the same time cannot overwrite each other's changes (no lost updates).
+#
+#   STATE_STORE=s3        one JSON document per namespace in S3 like before (default)
+#   STATE_STORE=dynamodb  one item per key in STATE_TABLE (partition key "pk" = namespace,
+#                         sort key "sk" = key), conditional writes on the version
+#   STATE_STORE=memory    in process only, for local runs and tests
+# Reads go through a cache that lives as long as the lambda container (STATE_CACHE_TTL seconds).
+#
+# Namespaces are sharded per gateway ("motion/<gateway>", see shard()), so executions for different
+# gateways never write the same S3 object or DynamoDB partition. The default gateway keeps the
+# unsharded namespace, i.e. the objects that existed before. aggregate() merges shards for the rare
+# global view.
+STATE_STORE = os.environ.get('STATE_STORE', 's3')
+STATE_TABLE = os.environ.get('STATE_TABLE', 'DoorTwinState')
+STATE_BUCKET = 'bucket-for-lambda-function1'
+CACHE_TTL = float(os.environ.get('STATE_CACHE_TTL', '5'))
+CAS_RETRIES = 5
+
+S3_DOCUMENTS = {
+    'motion': 'motion-data.json',
+    'anomalies': 'anomaly-state/reported_anomalies.json',
+    'co2': 'anomaly-state/co2-detector.json',
+    'notifications': 'anomaly-state/notification-digest.json'
+}
+
+
+def shard(namespace, shard_id=None):
+    # shard_id None = default gateway (topology.shard_id)
+    return f"{namespace}/{shard_id}" if shard_id else namespace
+
+
+def _error_code(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+
+class MemoryStore:
+    def __init__(self):
+        self.data = {}   # namespace -> key -> (value, version)
+        self._lock = threading.Lock()
+
+    def items(self, namespace):
+        with self._lock:
+            return dict(self.data.get(namespace, {}))
+
+    def compare_and_set(self, namespace, key, value, expected_version):
+        # expected_version None = the key must not exist yet. Returns the new version or None
+        with self._lock:
+            items = self.data.setdefault(namespace, {})
+            current = items.get(key)
+            if (current[1] if current else None) != expected_version:
+                return None
+            version = (expected_version or 0) + 1
+            items[key] = (value, version)
+            return version
+
+    def delete(self, namespace, key, expected_version):
+        with self._lock:
+            items = self.data.get(namespace, {})
+            current = items.get(key)
+            if current is None or current[1] != expected_version:
+                return False
+            del items[key]
+            return True
+
+
+class S3Store:
+    # the old layout: one JSON document per namespace. The version of a key is its JSON value,
+    # the whole document is written with If-Match on its ETag and merged again on a conflict
+    def __init__(self, s3, bucket=STATE_BUCKET, documents=S3_DOCUMENTS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.documents = documents
+        self.docs = {}   # namespace -> (data, etag) of the last read or write
+
+    def _object_key(self, namespace):
+        # "motion" -> motion-data.json, "motion/pi-2" -> motion-data/pi-2.json
+        base, _, shard_id = namespace.partition('/')
+        key = self.documents[base]
+        if not shard_id:
+            return key
+        root, extension = os.path.splitext(key)
+        return f"{root}/{shard_id}{extension}"
+
+    def _load(self, namespace):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._object_key(namespace))
+            data = json.loads(response['Body'].read())
+            etag = response.get('ETag')
+        except Exception as e:
+            if _error_code(e) != 'NoSuchKey':
+                raise
+            data, etag = {}, None
+        self.docs[namespace] = (data, etag)
+        return data, etag
+
+    @staticmethod
+    def _version(value):
+        return json.dumps(value, sort_keys=True)
+
+    def items(self, namespace):
+        data, etag = self._load(namespace)
+        return {key: (value, self._version(value)) for key, value in data.items()}
+
+    def _write(self, namespace, key, change, expected_version):
+        for attempt in range(CAS_RETRIES):
+            fresh = namespace not in self.docs
+            data, etag = self.docs[namespace] if not fresh else self._load(namespace)
+            current = self._version(data[key]) if key in data else None
+            if current != expected_version:
+                if fresh:
+                    return False
+                del self.docs[namespace]   # maybe only our copy is old
+                continue
+
+            new_data = dict(data)
+            change(new_data)
+            condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+            try:
+                response = self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self._object_key(namespace),
+                    Body=json.dumps(new_data),
+                    ContentType='application/json',
+                    **condition
+                )
+            except Exception as e:
+                if _error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise
+                self.docs.pop(namespace, None)   # someone else wrote the document, merge again
+                continue
+            self.docs[namespace] = (new_data, response.get('ETag'))
+            return True
+        return False
+
+    def compare_and_set(self, namespace, key, value, expected_version):
+        def change(data):
+            data[key] = value
+        return self._version(value) if self._write(namespace, key, change, expected_version) else None
+
+    def delete(self, namespace, key, expected_version):
+        def change(data):
+            data.pop(key, None)
+        return expected_version is not None and self._write(namespace, key, change, expected_version)
+
+
+class DynamoStore:
+    def __init__(self, dynamodb, table=STATE_TABLE):
+        self.dynamodb = dynamodb
+        self.table = table
+
+    def items(self, namespace):
+        items = {}
+        request = {
+            'TableName': self.table,
+            'KeyConditionExpression': 'pk = :pk',
+            'ExpressionAttributeValues': {':pk': {'S': namespace}}
+        }
+        while True:
+            response = self.dynamodb.query(**request)
+            for item in response.get('Items', []):
+                items[item['sk']['S']] = (json.loads(item['value']['S']), int(item['version']['N']))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def compare_and_set(self, namespace, key, value, expected_version):
+        version = (expected_version or 0) + 1
+        if expected_version is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(sk)'}
+        else:
+            condition = {
+                'ConditionExpression': '#v = :v',
+                'ExpressionAttributeNames': {'#v': 'version'},
+                'ExpressionAttributeValues': {':v': {'N': str(expected_version)}}
+            }
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table,
+                Item={
+                    'pk': {'S': namespace},
+                    'sk': {'S': key},
+                    'value': {'S': json.dumps(value)},
+                    'version': {'N': str(version)}
+                },
+                **condition
+            )
+        except Exception as e:
+            if _error_code(e) == 'ConditionalCheckFailedException':
+                return None
+            raise
+        return version
+
+    def delete(self, namespace, key, expected_version):
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table,
+                Key={'pk': {'S': namespace}, 'sk': {'S': key}},
+                ConditionExpression='#v = :v',
+                ExpressionAttributeNames={'#v': 'version'},
+                ExpressionAttributeValues={':v': {'N': str(expected_version)}}
+            )
+        except Exception as e:
+            if _error_code(e) == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+
+class CachedStore:
+    # warm container cache in front of a backend. Reads are served from the cache for ttl seconds,
+    # writes go to the backend right away and a failed compare_and_set drops the cached namespace
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.cache = {}   # namespace -> (items, monotonic time)
+        self._lock = threading.Lock()
+
+    def items(self, namespace):
+        with self._lock:
+            cached = self.cache.get(namespace)
+            if cached and time.monotonic() - cached[1] <= self.ttl:
+                return dict(cached[0])
+        items = self.backend.items(namespace)
+        with self._lock:
+            self.cache[namespace] = (items, time.monotonic())
+        return dict(items)
+
+    def get(self, namespace, key):
+        # (value, version), (None, None) if the key does not exist
+        return self.items(namespace).get(key, (None, None))
+
+    def invalidate(self, namespace=None):
+        with self._lock:
+            if namespace is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(namespace, None)
+
+    def _store_local(self, namespace, key, entry):
+        with self._lock:
+            cached = self.cache.get(namespace)
+            if cached:
+                if entry is None:
+                    cached[0].pop(key, None)
+                else:
+                    cached[0][key] = entry
+
+    def compare_and_set(self, namespace, key, value, expected_version):
+        version = self.backend.compare_and_set(namespace, key, value, expected_version)
+        if version is None:
+            self.invalidate(namespace)
+        else:
+            self._store_local(namespace, key, (value, version))
+        return version
+
+    def delete(self, namespace, key, expected_version):
+        if self.backend.delete(namespace, key, expected_version):
+            self._store_local(namespace, key, None)
+            return True
+        self.invalidate(namespace)
+        return False
+
+    def aggregate(self, namespace, shard_ids):
+        # {(shard id, key): (value, version)} over the given shards, only read when a global view is needed
+        items = {}
+        for shard_id in shard_ids:
+            for key, entry in self.items(shard(namespace, shard_id)).items():
+                items[(shard_id, key)] = entry
+        return items
+
+    def update(self, namespace, key, change):
+        # read, change(value) -> new value, compare_and_set, again on a conflict
+        # returns the stored value (no write if change returns the same value)
+        for attempt in range(CAS_RETRIES):
+            value, version = self.get(namespace, key)
+            new_value = change(value)
+            if new_value == value:
+                return value
+            if self.compare_and_set(namespace, key, new_value, version) is not None:
+                return new_value
+        raise RuntimeError(f"Could not update {namespace}/{key}, too many conflicting writes")
+
+
+def create_store(s3=None, backend=STATE_STORE):
+    # s3: the client of the calling lambda, only used by the s3 backend
+    if backend == 'memory':
+        return CachedStore(MemoryStore())
+    if backend == 'dynamodb':
+        from aws_clients import lazy_client
+        return CachedStore(DynamoStore(lazy_client('dynamodb', region_name='eu-central-1')))
+    if s3 is None:
+        from aws_clients import lazy_client
+        s3 = lazy_client('s3')
+    return CachedStore(S3Store(s3))
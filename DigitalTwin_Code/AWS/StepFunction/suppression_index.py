@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+from state_store import shard
+
+logger = logging.getLogger()
+
+# Decides which anomalies are worth an SNS message (used by Notification.py).
+#   cooldown    a key ("<entity>_<type>") is notified at most once per NOTIFY_COOLDOWN seconds
+#   hysteresis  a key only counts as resolved after it was not seen for RESOLVE_AFTER seconds,
+#               so a flapping sensor (anomaly, no anomaly, anomaly, ...) stays one alert
+#   digest      new anomalies within DIGEST_WINDOW seconds go out together in one SNS message,
+#               the first one after a quiet window is sent right away
+# The state is one small entry per key plus the pending digest in the state store
+# (state_store.py, cached in the container). An entry is only written when it changes, when it
+# was last refreshed more than SEEN_REFRESH seconds ago or when it is resolved, not for every message.
+# Keys and digest are sharded per gateway (shard_id, see topology.py), an execution only touches the
+# shards of the gateways in its event. Keys of gateways that went quiet are resolved by sweep(),
+# which reads all shards at most every SWEEP_INTERVAL seconds per container.
+NOTIFY_COOLDOWN = float(os.environ.get('NOTIFY_COOLDOWN', '900'))
+RESOLVE_AFTER = float(os.environ.get('RESOLVE_AFTER', '60'))
+DIGEST_WINDOW = float(os.environ.get('DIGEST_WINDOW', '60'))
+SEEN_REFRESH = 10.0
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL', '300'))
+
+KEYS_NAMESPACE = 'anomalies'
+DIGEST_NAMESPACE = 'notifications'
+
+
+def anomaly_key(anomaly):
+    return f"{anomaly.get('entity', 'Unknown')}_{anomaly.get('type', 'Unknown')}"
+
+
+def _entry(value):
+    # entries written before the index were just True
+    if isinstance(value, dict):
+        return dict(value)
+    return {'active': True, 'last_seen': 0.0, 'last_notified': 0.0}
+
+
+class SuppressionIndex:
+    def __init__(self, store, cooldown=NOTIFY_COOLDOWN, resolve_after=RESOLVE_AFTER,
+                 digest_window=DIGEST_WINDOW, seen_refresh=SEEN_REFRESH, sweep_interval=SWEEP_INTERVAL):
+        self.store = store
+        self.cooldown = cooldown
+        self.resolve_after = resolve_after
+        self.digest_window = digest_window
+        self.seen_refresh = seen_refresh
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.monotonic()   # a new container starts with the shards of its event
+
+    def observe(self, anomalies, now, shard_id=None):
+        # returns (anomalies that should be notified, at most one per key, keys seen in this message)
+        namespace = shard(KEYS_NAMESPACE, shard_id)
+        entries = self.store.items(namespace)
+        notify = []
+        seen = set()
+        for anomaly in anomalies:
+            key = anomaly_key(anomaly)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            value, version = entries.get(key, (None, None))
+            entry = _entry(value) if value is not None else None
+            if entry is None:
+                new = {'active': True, 'last_seen': now, 'last_notified': now}
+            elif not entry['active'] and now - entry['last_notified'] >= self.cooldown:
+                new = dict(entry, active=True, last_seen=now, last_notified=now)
+            else:
+                if entry['active'] and now - entry['last_seen'] < self.seen_refresh:
+                    continue   # nothing new, no write
+                logger.info(f"Suppressing anomaly {key} (cooldown or still active)")
+                new = dict(entry, active=True, last_seen=now)
+
+            # compare and set: with two executions at the same time only one of them notifies
+            if self.store.compare_and_set(namespace, key, new, version) is None:
+                continue
+            if new['last_notified'] == now:
+                notify.append(anomaly)
+        return notify, seen
+
+    def resolve(self, now, current_keys, shard_id=None):
+        # marks keys resolved that were not seen for resolve_after seconds,
+        # forgets them completely once the cooldown is over
+        namespace = shard(KEYS_NAMESPACE, shard_id)
+        for key, (value, version) in self.store.items(namespace).items():
+            if key not in current_keys:
+                self._expire(namespace, key, value, version, now)
+
+    def sweep(self, now, shard_ids, skip=()):
+        # resolve over every shard (skip = shards this execution resolved already), lazily:
+        # at most every sweep_interval seconds per container
+        if time.monotonic() - self.last_sweep < self.sweep_interval:
+            return
+        self.last_sweep = time.monotonic()
+        for (shard_id, key), (value, version) in self.store.aggregate(KEYS_NAMESPACE, shard_ids).items():
+            if shard_id not in skip:
+                self._expire(shard(KEYS_NAMESPACE, shard_id), key, value, version, now)
+
+    def _expire(self, namespace, key, value, version, now):
+        entry = _entry(value)
+        if entry['active'] and now - entry['last_seen'] >= self.resolve_after:
+            if self.store.compare_and_set(namespace, key, dict(entry, active=False), version) is not None:
+                logger.info(f"Anomaly resolved: {key}")
+        elif not entry['active'] and now - max(entry['last_notified'], entry['last_seen']) >= self.cooldown:
+            self.store.delete(namespace, key, version)
+
+    def digest(self, anomalies, now, shard_id=None):
+        # adds the anomalies to the pending digest, returns the list to send now ([] = wait)
+        to_send = []
+
+        def change(current):
+            to_send.clear()
+            if not anomalies and not (current and current['pending']):
+                return current
+            digest = dict(current) if current else {'pending': [], 'last_publish': 0.0}
+            digest['pending'] = digest['pending'] + anomalies
+            if digest['pending'] and now - digest['last_publish'] >= self.digest_window:
+                to_send.extend(digest['pending'])
+                digest['pending'] = []
+                digest['last_publish'] = now
+            return digest
+
+        self.store.update(shard(DIGEST_NAMESPACE, shard_id), 'digest', change)
+        return list(to_send)
+
+    def requeue(self, anomalies, shard_id=None):
+        # sending failed: keep them for the next invocation, which sends right away
+        def change(current):
+            digest = dict(current) if current else {'pending': [], 'last_publish': 0.0}
+            return {'pending': anomalies + digest['pending'], 'last_publish': 0.0}
+
+        self.store.update(shard(DIGEST_NAMESPACE, shard_id), 'digest', change)
@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger()
+
+# Last written timestamp per twin property, kept in the lambda container between warm invocations.
+# update_DoorTwin asks the cache instead of calling get_entity for every message.
+# With TWIN_TIMESTAMP_TABLE set, a DynamoDB table (partition key "pk", string) is the shared source
+# of truth for all containers: a conditional put only succeeds for a newer timestamp, so out of
+# order messages are rejected by the write itself and no read is needed.
+DEFAULT_TTL = float(os.environ.get('TWIN_CACHE_TTL', '300'))  # seconds
+TABLE_NAME = os.environ.get('TWIN_TIMESTAMP_TABLE')
+
+
+class TimestampCache:
+    def __init__(self, ttl=DEFAULT_TTL, table_name=TABLE_NAME, dynamodb=None):
+        self.ttl = ttl
+        self.table_name = table_name
+        self._dynamodb = dynamodb
+        self.entries = {}   # key -> (timestamp in ms, monotonic time it was stored)
+        self.claims = {}    # key -> (claimed timestamp, timestamp the table had before or None), see release()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def dynamodb(self):
+        if self._dynamodb is None:
+            import aws_clients
+            self._dynamodb = aws_clients.client('dynamodb', region_name='eu-central-1')
+        return self._dynamodb
+
+    def get(self, key):
+        # newest known timestamp (ms) or None if unknown or older than the TTL
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def remember(self, key, timestamp_ms):
+        entry = self.entries.get(key)
+        if entry is None or timestamp_ms >= entry[0]:
+            self.entries[key] = (timestamp_ms, time.monotonic())
+
+    def invalidate(self, key=None):
+        # forget one key (e.g. after a failed write) or everything
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def claim(self, key, timestamp_ms):
+        # conditional write of the new timestamp, False if the table already has a newer or equal one.
+        # Without a table the cache alone decides
+        self.claims.pop(key, None)
+        if not self.table_name:
+            return True
+        try:
+            response = self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={'pk': {'S': '/'.join(key)}, 'ts': {'N': str(timestamp_ms)}},
+                ConditionExpression='attribute_not_exists(pk) OR ts < :ts',
+                ExpressionAttributeValues={':ts': {'N': str(timestamp_ms)}},
+                ReturnValues='ALL_OLD'
+            )
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            logger.warning(f"Timestamp table not available, using the cache only: {e}")
+            return True
+        previous = (response or {}).get('Attributes', {}).get('ts')
+        self.claims[key] = (timestamp_ms, int(float(previous['N'])) if previous else None)
+        return True
+
+    def release(self, key):
+        # the twin write of a claimed timestamp failed: forget it locally and give the claim back,
+        # otherwise a retry of the same message would be rejected as out of order.
+        # Conditional on our timestamp, a newer claim of another container is kept
+        self.invalidate(key)
+        claim = self.claims.pop(key, None)
+        if claim is None or not self.table_name:
+            return
+        claimed, previous = claim
+        condition = {
+            'ConditionExpression': 'ts = :ts',
+            'ExpressionAttributeValues': {':ts': {'N': str(claimed)}}
+        }
+        try:
+            if previous is None:
+                self.dynamodb.delete_item(TableName=self.table_name, Key={'pk': {'S': '/'.join(key)}}, **condition)
+            else:
+                self.dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={'pk': {'S': '/'.join(key)}, 'ts': {'N': str(previous)}},
+                    **condition
+                )
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                logger.warning(f"Could not give back the timestamp claim of {key}: {e}")
@@ -0,0 +1,151 @@
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Writes timestream records in as few and as small requests as possible and does not lose them:
+#   - records are grouped by their dimensions, the dimensions go into CommonAttributes once per request.
+#     Small groups (a single message) share one request instead, so grouping never adds requests
+#   - the requests (max 100 records) are sent at the same time
+#   - throttling and server errors are retried with jittered exponential backoff
+#   - on RejectedRecords only the rejected records are sent again. A record that conflicts with an
+#     existing one (same dimensions, time and measure, other value) is written again with a higher
+#     Version, other rejections (e.g. time outside the memory store retention) are reported
+MAX_RECORDS = 100               # write_records limit
+MIN_GROUP = 20                  # smaller groups are packed together with the dimensions in every record
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 6
+BASE_DELAY = 0.05               # seconds, backoff is random between 0 and BASE_DELAY * 2^attempt
+MAX_DELAY = 2.0
+RETRYABLE_ERRORS = ('ThrottlingException', 'InternalServerException', 'ServiceUnavailable',
+                    'RequestTimeout', 'RequestTimeoutException')
+
+
+def _error_code(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+
+class WriteFailed(Exception):
+    pass
+
+
+def group_records(records):
+    # [(common attributes, records without them), ...] one entry per set of dimensions
+    groups = {}
+    for record in records:
+        dimensions = tuple((d['Name'], d['Value']) for d in record.get('Dimensions', []))
+        groups.setdefault((dimensions, record.get('TimeUnit')), []).append(record)
+
+    result = []
+    for (dimensions, time_unit), group in groups.items():
+        common = {'Dimensions': [{'Name': name, 'Value': value} for name, value in dimensions]}
+        if time_unit:
+            common['TimeUnit'] = time_unit
+        stripped = [{name: value for name, value in record.items() if name not in common} for record in group]
+        result.append((common, stripped))
+    return result
+
+
+def plan_batches(records):
+    # [(common attributes, up to MAX_RECORDS records), ...]
+    batches = []
+    small = []
+    for common, group in group_records(records):
+        if len(group) < MIN_GROUP:
+            small.extend(dict(record, **common) for record in group)
+            continue
+        for i in range(0, len(group), MAX_RECORDS):
+            batches.append((common, group[i:i + MAX_RECORDS]))
+
+    # the small groups keep their dimensions, only the time unit is common (all are ms here)
+    time_units = {record.get('TimeUnit') for record in records}
+    common = {'TimeUnit': time_units.pop()} if len(time_units) == 1 and None not in time_units else {}
+    small = [{name: value for name, value in record.items() if name not in common} for record in small]
+    for i in range(0, len(small), MAX_RECORDS):
+        batches.append((common, small[i:i + MAX_RECORDS]))
+    return batches
+
+
+class TimestreamWriter:
+    def __init__(self, client, max_workers=MAX_WORKERS, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY):
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def write(self, database, table, records):
+        # returns the metrics of all batches, raises WriteFailed if a batch could not be written
+        batches = plan_batches(records)
+        futures = [self.executor.submit(self._write_batch, database, table, common, batch)
+                   for common, batch in batches]
+        results = [future.result() for future in futures]
+
+        metrics = {
+            'batches': len(results),
+            'records': sum(r['records'] for r in results),
+            'ingested': sum(r['ingested'] for r in results),
+            'rejected': sum(r['rejected'] for r in results),
+            'retries': sum(r['retries'] for r in results),
+            'failed_batches': sum(1 for r in results if r['error']),
+            'max_latency_ms': max((r['latency_ms'] for r in results), default=0.0)
+        }
+        logger.info(f"Timestream write: {metrics}")
+        if metrics['failed_batches']:
+            raise WriteFailed(f"{metrics['failed_batches']} of {metrics['batches']} timestream batches failed: "
+                              + "; ".join(r['error'] for r in results if r['error']))
+        return metrics
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(MAX_DELAY, self.base_delay * 2 ** attempt)))
+
+    def _write_batch(self, database, table, common, records):
+        start = time.perf_counter()
+        result = {'records': len(records), 'ingested': 0, 'rejected': 0, 'retries': 0, 'error': None}
+        pending = records
+        attempt = 0
+
+        while pending:
+            try:
+                response = self.client.write_records(
+                    DatabaseName=database,
+                    TableName=table,
+                    CommonAttributes=common,
+                    Records=pending
+                )
+                result['ingested'] += response.get('RecordsIngested', {}).get('Total', len(pending))
+                pending = []
+            except Exception as e:
+                code = _error_code(e)
+                attempt += 1
+                if code == 'RejectedRecordsException':
+                    pending = self._redrive(e, pending, result)
+                elif code not in RETRYABLE_ERRORS:
+                    result['error'] = f"{code or type(e).__name__}: {e}"
+                    break
+                if pending and attempt >= self.max_attempts:
+                    result['error'] = f"gave up after {attempt} attempts ({code})"
+                    break
+                if pending:
+                    result['retries'] += 1
+                    self._backoff(attempt)
+
+        result['latency_ms'] = (time.perf_counter() - start) * 1000
+        logger.info(f"Timestream batch {common.get('Dimensions', 'mixed')}: {result}")
+        return result
+
+    def _redrive(self, e, pending, result):
+        # the records that were not rejected are written, only the rejected ones come back
+        rejected = e.response.get('RejectedRecords', [])
+        result['ingested'] += len(pending) - len(rejected)
+        retry = []
+        for rejection in rejected:
+            record = pending[rejection['RecordIndex']]
+            if 'ExistingVersion' in rejection:
+                # newer value for the same point in time, overwrite it with a higher version
+                retry.append(dict(record, Version=rejection['ExistingVersion'] + 1))
+            else:
+                result['rejected'] += 1
+                logger.warning(f"Timestream rejected {record.get('MeasureName')} at {record.get('Time')}: {rejection.get('Reason')}")
+        return retry
@@ -0,0 +1,71 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger()
+
+# Which gateway belongs to which door, which BLE device of a gateway measures which room and the
+# TwinMaker / 3D scene entities of every door and room (topology.json, bundled with the lambdas).
+#   gateways  gateway id -> {"door": door entity, "devices": {device key: room entity}}
+#   doors     door entity -> {"sceneNode": 3D node rotated with the door angle}
+#   rooms     room entity -> {"light": 3D light, "occupancy": "enclosed"/"hallway", "door": door of the room}
+# The gateway id of a message is its "gateway_id" field (the IoT rule adds clientid() AS gateway_id),
+# messages without one belong to "defaultGateway" like the single gateway before.
+# The file is read once per container, every lookup is a dict lookup.
+TOPOLOGY_FILE = os.environ.get('TOPOLOGY_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'topology.json'))
+
+
+class Topology:
+    def __init__(self, data):
+        self.default_gateway = data.get('defaultGateway')
+        self.gateways = data.get('gateways', {})
+        self.doors = data.get('doors', {})
+        self.rooms = data.get('rooms', {})
+        # (device key, room) pairs per gateway, built once
+        self.devices = {gateway_id: tuple(gateway.get('devices', {}).items())
+                        for gateway_id, gateway in self.gateways.items()}
+        self.unknown = set()   # gateways already warned about
+
+    def gateway_id(self, sample):
+        return sample.get('gateway_id') or self.default_gateway
+
+    def door_of(self, sample):
+        # door entity of the gateway that sent the sample, None for an unknown gateway
+        gateway = self.gateways.get(self.gateway_id(sample))
+        if gateway is None:
+            if self.gateway_id(sample) not in self.unknown:
+                self.unknown.add(self.gateway_id(sample))
+                logger.warning(f"Unknown gateway {self.gateway_id(sample)}, its messages are skipped. Add it to topology.json")
+            return None
+        return gateway.get('door')
+
+    def devices_of(self, sample):
+        # ((device key, room entity), ...) of the gateway that sent the sample
+        return self.devices.get(self.gateway_id(sample), ())
+
+    def shard_id(self, gateway_id):
+        # state shard of a gateway (state_store.shard), None = the default gateway (unsharded state)
+        if not gateway_id or gateway_id == self.default_gateway:
+            return None
+        return gateway_id
+
+    def shard_ids(self):
+        # every shard, for a global view of the state
+        return [None] + [gateway_id for gateway_id in self.gateways if gateway_id != self.default_gateway]
+
+    def door(self, door_id):
+        return self.doors.get(door_id, {})
+
+    def room(self, room_id):
+        return self.rooms.get(room_id, {})
+
+
+_topology = None
+
+
+def get_topology(path=TOPOLOGY_FILE):
+    global _topology
+    if _topology is None:
+        with open(path) as f:
+            _topology = Topology(json.load(f))
+    return _topology
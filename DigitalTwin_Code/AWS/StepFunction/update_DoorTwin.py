@@ -1,9 +1,16 @@
-import boto3
 import os
 import math
+import calendar
 from datetime import datetime
+from timestamp_cache import TimestampCache
+from update_planner import UpdatePlanner
+from topology import get_topology
+from aws_clients import lazy_client
 
-iottwinmaker = boto3.client('iottwinmaker', region_name='eu-central-1')
+iottwinmaker = lazy_client('iottwinmaker', region_name='eu-central-1')
+
+# lives as long as the lambda container, so warm invocations do not read the twin again
+timestamp_cache = TimestampCache()
 
 def parse_timestamp(timestamp_string):
     try:
@@ -13,9 +20,27 @@ def parse_timestamp(timestamp_string):
     except:
         return None
 
+def timestamp_ms(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) * 1000 + timestamp.microsecond // 1000
+
+def read_twin_timestamp(workspace_id, entity_id, component_name, timestamp_property):
+    # timestamp (ms) that is in the twinmaker right now, None if there is none
+    response = iottwinmaker.get_entity(workspaceId=workspace_id, entityId=entity_id)
+    existing_property = (
+        response.get("components", {})
+        .get(component_name, {})
+        .get("properties", {})
+        .get(timestamp_property, {})
+    )
+    current_timestamp_str = existing_property.get("value", {}).get("stringValue")
+    current_timestamp = parse_timestamp(current_timestamp_str) if current_timestamp_str else None
+    return timestamp_ms(current_timestamp) if current_timestamp else None
+
 # functio to check if twin should be updated
 # because the stepfunction sometimes is a bit faster or a bit slower so the data arrives at the twin out of order
-# we have to check the timestamp to see if this data is newer than the data in the twinmaker
+# we have to check the timestamp to see if this data is newer than the data in the twinmaker.
+# The last written timestamp is cached (timestamp_cache.py), get_entity is only called when the cache
+# does not know the property yet or the entry is older than the TTL
 def should_update(workspace_id, entity_id, component_name, new_timestamp_str, timestamp_property):
     if not new_timestamp_str:
         return True
@@ -24,25 +49,26 @@ def should_update(workspace_id, entity_id, component_name, new_timestamp_str, ti
     if not new_timestamp:
         return False
 
-    try:
-        response = iottwinmaker.get_entity(workspaceId=workspace_id, entityId=entity_id)
-        existing_property = (
-            response.get("components", {})
-            .get(component_name, {})
-            .get("properties", {})
-            .get(timestamp_property, {})
-        )
-        current_timestamp_str = existing_property.get("value", {}).get("stringValue")
+    new_ms = timestamp_ms(new_timestamp)
+    key = (workspace_id, entity_id, component_name, timestamp_property)
+    current_ms = timestamp_cache.get(key)
 
-        if current_timestamp_str:
-            current_timestamp = parse_timestamp(current_timestamp_str)
-            if current_timestamp and new_timestamp <= current_timestamp:
-                return False
+    # with the DynamoDB table the conditional write decides, no read needed
+    if current_ms is None and not timestamp_cache.table_name:
+        try:
+            current_ms = read_twin_timestamp(workspace_id, entity_id, component_name, timestamp_property)
+        except:
+            return True  # Allow update
+        if current_ms is not None:
+            timestamp_cache.remember(key, current_ms)
 
-        return True
+    if current_ms is not None and new_ms <= current_ms:
+        return False
+    if not timestamp_cache.claim(key, new_ms):
+        return False
 
-    except:
-        return True  # Allow update
+    timestamp_cache.remember(key, new_ms)
+    return True
 
 def update_entity(workspace_id, entity_id, updates):
     try:
@@ -51,131 +77,145 @@ def update_entity(workspace_id, entity_id, updates):
             entityId=entity_id,
             componentUpdates=updates
         )
+        return True
     except:
         print(f"Failed to update entity: {entity_id}")
+        return False
 
-def lambda_handler(event, context):
-    workspace_id = os.environ.get("TWINMAKER_WORKSPACE_ID", "door")
-
-
-
-    ################################   For 3D scene - Plate_001 angle rotation   ####################################
+# with a batch of readings the updates hold the whole history, the twin only needs the newest value
+# of every property. Updates with a timestamp (ms) are compared by it, otherwise the later one wins
+def latest_updates(updates):
+    latest = {}
+    for update in updates:
+        key = (update.get("entityId"), update.get("componentName"), update.get("property"))
+        current = latest.get(key)
+        if current is None or update.get("timestamp", 0) >= current.get("timestamp", 0):
+            latest[key] = update
+    return list(latest.values())
+
+def by_entity(updates):
+    # entity id -> its updates, so every door / room is handled once
+    entities = {}
+    for update in updates:
+        entities.setdefault(update.get("entityId"), []).append(update)
+    return entities
+
+def twin_value(value, value_type):
+    if value_type == "doubleValue":
+        return {"value": {"doubleValue": float(value)}}
+    if value_type == "booleanValue":
+        return {"value": {"booleanValue": bool(value)}}
+    return {"value": {"stringValue": str(value)}}
+
+################################   Door updates (and 3D scene plate angle rotation)   ####################################
+def update_door(planner, workspace_id, door_id, door, updates):
     rotation_angle = None
     door_timestamp = None
 
-    for update in event.get("doorInfo", {}).get("doorUpdates", []):
+    for update in updates:
         if update.get("property") == "angle":
             rotation_angle = update.get("value")
         elif update.get("property") == "doorTimestamp":
             door_timestamp = update.get("value")
 
-    if rotation_angle is not None and door_timestamp:
-        if should_update(workspace_id, "Door", "DoorComponents", door_timestamp, "doorTimestamp"):
-            angle_in_radians = float(rotation_angle) * math.pi / 180
-            update_entity(
-                workspace_id,
-                "5dbaf7df-ea98-4bf7-8f8d-96afd0a390b0",  # plate_001
-                {
-                    "Node": {
-                        "componentTypeId": "com.amazon.iottwinmaker.3d.node",
-                        "updateType": "UPDATE",
-                        "propertyUpdates": {
-                            "transform_rotation": {
-                                "value": {
-                                    "listValue": [
-                                        {"doubleValue": -math.pi / 2},
-                                        {"doubleValue": 0.0},
-                                        {"doubleValue": angle_in_radians}
-                                    ]
-                                }
-                            }
-                        }
+    # one check for the 3D rotation and the door properties, they have the same timestamp
+    door_key = (workspace_id, door_id, "DoorComponents", "doorTimestamp")
+    if not door_timestamp or not should_update(workspace_id, door_id, "DoorComponents", door_timestamp, "doorTimestamp"):
+        return
+
+    if rotation_angle is not None and door.get("sceneNode"):
+        angle_in_radians = float(rotation_angle) * math.pi / 180
+        planner.add(
+            door["sceneNode"],
+            "Node",
+            {
+                "transform_rotation": {
+                    "value": {
+                        "listValue": [
+                            {"doubleValue": -math.pi / 2},
+                            {"doubleValue": 0.0},
+                            {"doubleValue": angle_in_radians}
+                        ]
                     }
                 }
-            )
-
-
-    ################################   Door updates   ####################################################
-    if door_timestamp and should_update(workspace_id, "Door", "DoorComponents", door_timestamp, "doorTimestamp"):
-        property_updates = {"DoorComponents": {"updateType": "UPDATE", "propertyUpdates": {}}}
-
-        for update in event.get("doorInfo", {}).get("doorUpdates", []):
-            property_name = update.get("property")
-            value = update.get("value")
-            value_type = update.get("valueType", "stringValue")
+            },
+            component_type_id="com.amazon.iottwinmaker.3d.node",
+            timestamp_key=door_key
+        )
 
-            if value_type == "doubleValue":
-                property_updates["DoorComponents"]["propertyUpdates"][property_name] = {"value": {"doubleValue": float(value)}}
-            elif value_type == "booleanValue":
-                property_updates["DoorComponents"]["propertyUpdates"][property_name] = {"value": {"booleanValue": bool(value)}}
+    property_updates = {}
+    for update in updates:
+        property_updates[update.get("property")] = twin_value(update.get("value"), update.get("valueType", "stringValue"))
+    planner.add(door_id, "DoorComponents", property_updates, timestamp_key=door_key)
+
+
+################################   Room updates (and 3D scene lights)  ####################################################
+def update_room(planner, workspace_id, room_id, room, updates):
+    room_timestamp = None
+    light_value = None
+    property_updates = {}
+
+    for update in updates:
+        property_name = update.get("property")
+        value = update.get("value")
+
+        if property_name == "roomTimestamp":
+            room_timestamp = value
+        if property_name == "light":
+            light_value = value
+
+        property_updates[property_name] = twin_value(value, update.get("valueType", "stringValue"))
+
+    if room_timestamp and should_update(workspace_id, room_id, "RoomComponents", room_timestamp, "roomTimestamp"):
+        planner.add(room_id, "RoomComponents", property_updates,
+                    timestamp_key=(workspace_id, room_id, "RoomComponents", "roomTimestamp"))
+
+    ############## 3D Scne lights ##############
+    if light_value is not None and room.get("light"):
+        try:
+            raw_light = float(light_value)
+            if raw_light < 50:
+                normalized = raw_light / 50.0
+            elif raw_light < 300:
+                normalized = raw_light / 300.0
             else:
-                property_updates["DoorComponents"]["propertyUpdates"][property_name] = {"value": {"stringValue": str(value)}}
+                normalized = min(raw_light / 300.0, 1.0)
 
-        update_entity(workspace_id, "Door", property_updates)
+            normalized = max(normalized, 0.1)
 
+            planner.add(
+                room["light"],
+                "Light",
+                {
+                    "lightSettings_intensity": {
+                        "value": {"doubleValue": normalized}
+                    }
+                }
+            )
+        except Exception as e:
+            print(f"Could not update 3D light for {room_id}: {e}")
 
+def lambda_handler(event, context):
+    workspace_id = os.environ.get("TWINMAKER_WORKSPACE_ID", "door")
+    door_updates = latest_updates(event.get("doorInfo", {}).get("doorUpdates", []))
+    room_updates = latest_updates(event.get("roomsInfo", {}).get("roomUpdates", []))
+    anomaly_updates = latest_updates(event.get("anomalies", {}).get("anomalyUpdates", []))
 
-    ################################   Room1 and Room2 updates (3D scene lights)  ####################################################
-    for room_id, light_entity_id in [("Room1", "138bc7e7-4f77-49a4-9a1a-0e4e678aaade"), ("Room2", "a990152b-203a-4bdb-a6c9-4b43bf8d6f78")]:
-        room_timestamp = None
-        light_value = None
-        property_updates = {"RoomComponents": {"updateType": "UPDATE", "propertyUpdates": {}}}
+    # all writes are collected per entity and sent together at the end (update_planner.py)
+    planner = UpdatePlanner(workspace_id)
 
-        for update in event.get("roomsInfo", {}).get("roomUpdates", []):
-            if update.get("entityId") != room_id:
-                continue
 
-            property_name = update.get("property")
-            value = update.get("value")
-            value_type = update.get("valueType", "stringValue")
+    # doors and rooms of any number of gateways, the 3D scene entities come from topology.json
+    topology = get_topology()
 
-            if property_name == "roomTimestamp":
-                room_timestamp = value
-            if property_name == "light":
-                light_value = value
+    for door_id, updates in by_entity(door_updates).items():
+        update_door(planner, workspace_id, door_id, topology.door(door_id), updates)
 
-            if value_type == "doubleValue":
-                property_updates["RoomComponents"]["propertyUpdates"][property_name] = {"value": {"doubleValue": float(value)}}
-            elif value_type == "booleanValue":
-                property_updates["RoomComponents"]["propertyUpdates"][property_name] = {"value": {"booleanValue": bool(value)}}
-            else:
-                property_updates["RoomComponents"]["propertyUpdates"][property_name] = {"value": {"stringValue": str(value)}}
-
-        if room_timestamp and should_update(workspace_id, room_id, "RoomComponents", room_timestamp, "roomTimestamp"):
-            update_entity(workspace_id, room_id, property_updates)
-
-        ############## 3D Scne lights ##############
-        if light_value is not None:
-            try:
-                raw_light = float(light_value)
-                if raw_light < 50:
-                    normalized = raw_light / 50.0
-                elif raw_light < 300:
-                    normalized = raw_light / 300.0
-                else:
-                    normalized = min(raw_light / 300.0, 1.0)
-
-                normalized = max(normalized, 0.1) 
-
-                update_entity(
-                    workspace_id,
-                    light_entity_id,
-                    {
-                        "Light": {
-                            "updateType": "UPDATE",
-                            "propertyUpdates": {
-                                "lightSettings_intensity": {
-                                    "value": {"doubleValue": normalized}
-                                }
-                            }
-                        }
-                    }
-                )
-            except Exception as e:
-                print(f"Could not update 3D light for {room_id}: {e}")
+    for room_id, updates in by_entity(room_updates).items():
+        update_room(planner, workspace_id, room_id, topology.room(room_id), updates)
 
     ##############################################   Anomaly Updates (should always update NO timestamp check) #####################################
-    for anomaly in event.get("anomalies", {}).get("anomalyUpdates", []):
+    for anomaly in anomaly_updates:
         entity_id = anomaly.get("entityId")
         component_name = anomaly.get("componentName", "AnomalyComponents")
         property_name = anomaly.get("property")
@@ -187,25 +227,24 @@ def lambda_handler(event, context):
 
 
 
-        update_entity(
-            workspace_id,
+        planner.add(
             entity_id,
+            component_name,
             {
-                component_name: {
-                    "updateType": "UPDATE",
-                    "propertyUpdates": {
-                        property_name: {
-                            "value": (
-                                {value_type: value}
-                                if value_type != "stringValue"
-                                else {"stringValue": str(value)}
-                            )
-                        }
-                    }
+                property_name: {
+                    "value": (
+                        {value_type: value}
+                        if value_type != "stringValue"
+                        else {"stringValue": str(value)}
+                    )
                 }
             }
         )
 
+    # one update_entity per entity, sent at the same time
+    # a failed write gives its timestamp claims back, so a retry of the message is not rejected
+    planner.send(update_entity, timestamp_cache.release)
+
     # pass all the data for Timestream function
     return {
         "status": "done",
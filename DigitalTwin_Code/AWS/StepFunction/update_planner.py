@@ -0,0 +1,79 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Collects the TwinMaker writes of one invocation and sends them with as few calls as possible:
+#   - all property updates of an entity go into one update_entity call (all its components)
+#   - a property whose value did not change since this container wrote it a moment ago is left out
+#   - the entities are written at the same time by a small thread pool
+MAX_WORKERS = int(os.environ.get('TWIN_UPDATE_WORKERS', '4'))
+# Another warm container may have written a different value since, which this container does not
+# see. So a value only counts as unchanged for a few seconds, long enough for the messages of one
+# burst (0.5 s cadence), short enough that a value another container overwrote is written again soon
+VALUE_TTL = float(os.environ.get('TWIN_VALUE_TTL', '5'))  # seconds
+
+# the pool and the last written values live as long as the lambda container
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+last_values = {}  # (workspace, entity, component, property) -> (value, monotonic time)
+
+
+class UpdatePlanner:
+    def __init__(self, workspace_id):
+        self.workspace_id = workspace_id
+        self.entities = {}          # entity id -> component name -> component update
+        self.timestamp_keys = {}    # entity id -> timestamp cache keys to forget if the write fails
+        self.skipped = 0
+
+    def _unchanged(self, entity_id, component_name, property_name, value):
+        entry = last_values.get((self.workspace_id, entity_id, component_name, property_name))
+        return entry is not None and entry[0] == value and time.monotonic() - entry[1] <= VALUE_TTL
+
+    def add(self, entity_id, component_name, property_updates, component_type_id=None, timestamp_key=None):
+        # property_updates: {name: {"value": {...}}} like in update_entity
+        changed = {}
+        for property_name, property_update in property_updates.items():
+            if self._unchanged(entity_id, component_name, property_name, property_update.get("value")):
+                self.skipped += 1
+            else:
+                changed[property_name] = property_update
+        if not changed:
+            return
+
+        components = self.entities.setdefault(entity_id, {})
+        component = components.setdefault(component_name, {"updateType": "UPDATE", "propertyUpdates": {}})
+        if component_type_id:
+            component["componentTypeId"] = component_type_id
+        component["propertyUpdates"].update(changed)
+        if timestamp_key:
+            self.timestamp_keys.setdefault(entity_id, []).append(timestamp_key)
+
+    def send(self, update_entity, invalidate=None):
+        # update_entity(workspace_id, entity_id, component_updates) -> True if written
+        # invalidate(timestamp_key) is called for the timestamps of a failed write (TimestampCache.release)
+        # returns the number of update_entity calls
+        futures = {
+            entity_id: executor.submit(update_entity, self.workspace_id, entity_id, components)
+            for entity_id, components in self.entities.items()
+        }
+        for entity_id, future in futures.items():
+            if future.result():
+                self._remember(entity_id)
+                continue
+            # the write failed, the twin may have older values than we think
+            for key in [key for key in last_values if key[0] == self.workspace_id and key[1] == entity_id]:
+                del last_values[key]
+            if invalidate:
+                for timestamp_key in self.timestamp_keys.get(entity_id, []):
+                    invalidate(timestamp_key)
+        if self.skipped:
+            logger.info(f"Skipped {self.skipped} unchanged twin properties")
+        return len(futures)
+
+    def _remember(self, entity_id):
+        now = time.monotonic()
+        for component_name, component in self.entities[entity_id].items():
+            for property_name, property_update in component["propertyUpdates"].items():
+                last_values[(self.workspace_id, entity_id, component_name, property_name)] = (property_update.get("value"), now)
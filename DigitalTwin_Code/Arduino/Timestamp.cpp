@@ -35,4 +35,14 @@ String getTimestamp() {
     ms
   );
   return String(buf);
-}
\ No newline at end of file
+}
+
+bool getEpochTime(uint32_t &seconds, uint16_t &ms) {
+  time_t now = time(nullptr);
+  if (now < 24 * 3600) {
+    return false;
+  }
+  seconds = (uint32_t)now;
+  ms = (uint16_t)(millis() % 1000);
+  return true;
+}
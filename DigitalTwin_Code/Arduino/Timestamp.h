@@ -8,4 +8,7 @@ void initTimestamp();
 
 String getTimestamp();
 
+// unix seconds + milliseconds, false if the time is not synced yet
+bool getEpochTime(uint32_t &seconds, uint16_t &ms);
+
 #endif
@@ -26,6 +26,20 @@ static const char* wifiPassword = "************";
 #define SERVICE_UUID        "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
 #define CHARACTERISTIC_UUID "beb5483e-36e1-4688-b7f5-ea07361b26a8"
 
+// 1 = compact 18 byte binary payload (see ble_payload.py on the Raspberry Pi), 0 = JSON
+#define USE_BINARY_PAYLOAD 1
+
+struct __attribute__((packed)) SensorPacket {
+  uint8_t  version;      // 1
+  uint8_t  flags;        // bit0 motion, bit1 temp/hum, bit2 light, bit3 co2, bit4 time valid
+  int16_t  temperature;  // 0.01 C
+  uint16_t humidity;     // 0.01 %
+  uint32_t light;        // 0.01 lux
+  uint16_t co2;          // ppm
+  uint32_t time;         // unix seconds
+  uint16_t timeMs;
+};
+
 // device name
 const char* BLE_DEVICE_NAME = "ESP32_BLE_Server_2";
 // const char* BLE_DEVICE_NAME = "ESP32_BLE_Server_1";    // <------Uncomment for second device
@@ -123,6 +137,31 @@ void publishSensorData() {
                 temperature, humidity, lightValue,
                 motion ? "YES" : "NO", co2);
 
+#if USE_BINARY_PAYLOAD
+  SensorPacket packet = {};
+  packet.version = 1;
+  if (motion) packet.flags |= 0x01;
+  if (!isnan(temperature) && !isnan(humidity)) {
+    packet.flags |= 0x02;
+    packet.temperature = (int16_t)lroundf(temperature * 100.0f);
+    packet.humidity    = (uint16_t)lroundf(humidity * 100.0f);
+  }
+  if (!isnan(lightValue) && lightValue >= 0) {
+    packet.flags |= 0x04;
+    packet.light = (uint32_t)lroundf(lightValue * 100.0f);
+  }
+  if (!isnan(co2) && co2 >= 0) {
+    packet.flags |= 0x08;
+    packet.co2 = (uint16_t)lroundf(co2);
+  }
+  if (getEpochTime(packet.time, packet.timeMs)) {
+    packet.flags |= 0x10;
+  }
+
+  // send to Raspberry Pi via BLE, fits in a single notification
+  pCharacteristic->setValue((uint8_t*)&packet, sizeof(packet));
+  pCharacteristic->notify();
+#else
   String timestamp = getTimestamp();
 
   // make JSON payload
@@ -143,4 +182,5 @@ void publishSensorData() {
   // send to Raspberry Pi via BLE
   pCharacteristic->setValue((uint8_t*)messageBuffer, strlen(messageBuffer));
   pCharacteristic->notify();
+#endif
 }
@@ -1,18 +1,47 @@
-import smbus
 import time
+import struct
 import threading
+import hardware
+from door_fusion import DoorFusion
 
-GYRO_ZOUT_H = 0x47
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MPU_ADDRESS  = 0x68
+SMPLRT_DIV   = 0x19
+CONFIG       = 0x1A
+GYRO_CONFIG  = 0x1B
+FIFO_EN      = 0x23
+INT_STATUS   = 0x3A
+GYRO_ZOUT_H  = 0x47
+USER_CTRL    = 0x6A
+PWR_MGMT_1   = 0x6B
+FIFO_COUNT_H = 0x72
+FIFO_R_W     = 0x74
+WHO_AM_I     = 0x75
+
+GYRO_SCALE = 131.0        # LSB per degree/s at +-250 degree/s
+SAMPLE_RATE_HZ = 200      # fixed output data rate of the gyro
+POLL_INTERVAL = 0.05      # seconds between FIFO reads, the samples in between are integrated as one batch
+I2C_BLOCK_MAX = 32        # smbus can read at most 32 bytes per block read
+FIFO_SIZE = 1024
+
+# drift compensation with the hall sensor as zero anchor (door_fusion.py),
+# False = plain gyro integration with the fixed calibration numbers
+FUSION_ENABLED = True
 
 bus = None
 mpu_available = False
+fifo_mode = False
 
 def init_mpu6050():
     global bus, mpu_available
     try:
-        bus = smbus.SMBus(1)
-        bus.write_byte_data(0x68, 0x6B, 0)
-        bus.read_byte_data(0x68, 0x75)
+        bus = hardware.open_i2c(1)   # smbus or the simulated MPU6050
+        bus.write_byte_data(MPU_ADDRESS, PWR_MGMT_1, 0)
+        bus.read_byte_data(MPU_ADDRESS, WHO_AM_I)
         mpu_available = True
         print("MPU6050 initialized successfully")
         return True
@@ -21,6 +50,27 @@ def init_mpu6050():
         mpu_available = False
         return False
 
+def configure_fifo(rate_hz=SAMPLE_RATE_HZ):
+    # gyro runs at 1 kHz with the low pass filter on, divide down to rate_hz
+    # and let the MPU6050 collect the Z gyro samples in its FIFO
+    global fifo_mode
+    try:
+        bus.write_byte_data(MPU_ADDRESS, CONFIG, 0x03)             # DLPF 44 Hz -> 1 kHz gyro rate
+        bus.write_byte_data(MPU_ADDRESS, SMPLRT_DIV, int(1000 / rate_hz) - 1)
+        bus.write_byte_data(MPU_ADDRESS, GYRO_CONFIG, 0x00)        # +-250 degree/s
+        bus.write_byte_data(MPU_ADDRESS, FIFO_EN, 0x10)            # only gyro Z into the FIFO
+        reset_fifo()
+        fifo_mode = True
+        print(f"MPU6050 FIFO enabled at {rate_hz} Hz")
+    except Exception as e:
+        print(f"Could not enable MPU6050 FIFO, reading registers directly: {e}")
+        fifo_mode = False
+    return fifo_mode
+
+def reset_fifo():
+    bus.write_byte_data(MPU_ADDRESS, USER_CTRL, 0x04)  # FIFO reset
+    bus.write_byte_data(MPU_ADDRESS, USER_CTRL, 0x40)  # FIFO enable
+
 sensor_data = {
     "gyro": 0.0,
     "angle": 0.0
@@ -30,13 +80,18 @@ gyro_z_offset = 0.0
 angle = 0.0
 last_time = time.time()
 thread_running = False
+sensor_ready = False
 sensor_thread = None
+_angle_lock = threading.Lock()
+fusion = DoorFusion()
+door_closed = None  # set by the hall sensor, see set_door_closed()
+peak_gyro = 0.0     # largest |rate| since the last take_peak_gyro(), for slam detection
+samples_read = 0    # gyro samples integrated so far, for the sample rate (gateway_profile.py)
 
 def read_word(reg):
-      
+    # one block read for high + low byte
     try:
-        high = bus.read_byte_data(0x68, reg)
-        low = bus.read_byte_data(0x68, reg + 1)
+        high, low = bus.read_i2c_block_data(MPU_ADDRESS, reg, 2)
         value = (high << 8) | low
         if value >= 32768:
             value -= 65536
@@ -45,74 +100,194 @@ def read_word(reg):
         print(f"Error reading from MPU6050: {e}")
         return 0
 
+def read_fifo_raw():
+    # all complete samples waiting in the FIFO as raw big endian bytes
+    high, low = bus.read_i2c_block_data(MPU_ADDRESS, FIFO_COUNT_H, 2)
+    count = (high << 8) | low
+    if count >= FIFO_SIZE or bus.read_byte_data(MPU_ADDRESS, INT_STATUS) & 0x10:
+        # FIFO overflowed, the samples are not continuous anymore
+        print("MPU6050 FIFO overflow, resetting")
+        reset_fifo()
+        return b""
+    count -= count % 2
+    data = bytearray()
+    while len(data) < count:
+        chunk = min(I2C_BLOCK_MAX, count - len(data))
+        data.extend(bus.read_i2c_block_data(MPU_ADDRESS, FIFO_R_W, chunk))
+    return bytes(data)
+
+def raw_to_rates(data):
+    # raw FIFO bytes -> list/array of degree/s (offset not removed)
+    if np is not None:
+        return np.frombuffer(data, dtype=">i2") / GYRO_SCALE
+    return [v / GYRO_SCALE for v in struct.unpack(f">{len(data) // 2}h", data)]
+
+def read_gyro_batch():
+    # returns (rates in degree/s, dt per sample)
+    global last_time
+    if fifo_mode:
+        try:
+            return raw_to_rates(read_fifo_raw()), 1.0 / SAMPLE_RATE_HZ
+        except Exception as e:
+            print(f"Error reading MPU6050 FIFO: {e}")
+            return [], 0.0
+    current_time = time.time()
+    dt = current_time - last_time
+    last_time = current_time
+    return [read_word(GYRO_ZOUT_H) / GYRO_SCALE], dt
+
 def calibrate_gyro_z_offset(samples=1000):
     global gyro_z_offset
-        
+    if not mpu_available:
+        gyro_z_offset = 0.0
+        return
+
     print("Calibrating gyroscope Z-axis offset. Keep sensor still.")
     gyro_z_sum = 0.0
-    for _ in range(samples):
-        z_gyro = read_word(GYRO_ZOUT_H) / 131.0  # Convert raw to degrees
-        gyro_z_sum += z_gyro
-        time.sleep(0.000001) # LESS SLEEP MORE ACCURATE
-    gyro_z_offset = gyro_z_sum / samples
+    collected = 0
+    if fifo_mode:
+        # the FIFO returns nothing on I2C errors and overflows, so it gets twice the time
+        # the samples need and the register reads below collect the rest
+        deadline = time.monotonic() + 2.0 * samples / SAMPLE_RATE_HZ + 1.0
+        while collected < samples and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            rates, _ = read_gyro_batch()
+            gyro_z_sum += float(sum(rates))
+            collected += len(rates)
+        if collected < samples:
+            print(f"MPU6050 FIFO gave only {collected} of {samples} calibration samples, reading the register")
+    for _ in range(samples - collected):
+        gyro_z_sum += read_word(GYRO_ZOUT_H) / GYRO_SCALE
+        collected += 1
+        time.sleep(1.0 / SAMPLE_RATE_HZ)
+    gyro_z_offset = gyro_z_sum / collected
+    fusion.bias = gyro_z_offset
     print(f"Gyro Z Offset: {gyro_z_offset}")
 
-def update_sensor_data():
-    global angle, last_time, sensor_data, gyro_z_offset, thread_running
-    last_time = time.time()  # Reset the timer when thread starts
-    
-    while thread_running:
-        # Gyro Z raw data converted to degrees - offset
-        z_gyro = (read_word(GYRO_ZOUT_H) / 131.0) - gyro_z_offset
+def integrate_batch(rates, dt):
+    # integrate a whole batch of samples at once and publish one consistent snapshot
+    global angle, sensor_data, peak_gyro, samples_read
+    if len(rates) == 0:
+        return
+    samples_read += len(rates)
+    if FUSION_ENABLED:
+        if np is not None and fifo_mode:
+            rates = rates.tolist()
+        with _angle_lock:
+            peak_gyro = max(peak_gyro, max(abs(r - fusion.bias) for r in rates))
+            angle = fusion.update(rates, dt, closed=door_closed)
+        sensor_data = {"gyro": rates[-1] - fusion.bias, "angle": angle}
+        return
 
-        # Calculate time difference for integration
-        current_time = time.time()
-        dt = current_time - last_time
-        last_time = current_time
+    if np is not None and fifo_mode:
+        corrected = rates - gyro_z_offset
+        delta = float(corrected.sum()) * dt
+        z_gyro = float(corrected[-1])
+        batch_peak = float(np.abs(corrected).max())
+    else:
+        corrected = [r - gyro_z_offset for r in rates]
+        delta = sum(corrected) * dt
+        z_gyro = corrected[-1]
+        batch_peak = max(abs(r) for r in corrected)
 
-        angle += z_gyro * dt
-        angle_mod = (angle + 10 % 360) -11.1  
+    with _angle_lock:
+        peak_gyro = max(peak_gyro, batch_peak)
+        angle += delta
+        angle_mod = (angle + 10 % 360) -11.1
         # Calibrated numbers. Depends on the initial possition and angle of the sensor.
 
-        sensor_data["gyro"] = z_gyro
-        sensor_data["angle"] = angle_mod
+    # replace the whole dict so readers never see gyro and angle from different batches
+    sensor_data = {"gyro": z_gyro, "angle": angle_mod}
+
+def setup_sensor():
+    # init, FIFO and calibration, used by the sensor thread and the asyncio runtime
+    global angle, last_time, sensor_ready
 
-def start_sensor_thread():
-    global thread_running, sensor_thread, angle, last_time
-    
-    if thread_running:
-        print("Sensor thread already running")
-        return
-    
     # Initialize MPU6050
     if not init_mpu6050():
         print("MPU6050 not found")
-    
+    else:
+        configure_fifo()
+
     # Reset angle
     angle = 0.0
     last_time = time.time()
-    
+
     calibrate_gyro_z_offset()
+    if fifo_mode:
+        reset_fifo()  # drop the samples collected during calibration
+    hardware.sensor_calibrated()
+    sensor_ready = True
+
+def poll_interval():
+    return POLL_INTERVAL if fifo_mode else 1.0 / SAMPLE_RATE_HZ
+
+def poll_sensor():
+    # read everything the sensor collected since the last call and integrate it
+    if mpu_available:
+        rates, dt = read_gyro_batch()
+        integrate_batch(rates, dt)
+
+def update_sensor_data():
+    global last_time, thread_running
+    last_time = time.time()  # Reset the timer when thread starts
+    interval = poll_interval()
+
+    next_poll = time.monotonic()
+    while thread_running:
+        poll_sensor()
+
+        # sleep until the next poll instead of spinning on the bus
+        next_poll += interval
+        delay = next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_poll = time.monotonic()
+
+def start_sensor_thread():
+    global thread_running, sensor_thread
+
+    if thread_running:
+        print("Sensor thread already running")
+        return
+
+    setup_sensor()
     thread_running = True
     sensor_thread = threading.Thread(target=update_sensor_data, daemon=True)
     sensor_thread.start()
     print("Sensor thread started")
 
 def stop_sensor_thread():
-    global thread_running
+    global thread_running, sensor_ready
     thread_running = False
+    sensor_ready = False
     print("Sensor thread stopped")
 
 def reset_angle():
     global angle
-    angle = 0.0
+    with _angle_lock:
+        angle = 0.0
+        fusion.reset()
     print("Angle reset to zero")
 
+def set_door_closed(closed):
+    # called with the hall sensor state, closed door = zero angle anchor for the fusion
+    global door_closed
+    door_closed = closed
+
+def take_peak_gyro():
+    # peak |gyro| since the last call, a slam is often shorter than the publish interval
+    global peak_gyro
+    with _angle_lock:
+        peak, peak_gyro = peak_gyro, 0.0
+    return peak
+
 def read_acc():
-    if not thread_running:
-        print("Warning: Sensor thread not running. Call start_sensor_thread() first.")
+    if not sensor_ready:
+        print("Warning: Sensor not running. Call start_sensor_thread() first.")
         return {"gyro": 0.0, "angle": 0.0}
-    
+
     return sensor_data.copy()
 
 if __name__ == "__main__":
@@ -120,8 +295,8 @@ if __name__ == "__main__":
     try:
         while True:
             data = read_acc()
-            print(f"Gyro: {data['gyro']:.2f}°/s, Angle: {data['angle']:.2f}° (MPU Available: {mpu_available})")
+            print(f"Gyro: {data['gyro']:.2f}°/s, Angle: {data['angle']:.2f}° (MPU Available: {mpu_available}, FIFO: {fifo_mode})")
             time.sleep(0.1)  ## less for more accuracy
     except KeyboardInterrupt:
         print("Exiting...")
-        stop_sensor_thread()
\ No newline at end of file
+        stop_sensor_thread()
@@ -0,0 +1,111 @@
+# Anomaly rules shared by the DetectAnomalies lambda and the Raspberry Pi gateway.
+# The same file is used in the AWS StepFunction lambdas and on the Raspberry Pi,
+# keep both copies identical.
+import datetime
+
+SLAM_GYRO_THRESHOLD = 65      # degree/s
+CLOSED_MAX_ANGLE = 5          # magnet says closed but |angle| is bigger -> conflict
+OPEN_MIN_ANGLE = 1            # magnet says open but |angle| is at most this -> conflict
+CO2_THRESHOLD = 2000          # ppm
+
+
+def is_slam(gyro):
+    return gyro is not None and abs(gyro) > SLAM_GYRO_THRESHOLD
+
+
+def is_sensor_conflict(magnet, angle):
+    if angle is None:
+        return False
+    if magnet and (angle > CLOSED_MAX_ANGLE or angle < -CLOSED_MAX_ANGLE):
+        # magnet says closed but angle says open
+        return True
+    if not magnet and (-OPEN_MIN_ANGLE <= angle <= OPEN_MIN_ANGLE):
+        # magnet says open but angle says closed
+        return True
+    return False
+
+
+def is_co2_too_high(co2):
+    return co2 is not None and co2 > CO2_THRESHOLD
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+
+def door_slam(gyro, timestamp=None, entity="Door"):
+    # (twin update, anomaly) for a door slam, entity = the door (topology.json in the lambdas)
+    update = {
+        "entityId": entity,
+        "componentName": "DoorComponents",
+        "property": "slammedAnomaly",
+        "value": "slammed",
+        "valueType": "stringValue"
+    }
+    anomaly = {
+        'entity': entity,
+        'type': 'door_slam',
+        'details': {
+            'gyro': gyro,
+            'timestamp': timestamp or _now()
+        }
+    }
+    return update, anomaly
+
+
+def sensor_conflict(magnet, angle, timestamp=None, entity="Door"):
+    update = {
+        "entityId": entity,
+        "componentName": "DoorComponents",
+        "property": "conflictAnomaly",
+        "value": "conflict",
+        "valueType": "stringValue"
+    }
+    anomaly = {
+        'entity': entity,
+        'type': 'sensor_conflict',
+        'details': {
+            'magnet': magnet,
+            'angle': angle,
+            'timestamp': timestamp or _now()
+        }
+    }
+    return update, anomaly
+
+
+def co2_spike(room_key, co2, timestamp=None):
+    return co2_anomaly(room_key, 'spike', co2, timestamp)
+
+
+def co2_anomaly(room_key, kind, co2, timestamp=None, score=None):
+    # kind: spike, dip, level_shift_up, level_shift_down (co2_detector.py in the lambdas)
+    too_low = kind in ('dip', 'level_shift_down')
+    update = {
+        "entityId": room_key,
+        "componentName": "RoomSensorComponent",
+        "property": "airQualityState",
+        "value": "too_low" if too_low else "too_high",
+        "valueType": "stringValue"
+    }
+    details = {
+        'co2': co2,
+        'timestamp': timestamp or _now()
+    }
+    if score is not None:
+        details['score'] = score
+    anomaly = {
+        'entity': room_key,
+        'type': f'co2_{kind}',
+        'details': details
+    }
+    return update, anomaly
+
+
+def check_door(angle, gyro, magnet, timestamp=None, entity="Door"):
+    # all door anomalies of one reading as a list of (update, anomaly)
+    found = []
+    if is_slam(gyro):
+        found.append(door_slam(gyro, timestamp, entity))
+    if is_sensor_conflict(magnet, angle):
+        found.append(sensor_conflict(magnet, angle, timestamp, entity))
+    return found
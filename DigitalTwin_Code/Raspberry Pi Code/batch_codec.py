@@ -0,0 +1,260 @@
+# Compact multi-sample envelope for the gateway payloads.
+# The same file is used on the Raspberry Pi (encode) and in the AWS
+# StepFunction lambdas (decode), keep both copies identical.
+#
+# A batch is stored column by column instead of one JSON object per sample:
+#   - timestamps: earliest timestamp in ms + uint32 offsets per sample (the Pi clock
+#                 can step back when NTP corrects it, so the first sample is not always the earliest)
+#   - numbers:    packed float32 (NaN = missing)
+#   - booleans:   one byte per sample (0, 1, 255 = missing)
+#   - strings:    run length list [[index, value], ...] (BLE timestamps repeat a lot)
+# The columns are serialized with CBOR (if cbor2 is installed) or JSON and can be
+# zlib compressed. The result is base64 encoded so it fits in a JSON MQTT message.
+import json
+import math
+import zlib
+import base64
+import calendar
+from array import array
+from datetime import datetime
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+ENVELOPE_VERSION = 1
+
+LOCAL_NUMBER_FIELDS = ["angle", "gyro"]
+LOCAL_BOOL_FIELDS = ["magnet"]
+REMOTE_NUMBER_FIELDS = ["temperature", "humidity", "light", "co2"]
+REMOTE_BOOL_FIELDS = ["motion"]
+REMOTE_STRING_FIELDS = ["timestamp"]
+
+_BOOL_MISSING = 255
+
+
+def timestamp_to_ms(timestamp):
+    # "YYYY-MM-DDTHH:MM:SS.mmmZ" -> ms since epoch
+    parsed = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
+    return calendar.timegm(parsed.timetuple()) * 1000 + parsed.microsecond // 1000
+
+
+def ms_to_timestamp(ms):
+    seconds, millis = divmod(int(ms), 1000)
+    return datetime.utcfromtimestamp(seconds).strftime("%Y-%m-%dT%H:%M:%S") + f".{millis:03d}Z"
+
+
+def _pack_numbers(values):
+    packed = array("f", (math.nan if v is None else float(v) for v in values))
+    return packed.tobytes()
+
+
+def _unpack_numbers(data):
+    values = array("f")
+    values.frombytes(data)
+    return [None if math.isnan(v) else v for v in values]
+
+
+def _pack_bools(values):
+    return bytes(_BOOL_MISSING if v is None else int(bool(v)) for v in values)
+
+
+def _unpack_bools(data):
+    return [None if b == _BOOL_MISSING else bool(b) for b in data]
+
+
+def _pack_strings(values):
+    runs = []
+    for i, value in enumerate(values):
+        if not runs or runs[-1][1] != value:
+            runs.append([i, value])
+    return runs
+
+
+def _unpack_strings(runs, count):
+    values = [None] * count
+    for n, (start, value) in enumerate(runs):
+        end = runs[n + 1][0] if n + 1 < len(runs) else count
+        for i in range(start, end):
+            values[i] = value
+    return values
+
+
+def encode_batch(samples, compress=True, use_cbor=True):
+    # samples = list of gateway payloads {"local_data": ..., "remote_data": ...}
+    times = [timestamp_to_ms(s["local_data"]["door_timestamp"]) for s in samples]
+    t0 = min(times)
+    deltas = array("I", (t - t0 for t in times))
+    devices = sorted({d for s in samples for d in s.get("remote_data", {})})
+
+    columns = {"t0": t0, "dt": deltas.tobytes(), "devices": devices}
+    for field in LOCAL_NUMBER_FIELDS:
+        columns[field] = _pack_numbers(s["local_data"].get(field) for s in samples)
+    for field in LOCAL_BOOL_FIELDS:
+        columns[field] = _pack_bools(s["local_data"].get(field) for s in samples)
+
+    for device in devices:
+        readings = [s.get("remote_data", {}).get(device, {}) for s in samples]
+        for field in REMOTE_NUMBER_FIELDS:
+            columns[f"{device}.{field}"] = _pack_numbers(r.get(field) for r in readings)
+        for field in REMOTE_BOOL_FIELDS:
+            columns[f"{device}.{field}"] = _pack_bools(r.get(field) for r in readings)
+        for field in REMOTE_STRING_FIELDS:
+            columns[f"{device}.{field}"] = _pack_strings([r.get(field) for r in readings])
+
+    if use_cbor and cbor2 is not None:
+        encoding = "cbor"
+        body = cbor2.dumps(columns)
+    else:
+        encoding = "json"
+        body = json.dumps({
+            name: base64.b64encode(value).decode() if isinstance(value, bytes) else value
+            for name, value in columns.items()
+        }, separators=(",", ":")).encode()
+
+    if compress:
+        body = zlib.compress(body)
+
+    return {
+        "batch": {
+            "v": ENVELOPE_VERSION,
+            "n": len(samples),
+            "enc": encoding,
+            "zlib": compress,
+            "data": base64.b64encode(body).decode()
+        }
+    }
+
+
+def decode_batch(envelope):
+    # inverse of encode_batch, returns the list of gateway payloads
+    batch = envelope["batch"]
+    if batch.get("v") != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported batch version: {batch.get('v')}")
+
+    body = base64.b64decode(batch["data"])
+    if batch.get("zlib"):
+        body = zlib.decompress(body)
+
+    if batch["enc"] == "cbor":
+        if cbor2 is None:
+            raise ValueError("Batch is CBOR encoded but cbor2 is not installed")
+        columns = cbor2.loads(body)
+    else:
+        columns = json.loads(body)
+        for name, value in columns.items():
+            if isinstance(value, str):
+                columns[name] = base64.b64decode(value)
+
+    count = batch["n"]
+    deltas = array("I")
+    deltas.frombytes(columns["dt"])
+
+    local_values = {}
+    for field in LOCAL_NUMBER_FIELDS:
+        local_values[field] = _unpack_numbers(columns[field])
+    for field in LOCAL_BOOL_FIELDS:
+        local_values[field] = _unpack_bools(columns[field])
+
+    remote_values = {}
+    for device in columns["devices"]:
+        for field in REMOTE_NUMBER_FIELDS:
+            remote_values[(device, field)] = _unpack_numbers(columns[f"{device}.{field}"])
+        for field in REMOTE_BOOL_FIELDS:
+            remote_values[(device, field)] = _unpack_bools(columns[f"{device}.{field}"])
+        for field in REMOTE_STRING_FIELDS:
+            remote_values[(device, field)] = _unpack_strings(columns[f"{device}.{field}"], count)
+
+    samples = []
+    for i in range(count):
+        local_data = {"door_timestamp": ms_to_timestamp(columns["t0"] + deltas[i])}
+        for field, values in local_values.items():
+            local_data[field] = values[i]
+
+        remote_data = {device: {} for device in columns["devices"]}
+        for (device, field), values in remote_values.items():
+            remote_data[device][field] = values[i]
+
+        samples.append({"local_data": local_data, "remote_data": remote_data})
+    return samples
+
+
+def is_batch(event):
+    return isinstance(event, dict) and isinstance(event.get("batch"), dict)
+
+
+def flatten_sample(sample):
+    # same shape the IoT rule builds from a single gateway message
+    local_data = sample["local_data"]
+    event = {
+        "door_timestamp": local_data.get("door_timestamp"),
+        "angle": local_data.get("angle"),
+        "gyro": local_data.get("gyro"),
+        "magnet": local_data.get("magnet"),
+        "doorInfo": {
+            "angle": local_data.get("angle"),
+            "gyro": local_data.get("gyro"),
+            "magnet": local_data.get("magnet")
+        },
+        "roomsInfo": {}
+    }
+    if sample.get("gateway_id"):
+        event["gateway_id"] = sample["gateway_id"]
+    # which room a device measures depends on the gateway (topology.json), the handlers map
+    # the device fields to rooms, so roomsInfo stays empty here
+    for device, reading in sample.get("remote_data", {}).items():
+        for field, value in reading.items():
+            event[f"{device}_{field}"] = value
+    return event
+
+
+def is_multi(event):
+    # more than one gateway message in one event: a batch envelope, a list of readings
+    # ([...] or {"readings": [...]}) or SQS / Kinesis records ({"Records": [...]})
+    if isinstance(event, list):
+        return True
+    return is_batch(event) or (isinstance(event, dict) and
+                               (isinstance(event.get("readings"), list) or isinstance(event.get("Records"), list)))
+
+
+def _record_message(record):
+    # the gateway message inside an SQS or Kinesis record
+    if "body" in record:
+        return json.loads(record["body"])
+    if "kinesis" in record:
+        return json.loads(base64.b64decode(record["kinesis"]["data"]))
+    return record
+
+
+def _tag_gateway(samples, gateway_id):
+    # the IoT rule adds the gateway id to the message, every sample of it belongs to that gateway
+    if gateway_id:
+        for sample in samples:
+            sample.setdefault("gateway_id", gateway_id)
+    return samples
+
+
+def expand_event(event):
+    # lambdas call this on their input: a batch turns into one event per sample,
+    # a normal message stays a single event
+    if is_batch(event):
+        return _tag_gateway([flatten_sample(sample) for sample in decode_batch(event)], event.get("gateway_id"))
+    if isinstance(event, list):
+        messages = event
+    elif isinstance(event, dict) and isinstance(event.get("readings"), list):
+        messages = event["readings"]
+    elif isinstance(event, dict) and isinstance(event.get("Records"), list):
+        messages = [_record_message(record) for record in event["Records"]]
+    else:
+        return [event]
+
+    samples = []
+    for message in messages:
+        if isinstance(message, dict) and "local_data" in message:
+            samples.append(flatten_sample(message))   # raw gateway payload
+        else:
+            samples.extend(expand_event(message))
+    # queues do not keep the order, the last sample has to be the newest state
+    samples.sort(key=lambda sample: sample.get("door_timestamp") or "")
+    return _tag_gateway(samples, event.get("gateway_id") if isinstance(event, dict) else None)
@@ -0,0 +1,101 @@
+# Decoder for the BLE characteristic payload of the ESP32 nodes.
+#
+# Binary format, version 1, little endian, 18 bytes (fits the 20 byte notification of the default MTU):
+#   B  version        1
+#   B  flags          bit 0 motion, bit 1 temperature/humidity valid, bit 2 light valid,
+#                     bit 3 co2 valid, bit 4 time valid
+#   h  temperature    0.01 degree C
+#   H  humidity       0.01 %
+#   I  light          0.01 lux
+#   H  co2            ppm
+#   I  time           unix seconds (UTC)
+#   H  time ms        milliseconds
+#
+# The old JSON payload ({"temp_1": ..., "time_1": ...}) is still understood.
+import json
+import struct
+import time
+
+VERSION = 1
+BINARY_FORMAT = struct.Struct("<BBhHIHIH")
+
+FLAG_MOTION = 0x01
+FLAG_CLIMATE = 0x02
+FLAG_LIGHT = 0x04
+FLAG_CO2 = 0x08
+FLAG_TIME = 0x10
+
+NO_TIMESTAMP = "0000-00-00T00:00:00.000Z"  # what the ESP32 sends without NTP time
+
+# ESP32 json keys are "<prefix>_<suffix>", e.g. temp_1
+JSON_FIELDS = {
+    "temperature": "temp",
+    "humidity":    "hum",
+    "light":       "light",
+    "motion":      "motion",
+    "co2":         "co2",
+    "timestamp":   "time"
+}
+
+
+def encode_binary(temperature, humidity, light, motion, co2, epoch_seconds, millis):
+    # same layout the ESP32 builds, used for tests and benchmarks
+    flags = FLAG_MOTION if motion else 0
+    if temperature is not None and humidity is not None:
+        flags |= FLAG_CLIMATE
+    if light is not None:
+        flags |= FLAG_LIGHT
+    if co2 is not None:
+        flags |= FLAG_CO2
+    if epoch_seconds:
+        flags |= FLAG_TIME
+    return BINARY_FORMAT.pack(
+        VERSION, flags,
+        round((temperature or 0) * 100), round((humidity or 0) * 100),
+        round((light or 0) * 100), round(co2 or 0),
+        epoch_seconds or 0, millis or 0
+    )
+
+
+_time_cache = (None, "")  # last seconds value and its formatted date/time
+
+
+def _format_time(seconds, millis):
+    global _time_cache
+    cached_seconds, prefix = _time_cache
+    if cached_seconds != seconds:
+        t = time.gmtime(seconds)
+        prefix = (f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T"
+                  f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}")
+        _time_cache = (seconds, prefix)
+    return f"{prefix}.{millis:03d}Z"
+
+
+def decode_binary(data):
+    view = memoryview(data)
+    version, flags, temp, hum, light, co2, seconds, millis = BINARY_FORMAT.unpack_from(view)
+    if version != VERSION:
+        raise ValueError(f"Unknown BLE payload version {version}")
+    climate = flags & FLAG_CLIMATE
+    return {
+        "temperature": temp / 100.0 if climate else None,
+        "humidity":    hum / 100.0 if climate else None,
+        "light":       light / 100.0 if flags & FLAG_LIGHT else None,
+        "motion":      bool(flags & FLAG_MOTION),
+        "co2":         float(co2) if flags & FLAG_CO2 else None,
+        "timestamp":   _format_time(seconds, millis) if flags & FLAG_TIME else NO_TIMESTAMP
+    }
+
+
+def decode_json(data, suffix):
+    payload = json.loads(bytes(data).decode())
+    if f"temp_{suffix}" not in payload:
+        return None
+    return {field: payload.get(f"{prefix}_{suffix}") for field, prefix in JSON_FIELDS.items()}
+
+
+def decode(data, suffix):
+    # returns the reading as a dict, or None if the payload is not for this device
+    if data[:1] == b"{":
+        return decode_json(data, suffix)
+    return decode_binary(data)
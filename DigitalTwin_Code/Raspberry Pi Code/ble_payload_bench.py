@@ -0,0 +1,32 @@
+# Microbenchmark: JSON vs binary BLE payload (bytes per reading and decode throughput)
+#   python3 ble_payload_bench.py
+import json
+import time
+import timeit
+
+import ble_payload
+
+NUMBER = 100000
+
+
+def main():
+    now = time.time()
+    json_data = json.dumps({
+        "time_1": ble_payload._format_time(int(now), 123),
+        "temp_1": 21.37, "hum_1": 43.12, "light_1": 312.5,
+        "motion_1": True, "co2_1": 612.0
+    }, separators=(",", ":")).encode()
+    binary_data = ble_payload.encode_binary(21.37, 43.12, 312.5, True, 612.0, int(now), 123)
+
+    # both have to give the same reading
+    assert ble_payload.decode(json_data, "1") == ble_payload.decode(binary_data, "1")
+
+    print(f"{'format':8s} {'bytes':>6s} {'notifications@MTU23':>20s} {'decodes/s':>12s} {'us/decode':>10s}")
+    for name, data in [("json", json_data), ("binary", binary_data)]:
+        seconds = timeit.timeit(lambda: ble_payload.decode(data, "1"), number=NUMBER)
+        notifications = -(-len(data) // 20)  # 20 byte payload per notification with the default MTU
+        print(f"{name:8s} {len(data):6d} {notifications:20d} {NUMBER / seconds:12.0f} {seconds / NUMBER * 1e6:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
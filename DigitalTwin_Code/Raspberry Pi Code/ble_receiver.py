@@ -1,110 +1,170 @@
+import os
 import json
 import asyncio
 import threading
-from bleak import BleakScanner, BleakClient
-
-device_1_temperature = None
-device_1_humidity    = None
-device_1_light       = None
-device_1_motion      = None
-device_1_co2         = None
-device_1_timestamp   = None
-
-device_2_temperature = None
-device_2_humidity    = None
-device_2_light       = None
-device_2_motion      = None
-device_2_co2         = None
-device_2_timestamp   = None
+from snapshot_store import SnapshotStore, READING_FIELDS
+import ble_payload
+import hardware
 
 SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
-BLE_DEVICE_NAME_1 = "ESP32_BLE_Server_1"
-BLE_DEVICE_NAME_2 = "ESP32_BLE_Server_2"
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ble_devices.json")
 TIMEOUT = 15.0  # seconds
+SCAN_TIMEOUT = 20.0
+MAX_BACKOFF = 60.0
 
+devices = []            # configured devices, see ble_devices.json
+store = SnapshotStore()  # device key -> latest Reading
 _clients = {}
+_loop = None
+_stopping = False
 
-def _notification_handler(device_name):
+def load_config(path=CONFIG_FILE):
+    global devices, SCAN_TIMEOUT
+    with open(path) as f:
+        config = json.load(f)
+    SCAN_TIMEOUT = config.get("scan_timeout", SCAN_TIMEOUT)
+    devices = config["devices"]
+    return devices
+
+def get_remote_data(snapshot=None):
+    # latest reading of every configured device, same shape as the "remote_data" payload
+    if snapshot is None:
+        snapshot = store.snapshot()
+    remote_data = {}
+    for device in devices:
+        reading = snapshot.get(device["key"])
+        remote_data[device["key"]] = reading.as_dict() if reading else {field: None for field in READING_FIELDS}
+    return remote_data
+
+def _notification_handler(device):
+    suffix = device["suffix"]
     def handler(sender, data):
-        global device_1_temperature, device_1_humidity, device_1_light, device_1_motion, device_1_co2, device_1_timestamp
-        global device_2_temperature, device_2_humidity, device_2_light, device_2_motion, device_2_co2, device_2_timestamp
         try:
-            # parse json from ESP32
-            payload = json.loads(data.decode())
-            if device_name == BLE_DEVICE_NAME_1 and "temp_1" in payload:
-                device_1_temperature = payload.get("temp_1")
-                device_1_humidity    = payload.get("hum_1")
-                device_1_light       = payload.get("light_1")
-                device_1_motion      = payload.get("motion_1")
-                device_1_co2         = payload.get("co2_1")
-                device_1_timestamp   = payload.get("time_1")
-                print("[BLE Receiver] Updated data for Device_1")
-            elif device_name == BLE_DEVICE_NAME_2 and "temp_2" in payload:
-                device_2_temperature = payload.get("temp_2")
-                device_2_humidity    = payload.get("hum_2")
-                device_2_light       = payload.get("light_2")
-                device_2_motion      = payload.get("motion_2")
-                device_2_co2         = payload.get("co2_2")
-                device_2_timestamp   = payload.get("time_2")
-                print("[BLE Receiver] Updated data for Device_2")
+            # binary payload from the ESP32, json for older firmware (see ble_payload.py)
+            reading = ble_payload.decode(data, suffix)
+            if reading is not None:
+                store.publish(device["key"], **reading)
+                print(f"[BLE Receiver] Updated data for {device['key']}")
         except Exception as e:
-            print(f"[BLE Receiver] Notification handling error for {device_name}: {e}")
+            print(f"[BLE Receiver] Notification handling error for {device['name']}: {e}")
     return handler
 
-async def _ble_loop():
-    global _clients
-    # CONNECTING TO DEVICE 1 ------------------------------------------------
-    print(f"[BLE Receiver] Scanning for '{BLE_DEVICE_NAME_1}'...")
-    device1 = await BleakScanner.find_device_by_name(BLE_DEVICE_NAME_1, timeout=20.0)
-    if device1 is None:
-        print("[BLE Receiver] Device_1 not found!")
-    else:
-        client1 = BleakClient(device1)
-        try:
-            await client1.connect(timeout=TIMEOUT)
-            await client1.start_notify(CHARACTERISTIC_UUID, _notification_handler(BLE_DEVICE_NAME_1))
-            _clients[BLE_DEVICE_NAME_1] = client1
-            print(f"[BLE Receiver] Connected to Device_1 at {device1.address}")
-        except Exception as e:
-            print(f"[BLE Receiver] Error connecting to Device_1: {e}")
-
-    # CONNECTING TO DEVICE 2 ------------------------------------------------
-    print(f"[BLE Receiver] Scanning for '{BLE_DEVICE_NAME_2}'...")
-    device2 = await BleakScanner.find_device_by_name(BLE_DEVICE_NAME_2, timeout=20.0)
-    if device2 is None:
-        print("[BLE Receiver] Device_2 not found!")
-    else:
-        client2 = BleakClient(device2)
+async def _scan_all(first_seen):
+    # one scan for all configured names instead of one scan per device,
+    # every device can connect as soon as it was seen
+    from bleak import BleakScanner
+    pending = dict(first_seen)
+
+    def detection(ble_device, advertisement_data):
+        name = ble_device.name or advertisement_data.local_name
+        future = pending.pop(name, None)
+        if future is not None and not future.done():
+            future.set_result(ble_device)
+
+    print(f"[BLE Receiver] Scanning for {sorted(first_seen)}...")
+    async with BleakScanner(detection_callback=detection):
+        await asyncio.wait(list(first_seen.values()), timeout=SCAN_TIMEOUT)
+    if pending:
+        print(f"[BLE Receiver] Not found in first scan: {sorted(pending)}")
+    for future in pending.values():
+        if not future.done():
+            future.set_result(None)
+
+async def _maintain_connection(device, first_seen):
+    # connect, wait for a disconnect, reconnect with exponential backoff
+    from bleak import BleakScanner, BleakClient
+    name = device["name"]
+    ble_device = await first_seen
+    backoff = 1.0
+    while not _stopping:
+        if ble_device is None:
+            ble_device = await BleakScanner.find_device_by_name(name, timeout=SCAN_TIMEOUT)
+            if ble_device is None:
+                print(f"[BLE Receiver] {name} not found, retrying in {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+        disconnected = asyncio.Event()
+        client = BleakClient(ble_device, disconnected_callback=lambda c: disconnected.set())
         try:
-            await client2.connect(timeout=TIMEOUT)
-            await client2.start_notify(CHARACTERISTIC_UUID, _notification_handler(BLE_DEVICE_NAME_2))
-            _clients[BLE_DEVICE_NAME_2] = client2
-            print(f"[BLE Receiver] Connected to Device_2 at {device2.address}")
+            await client.connect(timeout=TIMEOUT)
+            await client.start_notify(CHARACTERISTIC_UUID, _notification_handler(device))
+            _clients[name] = client
+            print(f"[BLE Receiver] Connected to {name} at {ble_device.address}")
+            backoff = 1.0
+            await disconnected.wait()
+            print(f"[BLE Receiver] {name} disconnected")
         except Exception as e:
-            print(f"[BLE Receiver] Error connecting to Device_2: {e}")
+            print(f"[BLE Receiver] Error connecting to {name}: {e}")
+            ble_device = None  # scan again, the device might be gone
+        finally:
+            _clients.pop(name, None)
+            # e.g. connected but start_notify failed, the connection would stay open otherwise
+            if client.is_connected:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
 
-    while True:
-        await asyncio.sleep(1)
+        if not _stopping:
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+async def run_ble_manager():
+    # runs until cancelled or stop_ble()/shutdown_ble() is called, can run in any event loop
+    global _loop, _stopping
+    _loop = asyncio.get_running_loop()
+    _stopping = False
+    if not devices:
+        load_config()
+    if hardware.simulated("bleak"):
+        # no BLE adapter / bleak: simulated ESP32s, same notification handler
+        import sim_backends
+        await sim_backends.run_ble_devices(devices, _notification_handler, lambda: _stopping)
+        return
+    first_seen = {device["name"]: _loop.create_future() for device in devices}
+    await asyncio.gather(
+        _scan_all(first_seen),
+        *[_maintain_connection(device, first_seen[device["name"]]) for device in devices]
+    )
 
 _ble_thread = None
 
 def init_ble():
-    global _ble_thread
+    global _ble_thread, _stopping
     print("BLE initializing...")
+    _stopping = False
+    load_config()
     _ble_thread = threading.Thread(target=run_ble, daemon=True)
     _ble_thread.start()
 
 def run_ble():
-    asyncio.run(_ble_loop())
+    asyncio.run(run_ble_manager())
 
-def stop_ble():
-    global _clients
-    print("BLE stopping...")
-    for client in _clients.values():
+async def _disconnect_all():
+    for client in list(_clients.values()):
         try:
             if client.is_connected:
-                asyncio.run(client.disconnect())
+                await client.disconnect()
                 print("Disconnected a client")
         except Exception as e:
-            print(f"Error disconnecting client: {e}")
\ No newline at end of file
+            print(f"Error disconnecting client: {e}")
+
+async def shutdown_ble():
+    # stop reconnecting and disconnect, called from inside the BLE event loop
+    global _stopping
+    _stopping = True
+    await _disconnect_all()
+
+def stop_ble():
+    global _stopping
+    print("BLE stopping...")
+    _stopping = True
+    # the clients belong to the BLE thread's event loop, disconnect them there
+    if _loop is not None and _loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_disconnect_all(), _loop).result(timeout=TIMEOUT)
+        except Exception as e:
+            print(f"Error disconnecting clients: {e}")
@@ -0,0 +1,76 @@
+import time
+
+# how much a value has to change before a new message is sent
+DEFAULT_DEADBANDS = {
+    "angle": 2.0,   # degrees
+    "gyro":  15.0,  # degrees per second
+    "co2":   50.0   # ppm
+}
+HEARTBEAT_INTERVAL = 30.0  # seconds, send a message at least this often
+
+
+class ChangeDetector:
+    # decides if a payload is worth publishing
+    # only sends when a field moved more than its deadband, the magnet flipped,
+    # a BLE device sent a new reading or the heartbeat is due
+    def __init__(self, deadbands=None, heartbeat=HEARTBEAT_INTERVAL):
+        self.deadbands = dict(DEFAULT_DEADBANDS)
+        if deadbands:
+            self.deadbands.update(deadbands)
+        self.heartbeat = heartbeat
+        self.last_payload = None
+        self.last_publish_time = None
+        self.last_seq = None
+
+    def _moved(self, field, old, new):
+        if old is None or new is None:
+            return old is not new
+        return abs(new - old) >= self.deadbands[field]
+
+    def change_reason(self, payload, now=None, seq=None):
+        # returns why the payload should be sent, or None if nothing changed
+        # seq = sequence number of the newest BLE reading (snapshot_store), if known
+        if now is None:
+            now = time.monotonic()
+
+        if self.last_payload is None:
+            return "first"
+
+        old_local = self.last_payload["local_data"]
+        new_local = payload["local_data"]
+        if new_local["magnet"] != old_local["magnet"]:
+            return "magnet"
+        for field in ("angle", "gyro"):
+            if self._moved(field, old_local[field], new_local[field]):
+                return field
+
+        if seq is not None and seq != self.last_seq:
+            return "ble_reading"
+
+        old_remote = self.last_payload["remote_data"]
+        for device, reading in payload["remote_data"].items():
+            old_reading = old_remote.get(device, {})
+            if seq is None and reading.get("timestamp") != old_reading.get("timestamp"):
+                return f"{device}_timestamp"
+            if self._moved("co2", old_reading.get("co2"), reading.get("co2")):
+                return f"{device}_co2"
+
+        if now - self.last_publish_time >= self.heartbeat:
+            return "heartbeat"
+        return None
+
+    def mark_published(self, payload, now=None, seq=None):
+        if now is None:
+            now = time.monotonic()
+        self.last_payload = payload
+        self.last_publish_time = now
+        self.last_seq = seq
+
+    def check(self, payload, now=None, seq=None):
+        # change_reason + mark_published in one step
+        if now is None:
+            now = time.monotonic()
+        reason = self.change_reason(payload, now, seq)
+        if reason:
+            self.mark_published(payload, now, seq)
+        return reason
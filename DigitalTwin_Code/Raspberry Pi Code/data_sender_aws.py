@@ -1,28 +1,201 @@
 import json
+import time
+import threading
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+from batch_codec import encode_batch
+from offline_buffer import OfflineBuffer
 
 class DataSender:
     def __init__(self, endpoint, root_ca, private_key, certificate,
-                 client_id="myClient", topic="my/topic"):
+                 client_id="myClient", topic="my/topic",
+                 batch_size=1, batch_interval_ms=None, compress=True, use_cbor=True,
+                 buffer_dir=None, drain_rate=20.0, priority_topic=None):
         self.topic = topic
+        # anomalies found on the gateway go here, not batched and not buffered (see publish_alert)
+        self.priority_topic = priority_topic or f"{topic}/anomalies"
         self.client = AWSIoTMQTTClient(client_id)
         self.client.configureEndpoint(endpoint, 8883)
         self.client.configureCredentials(root_ca, private_key, certificate)
 
         #  some settings
-        self.client.configureOfflinePublishQueueing(-1)
+        # with a buffer_dir the messages of offline phases go to disk (offline_buffer.py)
+        # instead of the unbounded in memory queue of the SDK
+        self.buffer = OfflineBuffer(buffer_dir) if buffer_dir else None
+        self.drain_rate = drain_rate
+        self.online = False
+        self._drain_thread = None
+        # the MQTT client is not thread safe: the drain thread, the gateway's publish executor
+        # and alerts all publish through _publish
+        self._publish_lock = threading.Lock()
+        if self.buffer is not None:
+            self.client.configureOfflinePublishQueueing(0)
+            self.client.onOnline = self._on_online
+            self.client.onOffline = self._on_offline
+        else:
+            self.client.configureOfflinePublishQueueing(-1)
         self.client.configureDrainingFrequency(2)
         self.client.configureConnectDisconnectTimeout(10)
         self.client.configureMQTTOperationTimeout(5)
-        self.client.connect()
-        
-        print(f"Connected to AWS")
+        self._connect()
+
+        # batching: batch_size=1 sends every sample on its own like before,
+        # otherwise samples are collected until batch_size or batch_interval_ms is reached
+        self.batch_size = batch_size
+        self.batch_interval_ms = batch_interval_ms
+        self.compress = compress
+        self.use_cbor = use_cbor
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_timer = None
+
+        print("Connected to AWS" if self.online else "Started without AWS connection")
+
+    def _connect(self):
+        if self.buffer is None:
+            self.client.connect()
+            self.online = True
+            return
+        try:
+            self.client.connect()
+            self.online = True
+            self._start_drain()
+        except Exception as e:
+            # no connection at boot, keep buffering and retry in the background
+            print(f"Could not connect to AWS, buffering to disk: {e}")
+            threading.Thread(target=self._reconnect_loop, daemon=True).start()
+
+    def _reconnect_loop(self):
+        delay = 5
+        while not self.online:
+            time.sleep(delay)
+            try:
+                self.client.connect()
+                self.online = True
+                self._start_drain()
+            except Exception:
+                delay = min(delay * 2, 300)
+
+    def _on_online(self):
+        print("AWS connection is back")
+        self.online = True
+        self._start_drain()
+
+    def _on_offline(self):
+        print("AWS connection lost, buffering to disk")
+        self.online = False
+
+    def _start_drain(self):
+        if self._drain_thread is not None and self._drain_thread.is_alive():
+            return
+        self._drain_thread = threading.Thread(target=self._drain, daemon=True)
+        self._drain_thread.start()
+
+    def _drain(self):
+        sent = self.buffer.drain(self._send_buffered, rate_per_second=self.drain_rate,
+                                 should_continue=lambda: self.online)
+        if sent:
+            print(f"Sent {sent} buffered messages")
+
+    def _publish(self, topic, msg, qos):
+        with self._publish_lock:
+            return self.client.publish(topic, msg, qos)
+
+    def _send_buffered(self, msg):
+        try:
+            return self._publish(self.topic, msg.decode(), 1) is not False
+        except Exception:
+            return False
+
+    def _send(self, msg, qos):
+        # everything goes through the disk buffer while offline or while older
+        # messages are still waiting, so the order is kept
+        if self.buffer is not None:
+            if not self.online or self.buffer.peek(1):
+                self.buffer.append(msg)
+                if self.online:
+                    self._start_drain()
+                return False
+            try:
+                if self._publish(self.topic, msg, qos) is False:
+                    raise RuntimeError("publish failed")
+            except Exception as e:
+                print(f"Publish failed, buffering to disk: {e}")
+                self.buffer.append(msg)
+                return False
+            return True
+        self._publish(self.topic, msg, qos)
+        return True
 
     def publish(self, data, qos=1):
+        if self.batch_size <= 1 and not self.batch_interval_ms:
+            msg = json.dumps(data)
+            if self._send(msg, qos):
+                print(f"Published {msg}")
+            return
+
+        with self._lock:
+            self._pending.append(data)
+            if len(self._pending) >= self.batch_size:
+                batch = self._take_pending()
+            else:
+                batch = None
+                if self.batch_interval_ms and self._flush_timer is None:
+                    self._flush_timer = threading.Timer(self.batch_interval_ms / 1000.0, self.flush, args=(qos,))
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+
+        if batch:
+            self.publish_batch(batch, qos)
+
+    def publish_alert(self, data, qos=1):
+        # alerts skip the batching and the disk buffer, an alert that arrives
+        # minutes later after a reconnect is not useful anymore
         msg = json.dumps(data)
-        self.client.publish(self.topic, msg, qos)
-        print(f"Published {msg}")
+        if not self.online and self.buffer is not None:
+            print(f"Offline, alert dropped: {msg}")
+            return
+        try:
+            self._publish(self.priority_topic, msg, qos)
+            print(f"Published alert {msg}")
+        except Exception as e:
+            print(f"Alert publish failed: {e}")
+
+    def _take_pending(self):
+        # must be called with self._lock held
+        batch = self._pending
+        self._pending = []
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        return batch
+
+    def publish_batch(self, batch, qos=1):
+        # one envelope for a list of payloads (see batch_codec.py)
+        start = time.perf_counter()
+        try:
+            msg = json.dumps(encode_batch(batch, compress=self.compress, use_cbor=self.use_cbor))
+        except Exception as e:
+            # the samples are already off the pending list, send them one by one instead
+            # (through the disk buffer while offline) so they are not lost
+            print(f"Could not encode batch of {len(batch)} samples, sending them one by one: {e}")
+            for data in batch:
+                self._send(json.dumps(data), qos)
+            return
+        if self._send(msg, qos):
+            took_ms = (time.perf_counter() - start) * 1000
+            print(f"Published batch of {len(batch)} samples ({len(msg)} bytes, {took_ms:.1f} ms)")
+
+    def flush(self, qos=1):
+        # send whatever is collected, called by the timer and on disconnect
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self.publish_batch(batch, qos)
 
     def disconnect(self):
+        self.flush()
+        self.online = False
+        if self.buffer is not None:
+            self.buffer.close()
         self.client.disconnect()
         print("Disconnected from AWS.")
@@ -0,0 +1,67 @@
+# Drift compensated door angle.
+# Pure gyro integration drifts because the gyro bias changes with temperature and time.
+# DoorFusion combines three corrections:
+#   - hall sensor anchor: while the magnet says "closed" the angle is pulled to 0
+#   - rest detection: while the gyro (and the accelerometer, if given) says the door
+#     does not move, the angle is not integrated and the gyro bias is re-estimated
+#   - complementary filter: the anchor is blended in with ANCHOR_GAIN per second so a
+#     short wrong magnet reading does not make the angle jump
+import math
+
+ANCHOR_GAIN = 5.0         # 1/s, how fast the angle is pulled to 0 while closed
+REST_RATE = 1.5           # degree/s, below this the door counts as not moving
+REST_SAMPLES = 40         # samples in a row below REST_RATE before the door is at rest
+BIAS_ALPHA = 0.01         # how fast the bias follows the gyro while at rest
+ACCEL_REST_G = 0.05       # g, allowed deviation of |accel| from 1 g while at rest
+
+
+class DoorFusion:
+    def __init__(self, bias=0.0, anchor_gain=ANCHOR_GAIN, rest_rate=REST_RATE,
+                 rest_samples=REST_SAMPLES, bias_alpha=BIAS_ALPHA):
+        self.angle = 0.0
+        self.bias = bias
+        self.rate = 0.0
+        self.anchor_gain = anchor_gain
+        self.rest_rate = rest_rate
+        self.rest_samples = rest_samples
+        self.bias_alpha = bias_alpha
+        self.still_count = 0
+        self.at_rest = False
+
+    def reset(self, angle=0.0):
+        self.angle = angle
+        self.still_count = 0
+
+    def _accel_still(self, accel):
+        # accel = (x, y, z) in g, a moving door adds some centripetal/tangential acceleration
+        magnitude = math.sqrt(accel[0] ** 2 + accel[1] ** 2 + accel[2] ** 2)
+        return abs(magnitude - 1.0) < ACCEL_REST_G
+
+    def update(self, rates, dt, closed=None, accels=None):
+        # rates: raw gyro Z samples in degree/s (offset not removed), dt per sample
+        # closed: hall sensor state for this batch (True/False/None = unknown)
+        # accels: optional list of (x, y, z) samples in g, same length as rates
+        for i, raw_rate in enumerate(rates):
+            rate = raw_rate - self.bias
+            still = abs(rate) < self.rest_rate
+            if accels is not None and still:
+                still = self._accel_still(accels[i])
+
+            if still:
+                self.still_count += 1
+            else:
+                self.still_count = 0
+            self.at_rest = self.still_count >= self.rest_samples
+
+            if self.at_rest:
+                # door does not move: everything the gyro measures is bias
+                self.bias += self.bias_alpha * (raw_rate - self.bias)
+                rate = 0.0
+            else:
+                self.angle += rate * dt
+
+            if closed:
+                self.angle -= self.angle * min(1.0, self.anchor_gain * dt)
+
+            self.rate = rate
+        return self.angle
@@ -0,0 +1,43 @@
+import time
+
+import anomaly_rules
+
+ALERT_COOLDOWN = 5.0   # seconds, the same anomaly type is not alerted again within this time
+CONFLICT_HOLD = 0.5    # seconds a magnet/angle conflict has to last, the angle lags behind the magnet
+
+
+class EdgeAnomalyMonitor:
+    # runs the DetectAnomalies rules (anomaly_rules.py) on the gateway at sample rate
+    # so a slam between two publishes is not missed and the alert does not wait for the step function
+    def __init__(self, cooldown=ALERT_COOLDOWN, conflict_hold=CONFLICT_HOLD):
+        self.cooldown = cooldown
+        self.conflict_hold = conflict_hold
+        self.last_alert = {}          # anomaly type -> monotonic time of the last alert
+        self.conflict_since = None
+
+    def _due(self, kind, now):
+        last = self.last_alert.get(kind)
+        if last is not None and now - last < self.cooldown:
+            return False
+        self.last_alert[kind] = now
+        return True
+
+    def check(self, angle, peak_gyro, magnet, now=None, timestamp=None):
+        # returns the list of (update, anomaly) to alert now, usually empty
+        # peak_gyro = largest |rate| since the last check, not only the newest sample
+        if now is None:
+            now = time.monotonic()
+        found = []
+
+        if anomaly_rules.is_slam(peak_gyro) and self._due("door_slam", now):
+            found.append(anomaly_rules.door_slam(peak_gyro, timestamp))
+
+        if anomaly_rules.is_sensor_conflict(magnet, angle):
+            if self.conflict_since is None:
+                self.conflict_since = now
+            if now - self.conflict_since >= self.conflict_hold and self._due("sensor_conflict", now):
+                found.append(anomaly_rules.sensor_conflict(magnet, angle, timestamp))
+        else:
+            self.conflict_since = None
+
+        return found
@@ -0,0 +1,86 @@
+# Minimal stand-in for RPi.GPIO so the hall sensor code runs on a normal Linux machine.
+# Only the functions used by magnetic_hall.py are implemented.
+# set_input(pin, level) changes a pin and fires the edge callbacks like the real library.
+import threading
+
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+_mode = None
+_levels = {}
+_callbacks = {}
+_lock = threading.Lock()
+
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(pin, direction, pull_up_down=PUD_OFF, initial=None):
+    with _lock:
+        if pin not in _levels:
+            _levels[pin] = initial if initial is not None else (HIGH if pull_up_down == PUD_UP else LOW)
+
+
+def input(pin):
+    return _levels.get(pin, LOW)
+
+
+def output(pin, level):
+    set_input(pin, level)
+
+
+def add_event_detect(pin, edge, callback=None, bouncetime=None):
+    with _lock:
+        _callbacks[pin] = (edge, [callback] if callback else [])
+
+
+def add_event_callback(pin, callback):
+    with _lock:
+        _callbacks[pin][1].append(callback)
+
+
+def remove_event_detect(pin):
+    with _lock:
+        _callbacks.pop(pin, None)
+
+
+def cleanup(pin=None):
+    global _mode
+    with _lock:
+        if pin is None:
+            _levels.clear()
+            _callbacks.clear()
+            _mode = None
+        else:
+            _levels.pop(pin, None)
+            _callbacks.pop(pin, None)
+
+
+def set_input(pin, level):
+    # simulate the pin changing, callbacks run in the calling thread
+    with _lock:
+        old = _levels.get(pin, LOW)
+        _levels[pin] = level
+        edge, callbacks = _callbacks.get(pin, (None, []))
+        callbacks = list(callbacks)
+    if old == level or edge is None:
+        return
+    if edge == BOTH or (edge == RISING and level == HIGH) or (edge == FALLING and level == LOW):
+        for callback in callbacks:
+            callback(pin)
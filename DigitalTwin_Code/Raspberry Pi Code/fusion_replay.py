@@ -0,0 +1,109 @@
+# Replay benchmark for door_fusion.py
+# Replays a gyro trace through plain integration (what accelerometer.py did before) and
+# through DoorFusion and reports the angle error and the drift per hour.
+#
+#   python3 fusion_replay.py                 synthetic 1 hour trace
+#   python3 fusion_replay.py trace.csv       recorded trace
+#
+# CSV columns: time (s), gyro_z (raw degree/s, offset not removed), magnet (0/1), angle (optional, true angle)
+# Without a true angle column the error is measured while the magnet says closed (true angle = 0).
+import sys
+import csv
+import math
+import random
+
+from door_fusion import DoorFusion
+
+SAMPLE_RATE_HZ = 200
+CALIBRATION_SECONDS = 2.0
+
+
+def synthetic_trace(hours=1.0, rate_hz=SAMPLE_RATE_HZ, seed=1):
+    # door that opens every 1-3 minutes, sometimes slams, with a gyro bias that wanders
+    rng = random.Random(seed)
+    dt = 1.0 / rate_hz
+    samples = int(hours * 3600 * rate_hz)
+    bias = 0.4
+    angle = 0.0
+    plan = []  # list of (target angle, speed degree/s, hold seconds)
+    hold = 5.0
+    target, speed = 0.0, 0.0
+    trace = []
+    for i in range(samples):
+        t = i * dt
+        bias += rng.gauss(0, 0.0004) + 0.3 / (3600 * rate_hz)   # random walk + temperature drift
+        if hold > 0:
+            hold -= dt
+            rate = 0.0
+        else:
+            if not plan:
+                opened = rng.uniform(45, 95)
+                plan = [(opened, rng.uniform(30, 80), rng.uniform(5, 30)),
+                        (0.0, rng.choice([40, 60, 140]), rng.uniform(60, 180))]
+            target, speed, next_hold = plan[0]
+            step = math.copysign(min(speed * dt, abs(target - angle)), target - angle)
+            rate = step / dt
+            angle += step
+            if abs(target - angle) < 1e-9:
+                plan.pop(0)
+                hold = next_hold
+        magnet = angle < 2.0
+        trace.append((t, rate + bias + rng.gauss(0, 0.05), magnet, angle))
+    return trace
+
+
+def load_trace(path):
+    trace = []
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            true_angle = float(row["angle"]) if row.get("angle") not in (None, "") else None
+            trace.append((float(row["time"]), float(row["gyro_z"]), row["magnet"] in ("1", "True", "true"), true_angle))
+    return trace
+
+
+def conflict(magnet, angle):
+    # same rule as DetectAnomalies sensor_conflict
+    return (magnet and (angle > 5 or angle < -5)) or (not magnet and -1 <= angle <= 1)
+
+
+def replay(trace, rate_hz=SAMPLE_RATE_HZ):
+    dt = 1.0 / rate_hz
+    calibration = [s[1] for s in trace[:int(CALIBRATION_SECONDS * rate_hz)]]
+    offset = sum(calibration) / len(calibration)
+
+    fusion = DoorFusion(bias=offset)
+    raw_angle = 0.0
+    results = {"integration": [], "fusion": []}
+    batch = int(0.05 * rate_hz)  # same 50 ms batches as accelerometer.py
+
+    for start in range(0, len(trace), batch):
+        chunk = trace[start:start + batch]
+        for _, gyro, _, _ in chunk:
+            raw_angle += (gyro - offset) * dt
+        fusion.update([s[1] for s in chunk], dt, closed=chunk[-1][2])
+        t, _, magnet, true_angle = chunk[-1]
+        reference = true_angle if true_angle is not None else (0.0 if magnet else None)
+        results["integration"].append((t, raw_angle, magnet, reference))
+        results["fusion"].append((t, fusion.angle, magnet, reference))
+    return results
+
+
+def report(results):
+    for name, rows in results.items():
+        errors = [angle - ref for _, angle, _, ref in rows if ref is not None]
+        hours = (rows[-1][0] - rows[0][0]) / 3600 or 1.0
+        rms = math.sqrt(sum(e * e for e in errors) / len(errors))
+        worst = max(abs(e) for e in errors)
+        final = errors[-1]
+        conflicts = sum(conflict(magnet, angle) for _, angle, magnet, _ in rows)
+        print(f"{name:12s} rms {rms:8.2f}°  max {worst:8.2f}°  final {final:8.2f}°  "
+              f"drift {abs(final) / hours:8.2f}°/h  false conflicts {conflicts}/{len(rows)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        trace = load_trace(sys.argv[1])
+    else:
+        print("Generating synthetic 1 hour trace...")
+        trace = synthetic_trace()
+    report(replay(trace))
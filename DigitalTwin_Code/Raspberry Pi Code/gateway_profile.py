@@ -0,0 +1,99 @@
+# Runs the whole gateway (gateway_runtime.py) on any Linux machine with the simulated
+# hardware (hardware.py) and reports the sample rate, what was published and the CPU use.
+#
+#   python3 gateway_profile.py --seconds 30
+#   python3 gateway_profile.py --seconds 30 --batch 10 --cprofile 15
+#
+# The simulated door, hall switch and ESP32s run in the same process, so their CPU time is
+# included (a small part, the door is integrated every 2 ms).
+# --cprofile profiles the event loop thread only, the smbus reads and publishing run in executor threads.
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+
+os.environ.setdefault("GATEWAY_HARDWARE", "sim")
+
+import accelerometer
+import gateway_runtime
+import hardware
+
+
+class CountingSender:
+    # stands in for DataSender, only counts
+    def __init__(self):
+        self.payloads = 0
+        self.batches = 0
+        self.alerts = []
+
+    def publish(self, payload):
+        self.payloads += 1
+
+    def publish_batch(self, payloads):
+        self.batches += 1
+        self.payloads += len(payloads)
+
+    def publish_alert(self, alert):
+        self.alerts.extend(anomaly["type"] for anomaly in alert["anomalies"])
+
+
+async def run_for(runtime, seconds):
+    task = asyncio.create_task(runtime.run())
+    # calibration (1000 gyro samples) is not part of the measurement
+    while runtime.sensor_ready is None or not runtime.sensor_ready.is_set():
+        await asyncio.sleep(0.05)
+    start = (time.perf_counter(), time.process_time(), accelerometer.samples_read)
+    await asyncio.sleep(seconds)
+    end = (time.perf_counter(), time.process_time(), accelerometer.samples_read)
+    runtime.stopping.set()
+    await task
+    return start, end
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=20.0, help="measured time after calibration")
+    parser.add_argument("--mode", choices=["change", "interval"], default="change")
+    parser.add_argument("--sample-interval", type=float, default=gateway_runtime.SAMPLE_INTERVAL)
+    parser.add_argument("--batch", type=int, default=1, help="payloads per publish")
+    parser.add_argument("--cprofile", type=int, default=0, help="print the N most expensive functions")
+    args = parser.parse_args()
+
+    sender = CountingSender()
+    runtime = gateway_runtime.GatewayRuntime(
+        sender.publish,
+        publish_batch=sender.publish_batch,
+        publish_alert=sender.publish_alert,
+        batch_size=args.batch,
+        publish_mode=args.mode,
+        sample_interval=args.sample_interval
+    )
+
+    profiler = None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start, end = asyncio.run(run_for(runtime, args.seconds))
+    if profiler:
+        profiler.disable()
+
+    wall = end[0] - start[0]
+    cpu = end[1] - start[1]
+    door = hardware.door_simulation()
+    print(f"hardware: {hardware.MODE}, measured {wall:.1f} s after calibration")
+    print(f"gyro samples: {(end[2] - start[2]) / wall:.1f}/s (configured {accelerometer.SAMPLE_RATE_HZ} Hz, "
+          f"FIFO {accelerometer.fifo_mode})")
+    print(f"payloads published: {sender.payloads} in {sender.batches} batches, alerts: {sender.alerts}, "
+          f"simulated slams: {door.slams}")
+    print(f"CPU: {cpu:.2f} s = {100 * cpu / wall:.1f}% of one core, "
+          f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    if profiler:
+        import pstats
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(args.cprofile)
+
+
+if __name__ == "__main__":
+    main()
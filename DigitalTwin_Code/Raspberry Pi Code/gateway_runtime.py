@@ -0,0 +1,242 @@
+# One asyncio event loop for the whole gateway.
+# Instead of a sensor thread, a BLE thread with its own loop and a blocking main loop,
+# everything runs as tasks in one loop:
+#   sensor     reads the MPU6050 FIFO (blocking smbus calls go to the executor) and checks the
+#              anomaly rules after every read (edge_anomalies.py), alerts go out right away
+#   ble        ble_receiver.run_ble_manager()
+#   sampler    builds the payload every SAMPLE_INTERVAL or right after a hall sensor edge
+#   publisher  takes payloads from a bounded queue, batches them and publishes in the executor
+# The queue gives backpressure: if publishing is slow the sampler waits instead of piling up messages.
+import time
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import accelerometer
+import ble_receiver
+from magnetic_hall import HallMonitor
+from change_detector import ChangeDetector
+from edge_anomalies import EdgeAnomalyMonitor
+
+SAMPLE_INTERVAL = 0.5  # seconds
+QUEUE_SIZE = 20
+
+
+def build_payload(magnet, ble_snapshot, timestamp=None):
+    # timestamp = wall clock time of the reading, default now (a hall edge passes the time of its first edge)
+    ########################### local sensors #########################################
+    sensor_data = accelerometer.read_acc()
+    if sensor_data:
+        angle = sensor_data["angle"]
+        gyro  = sensor_data["gyro"]
+    else:
+        angle = gyro = None
+
+    ########################### Timestamp and Payload #########################################
+    ts = time.time() if timestamp is None else timestamp
+    utc = time.gmtime(ts)
+    ms  = int((ts - int(ts)) * 1000)
+    door_timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", utc) + f".{ms:03d}Z"
+    local_data = {"door_timestamp": door_timestamp,
+                  "angle": angle,
+                  "gyro": gyro,
+                  "magnet": bool(magnet)}
+
+    return {
+        "local_data":  local_data,
+        "remote_data": ble_receiver.get_remote_data(ble_snapshot)
+    }
+
+
+class GatewayRuntime:
+    def __init__(self, publish, publish_batch=None, batch_size=1, batch_interval=1.0,
+                 publish_mode="change", sample_interval=SAMPLE_INTERVAL, publish_alert=None):
+        # publish(payload), publish_batch(list of payloads) and publish_alert(alert) are blocking sender calls
+        self.publish = publish
+        self.publish_batch = publish_batch
+        self.publish_alert = publish_alert
+        self.anomalies = EdgeAnomalyMonitor() if publish_alert else None
+        self.batch_size = batch_size if publish_batch else 1
+        self.batch_interval = batch_interval
+        self.detector = ChangeDetector() if publish_mode == "change" else None
+        self.sample_interval = sample_interval
+        # publishing uses its own single thread, alerts another one so they never wait behind
+        # a slow batch publish or offline buffer write (DataSender serializes the MQTT calls itself)
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish")
+        self.alert_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alert")
+        self.queue = None
+        self.batch = []   # payloads the publisher took from the queue and waits to send with more
+        self.wake_up = None
+        self.sensor_ready = None
+        self.stopping = None
+        self.hall = None
+        self.hall_event = None   # last hall sensor change the sampler did not publish yet
+        self.last_sample_time = 0.0
+
+    # ------------------------------------------------------------------ tasks
+    async def sensor_task(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, accelerometer.setup_sensor)
+        accelerometer.reset_angle()
+        self.sensor_ready.set()
+        interval = accelerometer.poll_interval()
+        next_poll = loop.time()
+        while True:
+            await loop.run_in_executor(None, accelerometer.poll_sensor)
+            if self.anomalies and accelerometer.mpu_available:
+                self.check_anomalies()
+            next_poll += interval
+            delay = next_poll - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_poll = loop.time()
+
+    def check_anomalies(self):
+        sensor_data = accelerometer.read_acc()
+        found = self.anomalies.check(sensor_data["angle"], accelerometer.take_peak_gyro(), self.hall.magnet)
+        if not found:
+            return
+        # same shape as the DetectAnomalies output, so an IoT rule can hand it to Notification
+        alert = {
+            "anomalyUpdates": [update for update, anomaly in found],
+            "anomalies": [anomaly for update, anomaly in found],
+            "local_data": {"angle": sensor_data["angle"], "gyro": sensor_data["gyro"],
+                           "magnet": bool(self.hall.magnet)}
+        }
+        print(f"Anomaly on the gateway: {[anomaly['type'] for update, anomaly in found]}")
+        asyncio.get_running_loop().run_in_executor(self.alert_executor, self._send_alert, alert)
+        self.wake_up.set()  # also publish the current state right away
+
+    def _send_alert(self, alert):
+        try:
+            self.publish_alert(alert)
+        except Exception as e:
+            print(f"Alert publishing failed: {e}")
+
+    async def sampler_task(self):
+        await self.sensor_ready.wait()  # calibration takes a few seconds, BLE connects meanwhile
+        while True:
+            self.wake_up.clear()
+            ble_snapshot = ble_receiver.store.snapshot()
+            ble_seq = max((reading.seq for reading in ble_snapshot.values()), default=0)
+            # right after a hall edge the payload carries the time of the transition, not of the wake up.
+            # A sample taken while the edge was debounced can be newer, the twin would then skip the
+            # transition as out of order, so the time never goes back
+            hall_event, self.hall_event = self.hall_event, None
+            if hall_event:
+                timestamp = max(hall_event["time"], self.last_sample_time + 0.001)
+                payload = build_payload(hall_event["magnet"], ble_snapshot, timestamp=timestamp)
+            else:
+                timestamp = time.time()
+                payload = build_payload(self.hall.magnet, ble_snapshot, timestamp=timestamp)
+            self.last_sample_time = timestamp
+
+            reason = self.detector.check(payload, seq=ble_seq) if self.detector else "interval"
+            if reason:
+                print(f"Queued payload ({reason}): {payload}")
+                await self.queue.put(payload)  # waits while the publisher is behind
+
+            try:
+                await asyncio.wait_for(self.wake_up.wait(), timeout=self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def publisher_task(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # the batch is kept on self while it fills, so shutdown() can still send it
+            self.batch.append(await self.queue.get())
+            if self.batch_size > 1:
+                deadline = loop.time() + self.batch_interval
+                while len(self.batch) < self.batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        self.batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                    except asyncio.TimeoutError:
+                        break
+            batch, self.batch = self.batch, []
+            await self._send(batch)
+
+    async def _send(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            if len(batch) > 1:
+                await loop.run_in_executor(self.io_executor, self.publish_batch, batch)
+            else:
+                await loop.run_in_executor(self.io_executor, self.publish, batch[0])
+        except Exception as e:
+            print(f"Publishing failed: {e}")
+
+    # ------------------------------------------------------------------ run
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.wake_up = asyncio.Event()
+        self.sensor_ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        # GPIO callbacks come from another thread, hand them to the loop
+        def on_hall_change(magnet, event):
+            accelerometer.set_door_closed(magnet)
+            loop.call_soon_threadsafe(self._hall_changed, event)
+
+        self.hall = HallMonitor(on_change=on_hall_change)
+        self.hall.start()
+        accelerometer.set_door_closed(self.hall.magnet)
+
+        tasks = [
+            asyncio.create_task(self._supervise("sensor", self.sensor_task())),
+            asyncio.create_task(self._supervise("ble", ble_receiver.run_ble_manager())),
+            asyncio.create_task(self._supervise("sampler", self.sampler_task())),
+            asyncio.create_task(self._supervise("publisher", self.publisher_task())),
+        ]
+        await self.stopping.wait()
+
+        print("Stopping gateway")
+        await self.shutdown(tasks)
+
+    def _hall_changed(self, event):
+        self.hall_event = event
+        self.wake_up.set()
+
+    async def _supervise(self, name, coro):
+        # a failing task (e.g. no BLE adapter) is logged but does not stop the others
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Task {name} failed: {e}")
+
+    async def shutdown(self, tasks):
+        # disconnect BLE first so the connection tasks do not try to reconnect
+        await ble_receiver.shutdown_ble()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.hall.stop()
+
+        # publish the batch the publisher was filling and what is still queued before closing
+        pending, self.batch = self.batch, []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        if pending and self.batch_size > 1:
+            await self._send(pending)
+        else:
+            for payload in pending:
+                await self._send([payload])
+        self.io_executor.shutdown(wait=True)
+        self.alert_executor.shutdown(wait=True)
+        accelerometer.stop_sensor_thread()
+
+
+def run_gateway(publish, **options):
+    asyncio.run(GatewayRuntime(publish, **options).run())
@@ -0,0 +1,76 @@
+# Driver layer of the gateway: the real hardware or the simulated backends in sim_backends.py.
+#   GATEWAY_HARDWARE=auto  real driver if its library is installed, otherwise the simulation (default)
+#   GATEWAY_HARDWARE=real  smbus, RPi.GPIO and bleak only, a missing library is an error
+#   GATEWAY_HARDWARE=sim   always simulated, e.g. to profile the gateway on a laptop
+# Nothing is opened at import time, accelerometer.py, magnetic_hall.py and ble_receiver.py
+# ask for their driver when they start. In simulation the MPU6050 and the hall switch
+# see the same simulated door, which stays closed until sensor_calibrated() is called.
+import os
+import sys
+import importlib.util
+
+MODE = os.environ.get("GATEWAY_HARDWARE", "auto")
+
+_door = None
+_hall_switches = {}
+
+
+def simulated(library):
+    # True if the driver for `library` ("smbus", "RPi", "bleak") is simulated
+    if MODE == "sim":
+        return True
+    if MODE == "real":
+        return False
+    if library in sys.modules:
+        return False
+    return importlib.util.find_spec(library) is None
+
+
+def door_simulation():
+    global _door
+    if _door is None:
+        import sim_backends
+        _door = sim_backends.DoorSimulation()
+    return _door
+
+
+def sensor_calibrated():
+    # the gyro offset is known, the simulated door may move from now on
+    if _door is not None:
+        _door.release()
+
+
+def open_i2c(bus_number=1):
+    # smbus.SMBus or the simulated MPU6050
+    if simulated("smbus"):
+        import sim_backends
+        print("smbus not used, simulating the MPU6050")
+        return sim_backends.SimulatedMPU6050(door_simulation())
+    import smbus
+    return smbus.SMBus(bus_number)
+
+
+def gpio():
+    # RPi.GPIO or fake_gpio (same functions)
+    if simulated("RPi"):
+        import fake_gpio
+        return fake_gpio
+    import RPi.GPIO as GPIO
+    return GPIO
+
+
+def attach_hall_switch(gpio_module, pin):
+    # with fake_gpio the pin follows the simulated door, nothing to do on real hardware
+    if not hasattr(gpio_module, "set_input") or pin in _hall_switches:
+        return
+    import sim_backends
+    print("RPi.GPIO not used, simulating the hall switch")
+    switch = sim_backends.SimulatedHallSwitch(door_simulation(), gpio_module, pin)
+    switch.start()
+    _hall_switches[pin] = switch
+
+
+def detach_hall_switch(pin):
+    switch = _hall_switches.pop(pin, None)
+    if switch:
+        switch.stop()
@@ -1,24 +1,92 @@
-import RPi.GPIO as GPIO
 import time
+import threading
 
-HALL_SENSOR_PIN = 16 
+import hardware
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(HALL_SENSOR_PIN, GPIO.IN)
+HALL_SENSOR_PIN = 16
+DEBOUNCE_MS = 30  # the reed/hall signal has to be stable this long
 
-def read_hall_sensor():
+GPIO = None  # RPi.GPIO or fake_gpio, set up on first use (hardware.py)
+
+def setup_gpio(pin=HALL_SENSOR_PIN):
+    global GPIO
+    if GPIO is None:
+        GPIO = hardware.gpio()
+        GPIO.setmode(GPIO.BCM)
+    GPIO.setup(pin, GPIO.IN)
+    hardware.attach_hall_switch(GPIO, pin)
+    return GPIO
+
+def read_hall_sensor(pin=HALL_SENSOR_PIN):
     # true = magnet is found
-    return GPIO.input(HALL_SENSOR_PIN) == GPIO.LOW  
+    if GPIO is None:
+        setup_gpio(pin)
+    return GPIO.input(pin) == GPIO.LOW
+
+
+class HallMonitor:
+    # interrupt driven hall sensor
+    # every edge (re)starts a debounce timer, when the pin was stable for DEBOUNCE_MS
+    # the new state is taken and on_change(magnet, event) is called right away.
+    # event = {"magnet", "monotonic" (first edge, for durations), "time" (wall clock)}
+    def __init__(self, pin=HALL_SENSOR_PIN, debounce_ms=DEBOUNCE_MS, on_change=None):
+        self.pin = pin
+        self.debounce = debounce_ms / 1000.0
+        self.on_change = on_change
+        self.magnet = None
+        self.last_event = None
+        self._first_edge = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        setup_gpio(self.pin)
+        self.magnet = read_hall_sensor(self.pin)
+        GPIO.add_event_detect(self.pin, GPIO.BOTH, callback=self._edge)
+        print(f"Hall sensor interrupts started (magnet: {self.magnet})")
+
+    def stop(self):
+        GPIO.remove_event_detect(self.pin)
+        hardware.detach_hall_switch(self.pin)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _edge(self, channel):
+        # runs in the GPIO callback thread, keep it short
+        now = time.monotonic()
+        wall = time.time()
+        with self._lock:
+            if self._first_edge is None:
+                self._first_edge = (now, wall)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._settled)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _settled(self):
+        magnet = read_hall_sensor(self.pin)
+        with self._lock:
+            first_edge = self._first_edge
+            self._first_edge = None
+            self._timer = None
+            if magnet == self.magnet or first_edge is None:
+                return  # only bouncing, state did not change
+            self.magnet = magnet
+            self.last_event = {"magnet": magnet, "monotonic": first_edge[0], "time": first_edge[1]}
+            event = self.last_event
+        if self.on_change:
+            self.on_change(magnet, event)
 
 
 if __name__ == "__main__":
+    monitor = HallMonitor(on_change=lambda magnet, event: print("Magnet detected" if magnet else "No magnet"))
+    monitor.start()
     try:
         while True:
-            if read_hall_sensor():
-                print("Magnet detected")
-            else:
-                print("No magnet")
-            time.sleep(0.5)
+            time.sleep(1)
     except KeyboardInterrupt:
+        monitor.stop()
         GPIO.cleanup()
-
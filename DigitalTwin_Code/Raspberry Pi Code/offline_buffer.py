@@ -0,0 +1,254 @@
+# Persistent offline buffer for the gateway.
+# Messages that cannot be sent are appended to memory mapped segment files on disk
+# so a long outage does not grow the memory of the Pi and a reboot does not lose data.
+#
+# Layout of the buffer directory:
+#   segment-000001.buf, segment-000002.buf, ...   fixed size, preallocated
+#   cursor.json                                   {"segment": n, "offset": bytes already sent}
+# Every record is <length uint32><crc32 uint32><message bytes>, length 0 marks the end of a segment.
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SIZE = 1024 * 1024          # 1 MB per segment file
+MAX_SEGMENTS = 64                   # 64 MB on disk at most
+DROP_OLDEST = "drop_oldest"         # eviction: throw away the oldest segment when full
+DROP_NEWEST = "drop_newest"         # eviction: refuse new messages when full
+
+
+class OfflineBuffer:
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, max_segments=MAX_SEGMENTS,
+                 eviction=DROP_OLDEST):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.eviction = eviction
+        self.dropped = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments = sorted(
+            int(name[8:14]) for name in os.listdir(directory)
+            if name.startswith("segment-") and name.endswith(".buf")
+        )
+        self._read_segment, self._read_offset = self._load_cursor()
+
+        # open the newest segment for appending (or start a new one)
+        self._write_map = None
+        if self._segments:
+            self._open_for_write(self._segments[-1])
+            self._write_offset = self._find_end(self._write_map)
+        else:
+            self._new_segment()
+
+    # -------------------------------------------------------------- files
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:06d}.buf")
+
+    def _cursor_path(self):
+        return os.path.join(self.directory, "cursor.json")
+
+    def _load_cursor(self):
+        try:
+            with open(self._cursor_path()) as f:
+                cursor = json.load(f)
+            if cursor["segment"] in self._segments:
+                return cursor["segment"], cursor["offset"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return (self._segments[0] if self._segments else 1), 0
+
+    def _save_cursor(self):
+        tmp_path = self._cursor_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": self._read_segment, "offset": self._read_offset}, f)
+        os.replace(tmp_path, self._cursor_path())
+
+    def _open_map(self, number):
+        with open(self._segment_path(number), "r+b") as f:
+            return mmap.mmap(f.fileno(), self.segment_size)
+
+    def _open_for_write(self, number):
+        if self._write_map is not None:
+            self._write_map.flush()
+            self._write_map.close()
+        self._write_segment = number
+        self._write_map = self._open_map(number)
+
+    def _new_segment(self):
+        number = self._segments[-1] + 1 if self._segments else 1
+        with open(self._segment_path(number), "wb") as f:
+            f.truncate(self.segment_size)
+        self._segments.append(number)
+        self._open_for_write(number)
+        self._write_offset = 0
+
+    def _find_end(self, segment_map):
+        # walk the records until the first empty or broken one
+        offset = 0
+        while offset + RECORD_HEADER.size <= self.segment_size:
+            length, crc = RECORD_HEADER.unpack_from(segment_map, offset)
+            end = offset + RECORD_HEADER.size + length
+            if length == 0 or end > self.segment_size:
+                break
+            if zlib.crc32(segment_map[offset + RECORD_HEADER.size:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    def _delete_segment(self, number):
+        self._segments.remove(number)
+        try:
+            os.remove(self._segment_path(number))
+        except OSError:
+            pass
+
+    # -------------------------------------------------------------- public
+    def append(self, message):
+        # message is a str or bytes, returns False if it was dropped
+        data = message.encode() if isinstance(message, str) else message
+        needed = RECORD_HEADER.size + len(data)
+        if needed > self.segment_size:
+            raise ValueError("Message is bigger than a buffer segment")
+
+        with self._lock:
+            if self._write_offset + needed > self.segment_size:
+                if len(self._segments) >= self.max_segments:
+                    if self.eviction == DROP_NEWEST:
+                        self.dropped += 1
+                        return False
+                    self._evict_oldest()
+                self._new_segment()
+
+            RECORD_HEADER.pack_into(self._write_map, self._write_offset, len(data), zlib.crc32(data))
+            start = self._write_offset + RECORD_HEADER.size
+            self._write_map[start:start + len(data)] = data
+            self._write_offset += needed
+            return True
+
+    def _evict_oldest(self):
+        oldest = self._segments[0]
+        if oldest == self._write_segment:
+            return
+        lost = len(self._records_in(oldest, 0 if oldest != self._read_segment else self._read_offset))
+        self.dropped += lost
+        self._delete_segment(oldest)
+        if self._read_segment == oldest:
+            self._read_segment, self._read_offset = self._segments[0], 0
+            self._save_cursor()
+        print(f"[OfflineBuffer] Buffer full, dropped {lost} oldest messages")
+
+    def _records_in(self, number, offset, limit=None):
+        # returns [(end_offset, bytes), ...] starting at offset
+        if number == self._write_segment:
+            segment_map, end = self._write_map, self._write_offset
+        else:
+            segment_map, end = self._open_map(number), self.segment_size
+        records = []
+        try:
+            while offset + RECORD_HEADER.size <= end and (limit is None or len(records) < limit):
+                length, crc = RECORD_HEADER.unpack_from(segment_map, offset)
+                record_end = offset + RECORD_HEADER.size + length
+                if length == 0 or record_end > end:
+                    break
+                data = bytes(segment_map[offset + RECORD_HEADER.size:record_end])
+                offset = record_end
+                if zlib.crc32(data) != crc:
+                    break
+                records.append((offset, data))
+        finally:
+            if segment_map is not self._write_map:
+                segment_map.close()
+        return records
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(self._records_in(n, self._read_offset if n == self._read_segment else 0))
+                       for n in self._segments if n >= self._read_segment)
+
+    def peek(self, limit):
+        # oldest unsent messages, at most limit
+        return self.take(limit)[1]
+
+    def take(self, limit):
+        # (token, oldest unsent messages), pass the token to commit() after sending them
+        with self._lock:
+            token = (self._read_segment, self._read_offset)
+            messages = []
+            for number in self._segments:
+                if number < self._read_segment:
+                    continue
+                offset = self._read_offset if number == self._read_segment else 0
+                for _, data in self._records_in(number, offset, limit - len(messages)):
+                    messages.append(data)
+                if len(messages) >= limit:
+                    break
+            return token, messages
+
+    def commit(self, count, token=None):
+        # mark the first count messages from take() as sent. Returns False and keeps the cursor if
+        # the oldest segment was evicted since (the cursor moved), the messages would be skipped otherwise
+        with self._lock:
+            if token is not None and token != (self._read_segment, self._read_offset):
+                return False
+            while count > 0:
+                records = self._records_in(self._read_segment, self._read_offset, count)
+                if records:
+                    self._read_offset = records[-1][0]
+                    count -= len(records)
+                if count > 0 or self._read_offset >= self._segment_end(self._read_segment):
+                    if self._read_segment == self._write_segment:
+                        break
+                    # segment fully sent, remove it and continue with the next one
+                    finished = self._read_segment
+                    self._read_segment = self._segments[self._segments.index(finished) + 1]
+                    self._read_offset = 0
+                    self._delete_segment(finished)
+            self._save_cursor()
+            return True
+
+    def _segment_end(self, number):
+        if number == self._write_segment:
+            return self._write_offset
+        return self.segment_size
+
+    def drain(self, send, batch_size=50, rate_per_second=20.0, should_continue=None):
+        # send the buffered messages oldest first, at most rate_per_second
+        # send(message_bytes) must raise or return False if the message did not go out
+        sent = 0
+        while should_continue is None or should_continue():
+            token, messages = self.take(batch_size)
+            if not messages:
+                break
+            start = time.monotonic()
+            done = 0
+            for message in messages:
+                if send(message) is False:
+                    break
+                done += 1
+            if not self.commit(done, token):
+                # the buffer was full and dropped the oldest segment while sending, start again
+                # from the new cursor (messages sent from a later segment may go out twice)
+                sent += done
+                continue
+            sent += done
+            if done < len(messages):
+                break
+            # rate limit so the broker and the uplink are not flooded after an outage
+            wait = done / rate_per_second - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+        return sent
+
+    def close(self):
+        with self._lock:
+            if self._write_map is not None:
+                self._write_map.flush()
+                self._write_map.close()
+                self._write_map = None
+            self._save_cursor()
@@ -0,0 +1,293 @@
+# Simulated hardware for running the gateway without a Raspberry Pi (see hardware.py).
+#   DoorSimulation     door physics: a person opens the door, the door closer pulls it shut,
+#                      sometimes it is slammed and bounces off the frame. Nobody touches the door
+#                      before release(), i.e. while the gyro is calibrated
+#   SimulatedMPU6050   smbus stand-in with the MPU6050 registers accelerometer.py uses,
+#                      the FIFO fills with gyro Z samples of the simulated door at the configured rate
+#   SimulatedHallSwitch  drives the hall sensor pin of fake_gpio from the door angle (with contact bounce)
+#   RoomSimulation     CO2, motion, temperature, humidity and light of a room with people coming and going
+#   run_ble_devices    ESP32 nodes that send the binary BLE payload (ble_payload.py) every few seconds
+# Everything follows time.monotonic(), so the sample rates are the real ones.
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+import ble_payload
+
+# door
+MAX_ANGLE = 100.0          # degree, the door stop
+OPEN_SPEED = 60.0          # degree/s of a person opening the door
+CLOSER_STIFFNESS = 1.5     # 1/s^2, door closer spring
+CLOSER_DAMPING = 2.2       # 1/s, door closer damper (slightly under critical)
+RESTITUTION = 0.25         # share of the speed left after hitting the frame
+SLAM_SPEED = (150.0, 240.0)  # degree/s towards the frame
+MAGNET_ANGLE = 2.0         # degree, below this the magnet is at the hall sensor
+STEP = 0.002               # s, integration step
+HISTORY = 2.0              # s of gyro rates kept for sensors that read later (FIFO)
+
+# MPU6050 registers (same as accelerometer.py)
+MPU_ADDRESS = 0x68
+SMPLRT_DIV = 0x19
+INT_STATUS = 0x3A
+GYRO_ZOUT_H = 0x47
+USER_CTRL = 0x6A
+FIFO_COUNT_H = 0x72
+FIFO_R_W = 0x74
+WHO_AM_I = 0x75
+GYRO_SCALE = 131.0
+FIFO_SIZE = 1024
+
+# rooms
+OUTDOOR_CO2 = 420.0        # ppm
+CO2_PER_PERSON = 0.9       # ppm/s a person adds to a small room
+VENTILATION = 0.002        # 1/s air exchange
+DEVICE_INTERVAL = 2.0      # s between two notifications of an ESP32
+
+
+class DoorSimulation:
+    def __init__(self, seed=1, slam_probability=0.15, clock=time.monotonic):
+        self.rng = random.Random(seed)
+        self.slam_probability = slam_probability
+        self.clock = clock
+        self.angle = 0.0
+        self.rate = 0.0
+        self.phase = "closed"
+        self.target = 0.0
+        self.phase_end = None   # set by release()
+        self.time = clock()
+        self.slams = 0
+        self.history = deque(maxlen=int(HISTORY / STEP))   # rate of every step up to self.time
+        self._lock = threading.Lock()
+
+    def _next_phase(self):
+        if self.phase == "closed":
+            self.phase = "opening"
+            self.target = self.rng.uniform(45, 95)
+        elif self.phase == "opening":
+            self.phase = "open"
+            self.phase_end = self.time + self.rng.uniform(3, 20)
+        elif self.phase == "open":
+            self.phase = "closing"
+            if self.rng.random() < self.slam_probability:
+                self.rate = -self.rng.uniform(*SLAM_SPEED)
+                self.slams += 1
+
+    def _step(self, dt):
+        if self.phase == "closed" and self.phase_end is not None and self.time >= self.phase_end:
+            self._next_phase()
+        if self.phase == "opening":
+            self.rate = OPEN_SPEED if self.angle < self.target else 0.0
+            if self.angle >= self.target:
+                self._next_phase()
+        elif self.phase == "open":
+            self.rate = 0.0
+            if self.time >= self.phase_end:
+                self._next_phase()
+        elif self.phase == "closing":
+            self.rate += (-CLOSER_STIFFNESS * self.angle - CLOSER_DAMPING * self.rate) * dt
+            if self.angle < 0.05 and abs(self.rate) < 0.5:
+                self.rate = -1.0   # the latch pulls it in
+
+        self.angle += self.rate * dt
+        if self.angle <= 0.0 and self.rate < 0:
+            # hits the frame, a fast door bounces back a little
+            self.angle = 0.0
+            self.rate = -self.rate * RESTITUTION if self.rate < -30 else 0.0
+            if self.rate == 0.0:
+                self.phase = "closed"
+                self.phase_end = self.time + self.rng.uniform(5, 60)
+        self.angle = min(self.angle, MAX_ANGLE)
+        self.time += dt
+        self.history.append(self.rate)
+
+    def advance(self, until=None):
+        # moves the door to `until` (default now), returns (angle, rate)
+        until = self.clock() if until is None else until
+        with self._lock:
+            while self.time + STEP <= until:
+                self._step(STEP)
+            return self.angle, self.rate
+
+    def release(self):
+        # the first opening a few seconds from now
+        with self._lock:
+            if self.phase_end is None:
+                self.phase_end = max(self.time, self.clock()) + self.rng.uniform(3, 10)
+
+    def samples(self, start, rate_hz, count):
+        # gyro rates at start, start + 1/rate_hz, ... The hall switch may have moved the door
+        # further already, so the rates come from the history
+        self.advance(start + (count - 1) / rate_hz)
+        with self._lock:
+            rates = []
+            for i in range(count):
+                back = int((self.time - (start + i / rate_hz)) / STEP)
+                if not self.history:
+                    rates.append(self.rate)
+                else:
+                    rates.append(self.history[max(0, len(self.history) - 1 - back)])
+            return rates
+
+    def magnet(self):
+        return self.advance()[0] < MAGNET_ANGLE
+
+
+class SimulatedMPU6050:
+    # the registers and FIFO behaviour accelerometer.py relies on: Z gyro only, big endian,
+    # overflow flag in INT_STATUS when the FIFO was not read in time
+    def __init__(self, door, bias=0.6, noise=0.05, seed=2):
+        self.door = door
+        self.bias = bias
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.registers = {WHO_AM_I: MPU_ADDRESS, SMPLRT_DIV: 0}
+        self.fifo = bytearray()
+        self.fifo_enabled = False
+        self.overflow = False
+        self.next_sample = None
+        self._lock = threading.Lock()
+
+    def _raw(self, rate):
+        value = int(round((rate + self.bias + self.rng.gauss(0, self.noise)) * GYRO_SCALE))
+        return max(-32768, min(32767, value))
+
+    def _sample_rate(self):
+        return 1000.0 / (self.registers.get(SMPLRT_DIV, 0) + 1)
+
+    def _fill(self):
+        # samples the gyro would have written since the last read
+        now = self.door.clock()
+        if not self.fifo_enabled:
+            return
+        rate_hz = self._sample_rate()
+        if self.next_sample is None:
+            self.next_sample = now
+        count = int((now - self.next_sample) * rate_hz)
+        if count <= 0:
+            return
+        for rate in self.door.samples(self.next_sample, rate_hz, count):
+            if len(self.fifo) + 2 > FIFO_SIZE:
+                self.overflow = True
+                break
+            self.fifo.extend(self._raw(rate).to_bytes(2, "big", signed=True))
+        self.next_sample += count / rate_hz
+
+    def write_byte_data(self, address, register, value):
+        with self._lock:
+            self.registers[register] = value
+            if register == USER_CTRL:
+                if value & 0x04:
+                    self.fifo.clear()
+                    self.overflow = False
+                    self.next_sample = None
+                self.fifo_enabled = bool(value & 0x40)
+
+    def read_byte_data(self, address, register):
+        with self._lock:
+            if register == INT_STATUS:
+                self._fill()
+                return 0x10 if self.overflow else 0x00
+            return self.registers.get(register, 0)
+
+    def read_i2c_block_data(self, address, register, length):
+        with self._lock:
+            if register == FIFO_COUNT_H:
+                self._fill()
+                count = FIFO_SIZE if self.overflow else len(self.fifo)
+                return [count >> 8, count & 0xFF]
+            if register == FIFO_R_W:
+                data = self.fifo[:length]
+                del self.fifo[:length]
+                return list(data)
+            if register == GYRO_ZOUT_H:
+                raw = self._raw(self.door.advance()[1]) & 0xFFFF
+                return [raw >> 8, raw & 0xFF]
+            return [0] * length
+
+
+class SimulatedHallSwitch:
+    # sets the pin LOW while the magnet is at the sensor (like the real hall switch),
+    # every change bounces a few times within a couple of milliseconds
+    def __init__(self, door, gpio, pin, poll_interval=0.005, bounces=3, seed=3):
+        self.door = door
+        self.gpio = gpio
+        self.pin = pin
+        self.poll_interval = poll_interval
+        self.bounces = bounces
+        self.rng = random.Random(seed)
+        self.running = False
+        self.thread = None
+
+    def _level(self, magnet):
+        return self.gpio.LOW if magnet else self.gpio.HIGH
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.gpio.set_input(self.pin, self._level(self.door.magnet()))
+        self.thread = threading.Thread(target=self._run, daemon=True, name="hall-sim")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        magnet = self.door.magnet()
+        while self.running:
+            time.sleep(self.poll_interval)
+            now_magnet = self.door.magnet()
+            if now_magnet == magnet:
+                continue
+            for _ in range(self.rng.randint(0, self.bounces)):
+                self.gpio.set_input(self.pin, self._level(now_magnet))
+                time.sleep(self.rng.uniform(0.0002, 0.002))
+                self.gpio.set_input(self.pin, self._level(magnet))
+            self.gpio.set_input(self.pin, self._level(now_magnet))
+            magnet = now_magnet
+
+
+class RoomSimulation:
+    def __init__(self, seed=1):
+        self.rng = random.Random(seed)
+        self.people = 0
+        self.co2 = self.rng.uniform(450, 650)
+        self.temperature = self.rng.uniform(20.0, 22.5)
+        self.humidity = self.rng.uniform(35.0, 50.0)
+
+    def step(self, dt):
+        # people come and go about every few minutes, returns the reading as a dict
+        if self.rng.random() < dt / 180.0:
+            self.people = max(0, self.people + self.rng.choice((-1, 1)))
+        self.co2 += (self.people * CO2_PER_PERSON - VENTILATION * (self.co2 - OUTDOOR_CO2)) * dt
+        self.co2 += self.rng.gauss(0, 3)
+        self.temperature += (0.0005 * self.people - 0.0002) * dt + self.rng.gauss(0, 0.01)
+        self.humidity += self.rng.gauss(0, 0.05)
+        return {
+            "temperature": round(self.temperature, 2),
+            "humidity": round(self.humidity, 2),
+            "light": round(self.rng.uniform(250, 450), 1) if self.people else round(self.rng.uniform(0, 15), 1),
+            "motion": self.people > 0 and self.rng.random() < 0.4,
+            "co2": max(OUTDOOR_CO2, self.co2)
+        }
+
+
+async def run_ble_devices(devices, notification_handler, stopping, interval=DEVICE_INTERVAL):
+    # one simulated ESP32 per configured device, notifications go through the normal
+    # handler (binary payload -> ble_payload.decode -> snapshot store)
+    async def device_loop(index, device):
+        room = RoomSimulation(seed=index + 1)
+        handler = notification_handler(device)
+        await asyncio.sleep(random.Random(index).uniform(0, interval))
+        print(f"[BLE Receiver] Simulated {device['name']}")
+        while not stopping():
+            reading = room.step(interval)
+            now = time.time()
+            handler(None, ble_payload.encode_binary(
+                reading["temperature"], reading["humidity"], reading["light"], reading["motion"],
+                reading["co2"], int(now), int((now - int(now)) * 1000)))
+            await asyncio.sleep(interval)
+
+    await asyncio.gather(*[device_loop(i, device) for i, device in enumerate(devices)])
@@ -0,0 +1,57 @@
+# Latest reading per BLE device, shared between the BLE thread (writer) and main (reader).
+# Every notification creates a new immutable Reading and swaps it in with a single
+# reference assignment, the mapping itself is copy-on-write. A reader therefore always
+# sees complete readings (co2 and timestamp from the same notification) without locks
+# and without copying anything.
+import time
+import itertools
+from types import MappingProxyType
+
+READING_FIELDS = ("temperature", "humidity", "light", "motion", "co2", "timestamp")
+
+
+class Reading:
+    __slots__ = READING_FIELDS + ("seq", "received")
+
+    def __init__(self, seq, received, **fields):
+        for name in READING_FIELDS:
+            object.__setattr__(self, name, fields.get(name))
+        object.__setattr__(self, "seq", seq)
+        object.__setattr__(self, "received", received)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Reading is immutable")
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in READING_FIELDS}
+
+    def __repr__(self):
+        return f"Reading(seq={self.seq}, {self.as_dict()})"
+
+
+class SnapshotStore:
+    def __init__(self):
+        self._records = MappingProxyType({})
+        self._counter = itertools.count(1)
+        self.seq = 0  # sequence number of the newest reading of any device
+
+    def publish(self, key, **fields):
+        # only one writer (the BLE event loop), so copy-on-write needs no lock
+        reading = Reading(next(self._counter), time.monotonic(), **fields)
+        records = dict(self._records)
+        records[key] = reading
+        self._records = MappingProxyType(records)
+        self.seq = reading.seq
+        return reading
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def snapshot(self):
+        # read-only view of {key: Reading}, stays consistent while the writer goes on
+        return self._records
+
+    def is_fresh(self, key, last_seq):
+        # True if the device sent something after the reading with last_seq
+        reading = self._records.get(key)
+        return reading is not None and reading.seq > last_seq